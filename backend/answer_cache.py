@@ -0,0 +1,127 @@
+"""
+一括質問の回答キャッシュ（SQLite）
+キー: (正規化した質問, ペルソナID, モデル名, プロンプトバージョン)
+- プロンプトバージョンはシステムプロンプト本文のハッシュ。ペルソナやテンプレートが変われば自然に別キーになる
+- ANSWER_CACHE_TTL 秒を過ぎた回答は使わない（起動後の初回アクセス時に削除）
+- SQLite の読み書きはイベントループを止めるので、一括質問からは get_many_async / store（スレッドで実行）を使う。
+  store は書き込み中に来た回答を次の1回にまとめ、1トランザクション（commit 1回）で書く
+"""
+import asyncio, os, re, sqlite3, threading, time, unicodedata
+from metrics import CACHE_REQUESTS
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "data", "answer_cache.sqlite3")
+
+def normalize_question(question: str) -> str:
+    """全角/半角・大文字/小文字・空白の揺れを吸収する"""
+    q = unicodedata.normalize("NFKC", question).strip().lower()
+    return re.sub(r"\s+", " ", q)
+
+class AnswerCache:
+    TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL", str(7 * 86400)))
+    # SQLite のプレースホルダ上限に収まるよう分割して問い合わせる
+    _CHUNK = 500
+
+    def __init__(self, path: str, ttl_seconds: int | None = None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else self.TTL_SECONDS
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        # store で書き込み待ちの行（_pending_lock はリストの入れ替えだけに使う）
+        self._pending: list[tuple] = []
+        self._pending_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    question TEXT NOT NULL,
+                    persona_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (question, persona_id, model, prompt_version)
+                )
+            """)
+            conn.execute("DELETE FROM answers WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, question: str, model: str, versions: dict[str, str]) -> dict[str, str]:
+        """versions: ペルソナID → プロンプトバージョン。有効期限内の回答を ペルソナID → 回答 で返す"""
+        q = normalize_question(question)
+        cutoff = time.time() - self.ttl_seconds
+        ids = list(versions)
+        found: dict[str, str] = {}
+        with self._lock:
+            conn = self._connect()
+            for i in range(0, len(ids), self._CHUNK):
+                chunk = ids[i:i + self._CHUNK]
+                rows = conn.execute(
+                    f"SELECT persona_id, prompt_version, answer FROM answers "
+                    f"WHERE question = ? AND model = ? AND created_at >= ? "
+                    f"AND persona_id IN ({','.join('?' * len(chunk))})",
+                    (q, model, cutoff, *chunk),
+                ).fetchall()
+                for persona_id, version, answer in rows:
+                    if versions.get(persona_id) == version:
+                        found[persona_id] = answer
+        self.hits += len(found)
+        self.misses += len(ids) - len(found)
+        CACHE_REQUESTS.inc(len(found), cache="answer", result="hit")
+        CACHE_REQUESTS.inc(len(ids) - len(found), cache="answer", result="miss")
+        return found
+
+    async def get_many_async(self, question: str, model: str, versions: dict[str, str]) -> dict[str, str]:
+        return await asyncio.to_thread(self.get_many, question, model, versions)
+
+    def put(self, question: str, persona_id: str, model: str, prompt_version: str, answer: str):
+        self.put_many([(question, persona_id, model, prompt_version, answer)])
+
+    def put_many(self, rows: list[tuple[str, str, str, str, str]]):
+        """(質問, ペルソナID, モデル名, プロンプトバージョン, 回答) をまとめて1トランザクションで書く"""
+        if not rows:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                [(normalize_question(q), pid, model, version, answer, now) for q, pid, model, version, answer in rows],
+            )
+            conn.commit()
+
+    def _flush(self):
+        with self._pending_lock:
+            rows, self._pending = self._pending, []
+        self.put_many(rows)
+
+    async def store(self, rows: list[tuple[str, str, str, str, str]]):
+        """
+        イベントループから回答を保存する。書き込みはスレッドで行い、
+        先に走っている書き込みがあれば、その間にたまった行は次の1回（commit 1回）にまとめて書く
+        """
+        if not rows:
+            return
+        with self._pending_lock:
+            self._pending.extend(rows)
+        await asyncio.to_thread(self._flush)
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def get_status(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+answer_cache = AnswerCache(os.getenv("ANSWER_CACHE_PATH") or DEFAULT_PATH)
@@ -0,0 +1,76 @@
+"""
+Gemini クライアント呼び出し方式のベンチマーク（ローカルの偽 generateContent エンドポイント相手）
+  thread: 同期API を asyncio.to_thread で並列化（旧方式）
+  aio   : SDK の非同期API（client.aio）
+使い方（backend ディレクトリで）:
+  python benchmarks/bench_gemini_client.py --calls 200 --latency 0.2
+"""
+import argparse, asyncio, json, socket, threading, time
+
+import uvicorn
+from google import genai
+from google.genai import types
+
+def make_fake_app(latency: float):
+    """generateContent の最小限の応答を latency 秒後に返す ASGI アプリ"""
+    body = json.dumps({
+        "candidates": [{
+            "content": {"role": "model", "parts": [{"text": "はい、普段はイオンで買い物をしています。"}]},
+            "finishReason": "STOP",
+        }],
+        "usageMetadata": {"promptTokenCount": 1200, "candidatesTokenCount": 40, "totalTokenCount": 1240},
+    }).encode("utf-8")
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        while (await receive()).get("more_body"):
+            pass
+        await asyncio.sleep(latency)
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+def start_fake_server(latency: float) -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(make_fake_app(latency), host="127.0.0.1", port=port, log_level="error"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return port
+
+async def run(client: genai.Client, mode: str, calls: int, model: str) -> dict:
+    config = types.GenerateContentConfig(system_instruction="あなたは東京都在住の35歳男性です。")
+    peak_threads = threading.active_count()
+
+    async def one():
+        nonlocal peak_threads
+        if mode == "thread":
+            coro = asyncio.to_thread(client.models.generate_content, model=model, contents="普段の買い物は？", config=config)
+        else:
+            coro = client.aio.models.generate_content(model=model, contents="普段の買い物は？", config=config)
+        response = await coro
+        peak_threads = max(peak_threads, threading.active_count())
+        return response.text
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    elapsed = time.perf_counter() - start
+    return {"mode": mode, "calls": calls, "seconds": round(elapsed, 3), "calls_per_sec": round(calls / elapsed, 1), "peak_threads": peak_threads}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2, help="偽エンドポイントの応答遅延（秒）")
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    args = parser.parse_args()
+
+    port = start_fake_server(args.latency)
+    client = genai.Client(api_key="fake-key", http_options=types.HttpOptions(base_url=f"http://127.0.0.1:{port}"))
+    for mode in ("thread", "aio"):
+        print(asyncio.run(run(client, mode, args.calls, args.model)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+ペルソナ生成ベンチマーク: 既存の1人ずつ生成する経路と一括生成エンジンの personas/sec を比較
+使い方（backend ディレクトリで）:
+  python benchmarks/bench_population.py --total 100000 --workers 4
+"""
+import argparse, json, math, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persona_engine import generate_personas_for_prefecture, prefecture_rng
+from population_engine import allocate_by_population, generate_population
+
+STATS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "stats_by_prefecture.json")
+
+def bench_legacy(stats: dict, total: int, seed: int) -> float:
+    counts = allocate_by_population(stats, total)
+    start = time.perf_counter()
+    n = 0
+    for pref, pref_stats in stats.items():
+        n += len(generate_personas_for_prefecture(pref, pref_stats, num=counts[pref], rng=prefecture_rng(seed, pref)))
+    return n / (time.perf_counter() - start)
+
+def bench_batched(stats: dict, total: int, seed: int, workers: int) -> float:
+    start = time.perf_counter()
+    columns = generate_population(stats, total, seed, workers=workers)
+    return len(columns["id"]) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--total", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--legacy-total", type=int, default=None, help="既存経路の人数（省略時は --total と同じ）")
+    args = parser.parse_args()
+
+    with open(STATS_PATH, "r", encoding="utf-8") as f:
+        stats = json.load(f)
+
+    results = {
+        "legacy": bench_legacy(stats, args.legacy_total or args.total, args.seed),
+        "batched_1proc": bench_batched(stats, args.total, args.seed, workers=1),
+    }
+    if args.workers > 1:
+        results[f"batched_{args.workers}proc"] = bench_batched(stats, args.total, args.seed, workers=args.workers)
+
+    base = results["legacy"]
+    print(f"{'path':<16}{'personas/sec':>16}{'speedup':>10}")
+    for name, rate in results.items():
+        speedup = rate / base if base else math.nan
+        print(f"{name:<16}{rate:>16,.0f}{speedup:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
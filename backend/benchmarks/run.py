@@ -0,0 +1,172 @@
+"""
+マイクロベンチマーク一式（オフライン。Gemini API は呼ばない）
+対象:
+  stats_json_load            統計JSONの json.load
+  load_all_personas[N]       ペルソナ生成（既定 N = 470 / 10000 / 100000）
+  generate_persona_profile   ライフログ・心理プロファイル生成（470人分）
+  build_system_prompt        システムプロンプト組み立て（470人分・プロファイル付き）
+  api_personas_serialize     /api/personas の応答の組み立て（検索 + model_dump + JSONエンコード + 圧縮。キャッシュが空のとき）
+  api_personas_page          /api/personas の1ページ（limit=50, fields=id,prefecture,age,gender。キャッシュが空のとき）
+  api_personas_cached        /api/personas のキャッシュ済み応答（Accept-Encoding に合わせて返すだけ）
+使い方（backend ディレクトリで）:
+  python benchmarks/run.py --output bench.json                 # 計測して JSON レポートを保存
+  python benchmarks/run.py --quick                             # 100000人を省略
+  python benchmarks/run.py --baseline old.json                 # 計測して old.json と比較
+  python benchmarks/run.py --compare old.json new.json         # 保存済みの2つを比較
+比較では中央値が --threshold（既定 10%）以上遅くなったケースを回帰とし、終了コード 1 を返す。
+"""
+import argparse, json, math, os, platform, statistics, subprocess, sys, time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+STATS_PATH = os.path.join(BACKEND_DIR, "data", "stats_by_prefecture.json")
+DEFAULT_SIZES = (470, 10_000, 100_000)
+SEED = 42
+
+def measure(fn, items: int, repeat: int, min_time: float = 0.2) -> dict:
+    """fn() を repeat 回（短すぎる場合は1回あたり min_time 秒以上になるよう複数回まとめて）計測する"""
+    fn()  # ウォームアップ（キャッシュ・遅延 import の影響を除く）
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 16:
+            break
+        loops *= 2
+    times = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        times.append((time.perf_counter() - start) / loops)
+    median = statistics.median(times)
+    return {
+        "items": items,
+        "repeat": repeat,
+        "loops": loops,
+        "best_s": min(times),
+        "median_s": median,
+        "stdev_s": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "per_item_us": median / items * 1e6,
+        "items_per_sec": items / median if median else math.inf,
+    }
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_suite(sizes: tuple[int, ...], repeat: int, only: str | None = None) -> dict:
+    from starlette.requests import Request
+    from catalog_cache import PrecomputedResponse, catalog_cache
+    from persona_engine import load_all_personas
+    from lifelog_engine import generate_persona_profile
+    from gemini_client import build_system_prompt
+    from models import PersonaListQuery
+    import main as app_main
+
+    personas = load_all_personas(STATS_PATH, num=10, seed=SEED)
+    profiles = [generate_persona_profile(p) for p in personas]
+    app_main.PERSONAS.load(personas)
+
+    request = Request({"type": "http", "method": "GET", "path": "/api/personas", "query_string": b"",
+                       "headers": [(b"accept-encoding", b"gzip, deflate, br")]})
+
+    def api_personas():
+        return PrecomputedResponse(app_main._personas_body({}))
+
+    catalog_cache.clear()
+
+    def stats_load():
+        with open(STATS_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    cases: dict[str, tuple] = {"stats_json_load": (stats_load, 1)}
+    for n in sizes:
+        per_pref = math.ceil(n / 47)
+        cases[f"load_all_personas[{n}]"] = (lambda k=per_pref: load_all_personas(STATS_PATH, num=k, seed=SEED), per_pref * 47)
+    cases["generate_persona_profile"] = (lambda: [generate_persona_profile(p) for p in personas], len(personas))
+    cases["build_system_prompt"] = (lambda: [build_system_prompt(p, pr) for p, pr in zip(personas, profiles)], len(personas))
+    cases["api_personas_serialize"] = (api_personas, len(personas))
+    page_fields = ("id", "prefecture", "age", "gender")
+    cases["api_personas_page"] = (lambda: PrecomputedResponse(app_main._personas_body({}, page_fields, limit=50)), 50)
+    cases["api_personas_cached"] = (lambda: app_main.get_personas(request, PersonaListQuery()), len(personas))
+
+    results = {}
+    for name, (fn, items) in cases.items():
+        if only and only not in name:
+            continue
+        # 大きいケースは1回が長いので繰り返しを減らす
+        r = max(1, repeat if items < 50_000 else min(repeat, 3))
+        results[name] = measure(fn, items, r)
+        print(f"  {name:<34}{results[name]['median_s'] * 1e3:>12.3f} ms{results[name]['items_per_sec']:>16,.0f} items/s", file=sys.stderr)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+def compare(base: dict, new: dict, threshold: float) -> bool:
+    """中央値を比較して表を出力する。回帰があれば True"""
+    regressed = False
+    print(f"{'case':<34}{'base ms':>12}{'new ms':>12}{'change':>10}")
+    for name, b in base["results"].items():
+        n = new["results"].get(name)
+        if n is None:
+            continue
+        change = n["median_s"] / b["median_s"] - 1 if b["median_s"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:<34}{b['median_s'] * 1e3:>12.3f}{n['median_s'] * 1e3:>12.3f}{change:>+10.1%}{flag}")
+    return regressed
+
+def _load(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="persona / lifelog / prompt エンジンのマイクロベンチマーク")
+    parser.add_argument("--output", help="レポート（JSON）の保存先。省略時は標準出力")
+    parser.add_argument("--sizes", type=lambda s: tuple(int(x) for x in s.split(",")), default=DEFAULT_SIZES,
+                        help="load_all_personas の人数（カンマ区切り）")
+    parser.add_argument("--quick", action="store_true", help="100000人のケースを省略")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="名前にこの文字列を含むケースだけ実行")
+    parser.add_argument("--baseline", help="計測後にこのレポートと比較する")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="保存済みレポート同士を比較する（計測しない）")
+    parser.add_argument("--threshold", type=float, default=0.10, help="回帰とみなす中央値の悪化率")
+    args = parser.parse_args()
+
+    if args.compare:
+        regressed = compare(_load(args.compare[0]), _load(args.compare[1]), args.threshold)
+        sys.exit(1 if regressed else 0)
+
+    sizes = tuple(n for n in args.sizes if not (args.quick and n >= 100_000))
+    report = run_suite(sizes, args.repeat, args.only)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    elif not args.baseline:
+        print(text)
+
+    if args.baseline:
+        sys.exit(1 if compare(_load(args.baseline), report, args.threshold) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+一括質問の逐次集計（回答が届くたびに O(1) で更新し、summary イベントとして配信する）
+- 地域・都道府県・性別・年齢帯・所得帯ごとの回答数
+- キーワード頻度（漢字・カタカナ・英字の連続。1回答で同じ語は1回だけ数える）
+- 回答文字数の平均・標準偏差・最小・最大（Welford 法）
+- 選択肢が指定されていれば回答を符号化し、選択肢ごと・地域×選択肢ごとの件数
+クライアントは全回答を保持・再集計しなくても summary だけ購読すればよい。
+"""
+import math, re
+from collections import Counter, defaultdict
+from models import Persona
+from sampling import age_band, income_tier, code_answer
+
+_KEYWORD_RE = re.compile(r"[一-龥々〆ヵヶ]{2,}|[ァ-ヴー]{2,}|[A-Za-zＡ-Ｚａ-ｚ][A-Za-z0-9Ａ-Ｚａ-ｚ０-９]+")
+_STOPWORDS = {"自分", "場合", "ところ", "ため", "理由", "回答", "質問", "選択肢", "感じ", "部分", "以上", "以下"}
+
+def extract_keywords(text: str) -> set[str]:
+    return {w for w in _KEYWORD_RE.findall(text) if w not in _STOPWORDS}
+
+class BulkAggregator:
+    def __init__(self, total: int, options: list[str] | None = None, top_keywords: int = 20):
+        self.total = total
+        self.options = list(options or [])
+        self.top_keywords = top_keywords
+        self.completed = self.answered = self.failed = self.cached = 0
+        self.by: dict[str, Counter] = {k: Counter() for k in ("region", "prefecture", "gender", "age_band", "income_tier")}
+        self.keywords: Counter = Counter()
+        self.options_count: Counter = Counter()
+        self.options_by_region: dict[str, Counter] = defaultdict(Counter)
+        # 回答文字数（Welford 法）
+        self._len_mean = 0.0
+        self._len_m2 = 0.0
+        self._len_min: int | None = None
+        self._len_max: int | None = None
+
+    def add(self, persona: Persona, answer: str, failed: bool = False, cached: bool = False) -> str | None:
+        """1件取り込む。選択肢を指定していれば符号化した選択肢を返す"""
+        self.completed += 1
+        if failed:
+            self.failed += 1
+            return None
+        self.answered += 1
+        self.cached += cached
+        self.by["region"][persona.region] += 1
+        self.by["prefecture"][persona.prefecture] += 1
+        self.by["gender"][persona.gender] += 1
+        self.by["age_band"][age_band(persona.age)] += 1
+        self.by["income_tier"][income_tier(persona.annual_income)] += 1
+        self.keywords.update(extract_keywords(answer))
+
+        length = len(answer)
+        delta = length - self._len_mean
+        self._len_mean += delta / self.answered
+        self._len_m2 += delta * (length - self._len_mean)
+        self._len_min = length if self._len_min is None else min(self._len_min, length)
+        self._len_max = length if self._len_max is None else max(self._len_max, length)
+
+        if not self.options:
+            return None
+        option = code_answer(answer, self.options)
+        self.options_count[option] += 1
+        self.options_by_region[persona.region][option] += 1
+        return option
+
+    def summary(self) -> dict:
+        n = self.answered
+        result = {
+            "completed": self.completed,
+            "total": self.total,
+            "answered": n,
+            "failed": self.failed,
+            "cached": self.cached,
+            **{f"by_{k}": dict(c) for k, c in self.by.items()},
+            "answer_length": {
+                "mean": round(self._len_mean, 1),
+                "stdev": round(math.sqrt(self._len_m2 / (n - 1)), 1) if n > 1 else 0.0,
+                "min": self._len_min,
+                "max": self._len_max,
+            },
+            "keywords": self.keywords.most_common(self.top_keywords),
+        }
+        if self.options:
+            result["options"] = dict(self.options_count)
+            result["options_by_region"] = {r: dict(c) for r, c in self.options_by_region.items()}
+        return result
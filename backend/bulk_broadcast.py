@@ -0,0 +1,132 @@
+"""
+同じ一括質問の同時実行をまとめる（single-flight）
+- キー: (正規化した質問, 絞り込み条件, モデル, バッチサイズ, 回答キャッシュを使うか)
+- 最初のリクエストが BulkFlight を作り、bulk_ask_stream をリクエストから切り離したタスクで実行して
+  結果を順に results に積む（放送チャンネル）。同じキーの後続リクエストは新たに問い合わせず、
+  積まれた結果を先頭から受け取ってから、以降の新着を流す
+- 上流（bulk_ask_stream）から次の結果を読むのは、いちばん遅い購読者が積まれた結果を受け取り終えてから。
+  購読者が遅いと上流の結果キューが埋まり、新しい問い合わせが止まる（直接呼ぶ場合と同じ背圧がかかる）。
+  後から来た購読者は、すでに積まれた結果を読み終えるまでは他の購読者を待たせる
+- 購読者が1人でも残っている間は問い合わせを続け、全員いなくなったらタスクを取り消す
+- 使ったトークンは BulkFlight.meter に記録する（購読者ごとの予算とは共有できないので、
+  token_budget を指定したリクエストはまとめずに単独で実行する）
+"""
+import asyncio
+from contextlib import aclosing
+from answer_cache import normalize_question
+from metrics import BULK_SINGLE_FLIGHT
+from token_usage import TokenMeter, attribute_usage
+
+def flight_key(question: str, filters: dict, model: str, batch_size: int, use_cache: bool) -> tuple:
+    return (normalize_question(question), tuple(sorted(filters.items())), model, batch_size, use_cache)
+
+class BulkFlight:
+    def __init__(self, key: tuple, endpoint: str, owner: "SingleFlight"):
+        self.key = key
+        self.owner = owner
+        self.endpoint = endpoint
+        self.results: list[dict] = []
+        self.done = False
+        self.error: str | None = None
+        self.meter = TokenMeter()
+        self.task: asyncio.Task | None = None
+        # 購読者ごとの「次に受け取る結果の位置」
+        self._cursors: dict[int, int] = {}
+        self._next_subscriber = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._cursors)
+
+    def _caught_up(self) -> bool:
+        # 購読者がいない間（最初の購読者が読み始める前も）は上流を読み進めない
+        return bool(self._cursors) and min(self._cursors.values()) >= len(self.results)
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _wait_until(self, predicate):
+        while not predicate():
+            await self._changed.wait()
+
+    async def _run(self, stream):
+        attribute_usage(endpoint=self.endpoint, meter=self.meter)
+        try:
+            async with aclosing(stream):
+                while True:
+                    await self._wait_until(self._caught_up)
+                    try:
+                        result = await anext(stream)
+                    except StopAsyncIteration:
+                        break
+                    self.results.append(result)
+                    self._notify()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.done = True
+            self._notify()
+            self.owner.forget(self)
+
+    async def subscribe(self):
+        """これまでの結果を先頭から流し、その後は完了まで新着を流す（各結果は購読者ごとのコピー）"""
+        token = self._next_subscriber
+        self._next_subscriber += 1
+        self._cursors[token] = 0
+        try:
+            while True:
+                cursor = self._cursors[token]
+                if cursor < len(self.results):
+                    yield dict(self.results[cursor])
+                    # 受け取り終えてから位置を進める（yield から戻るまでは読み手が処理中）
+                    self._cursors[token] = cursor + 1
+                    self._notify()
+                    continue
+                if self.done:
+                    break
+                await self._wait_until(lambda: self.done or self._cursors[token] < len(self.results))
+            if self.error:
+                raise RuntimeError(self.error)
+        finally:
+            del self._cursors[token]
+            if not self._cursors and not self.done and self.task is not None:
+                # 誰も読んでいない問い合わせは続けない
+                self.task.cancel()
+                self.owner.forget(self)
+            else:
+                # 遅い購読者が抜けたら、待たされていた上流を進める
+                self._notify()
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: dict[tuple, BulkFlight] = {}
+
+    def join(self, key: tuple, stream_factory, endpoint: str = "bulk-question") -> tuple[BulkFlight, bool]:
+        """
+        実行中の同じキーがあればそれに相乗りし、なければ stream_factory() の実行を始める。
+        戻り値: (BulkFlight, 相乗りしたか)。購読は BulkFlight.subscribe() で行う
+        """
+        flight = self._flights.get(key)
+        if flight is not None and not flight.done:
+            BULK_SINGLE_FLIGHT.inc(role="joined")
+            return flight, True
+        flight = self._flights[key] = BulkFlight(key, endpoint, self)
+        flight.task = asyncio.create_task(flight._run(stream_factory()))
+        BULK_SINGLE_FLIGHT.inc(role="leader")
+        return flight, False
+
+    def forget(self, flight: BulkFlight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def get_status(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "subscribers": sum(f.subscribers for f in self._flights.values()),
+        }
+
+bulk_flights = SingleFlight()
@@ -0,0 +1,364 @@
+"""
+一括質問ジョブ（サーバー側で実行し、接続が切れても回答を失わない）
+- ジョブごとに data/jobs/{job_id}.jsonl へ追記保存する
+    1行目: {"type": "job", ...ジョブ定義}
+    以降  : {"type": "progress" | "summary", "data": {...}} / {"type": "done" | "error", "data": {...}}
+- イベントには1からの連番 id を振る。ファイルの行順から復元できるので再起動後も同じ id になる
+- クライアントは Last-Event-ID 以降を再送してもらってから実況に追従する
+- 起動時に未完了のジョブを読み込み、回答済み（失敗以外）のペルソナを除いて再開する。
+  終わったジョブは起動時には状態だけ確かめ、参照されたときにファイルから読み直す
+- uvicorn --workers N: ジョブを実行するワーカーは {job_id}.lock のリース（shared_state.FileLease）を持つ1つだけ。
+  他のワーカーは参照されたときにファイルから読み込み、追記をポーリングして追従する（BULK_JOB_POLL 秒ごと）。
+  実行中のワーカーが落ちてリースが外れたら、最初に気づいたワーカーが引き継いで再開する
+- 終わったジョブは BULK_JOB_TTL 秒たつか BULK_JOB_MAX 件を超えると古い順にファイルごと消す。
+  メモリには最近参照した BULK_JOB_CACHE 件だけ残す（実行中のジョブは常にメモリにある）
+"""
+import asyncio, json, os, time, uuid
+from collections import OrderedDict
+from shared_state import FileLease
+
+DEFAULT_DIR = os.path.join(os.path.dirname(__file__), "data", "jobs")
+
+class BulkJob:
+    def __init__(self, job_id: str, request: dict, persona_ids: list[str], created_at: float | None = None):
+        self.id = job_id
+        self.request = request
+        self.persona_ids = persona_ids
+        self.created_at = created_at or time.time()
+        self.status = "running"
+        self.events: list[dict] = []
+        self.answered: set[str] = set()
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+        self._file = None
+        # 保存先と実行権（このワーカーが実行しているあいだ lease を持つ）
+        self.path: str | None = None
+        self.lease: FileLease | None = None
+        # 他のワーカーが実行中なら、待つ代わりに呼ぶ（少し待ってからファイルの追記を読む）
+        self._remote = None
+        self._offset = 0
+
+    @property
+    def total(self) -> int:
+        return len(self.persona_ids)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "error")
+
+    # ── 記録 ─────────────────────────────────────────────────────
+    def _append(self, event: str, data: dict, persist: bool = True):
+        self.events.append({"id": len(self.events) + 1, "event": event, "data": data})
+        if event == "progress" and not data.get("failed"):
+            self.answered.add(data["persona_id"])
+        elif event in ("done", "error"):
+            self.status = event
+        if persist and self._file is not None:
+            self._file.write(json.dumps({"type": event, "data": data}, ensure_ascii=False) + "\n")
+            self._file.flush()
+        # 待機中の購読者を起こす（Event は使い捨てにして取りこぼしを防ぐ）
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _replay(self, line: bytes):
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            return  # 書き込み途中で落ちた行は捨てる
+        self._append(rec["type"], rec["data"], persist=False)
+
+    def refresh(self):
+        """他のワーカーが追記した行（改行まで書き終わったもの）を読み込む"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except OSError:
+            return
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        for line in data[:end].splitlines():
+            self._replay(line)
+
+    def record_progress(self, result: dict):
+        result = {**result, "completed": len(self.answered) + 1, "total": self.total}
+        if result.get("failed"):
+            result["completed"] -= 1
+        self._append("progress", result)
+
+    def record_summary(self, summary: dict):
+        self._append("summary", summary)
+
+    def finish(self, data: dict | None = None):
+        self._append("done", {"message": "完了", **(data or {})})
+        self.close()
+
+    def fail(self, error: str):
+        self._append("error", {"error": error})
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # ── 購読 ─────────────────────────────────────────────────────
+    async def follow(self, last_event_id: int = 0, summary_only: bool = False):
+        """last_event_id より後のイベントを再送し、その後はジョブ終了まで新着を流す（summary_only なら progress を除く）"""
+        cursor = max(0, last_event_id)
+        while True:
+            while cursor < len(self.events):
+                ev = self.events[cursor]
+                cursor += 1
+                if not (summary_only and ev["event"] == "progress"):
+                    yield ev
+            if self.finished:
+                return
+            if self._remote is not None:
+                await self._remote(self)
+            else:
+                await self._changed.wait()
+
+    def summary(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "question": self.request.get("question"),
+            "total": self.total,
+            "answered": len(self.answered),
+            "events": len(self.events),
+            "created_at": self.created_at,
+        }
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+def _last_record_type(path: str, tail_bytes: int = 65536) -> str | None:
+    """ファイル末尾の行の type（done / error なら終わったジョブ）。全体は読まない"""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - tail_bytes))
+        lines = f.read().splitlines()
+    if not lines:
+        return None
+    try:
+        return json.loads(lines[-1]).get("type")
+    except ValueError:
+        return None  # 書き込み途中で落ちた行（未完了）
+
+class BulkJobManager:
+    TTL_SECONDS = int(os.getenv("BULK_JOB_TTL", str(7 * 86400)))
+    MAX_FINISHED = int(os.getenv("BULK_JOB_MAX", "200"))
+    CACHE_SIZE = int(os.getenv("BULK_JOB_CACHE", "16"))
+    POLL_SECONDS = float(os.getenv("BULK_JOB_POLL", "0.5"))
+
+    def __init__(self, jobs_dir: str, ttl_seconds: int | None = None, max_finished: int | None = None,
+                 cache_size: int | None = None, poll_seconds: float | None = None):
+        self.jobs_dir = jobs_dir
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else self.TTL_SECONDS
+        self.max_finished = max_finished if max_finished is not None else self.MAX_FINISHED
+        self.cache_size = cache_size if cache_size is not None else self.CACHE_SIZE
+        self.poll_seconds = poll_seconds if poll_seconds is not None else self.POLL_SECONDS
+        # 落ちたワーカーのジョブを引き継ぐときに使う（resume で設定）
+        self.runner = None
+        # メモリ上のジョブ（実行中 + 最近参照した終了済み）。参照順
+        self.jobs: OrderedDict[str, BulkJob] = OrderedDict()
+        # ファイルに残っている終了済みジョブ → 終了時刻。終了順
+        self._finished: OrderedDict[str, float] = OrderedDict()
+        self.evicted = 0
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.jsonl")
+
+    def _lease(self, job_id: str) -> FileLease:
+        return FileLease(os.path.join(self.jobs_dir, f"{job_id}.lock"))
+
+    def get(self, job_id: str) -> BulkJob | None:
+        """
+        ジョブを返す。メモリになければファイルから読む（終了済み・他のワーカーが実行中のジョブ）。
+        引き継ぎでジョブを始めることがあるので、イベントループ上で呼ぶこと
+        """
+        if not job_id.isalnum():
+            return None
+        self._trim(time.time())
+        job = self.jobs.get(job_id)
+        if job is None:
+            job = self._load(self._path(job_id))
+            if job is None:
+                return None
+            self.jobs[job_id] = job
+            if not job.finished:
+                job._remote = self._follow_remote
+        if job._remote is not None:
+            self._sync(job)
+        elif job.finished and job_id not in self._finished:
+            self._mark_finished(job, os.path.getmtime(job.path))
+        if job_id in self.jobs:
+            self.jobs.move_to_end(job_id)
+            self._trim_memory()
+        return job
+
+    async def _follow_remote(self, job: BulkJob):
+        await asyncio.sleep(self.poll_seconds)
+        self._sync(job)
+
+    def _sync(self, job: BulkJob):
+        """他のワーカーが実行中のジョブの追記を読む。実行していたワーカーが落ちてリースが外れていれば引き継ぐ"""
+        job.refresh()
+        if not job.finished and self.runner is not None and job.lease.acquire():
+            job.refresh()  # リースが外れる直前に書かれた行
+            if not job.finished:
+                job._remote = None
+                self._open_for_append(job)
+                self.start(job, self.runner)
+                return
+            job.lease.release()
+        if job.finished:
+            job._remote = None
+            self._mark_finished(job)
+
+    def _open_for_append(self, job: BulkJob):
+        job._file = open(job.path, "a", encoding="utf-8")
+        if job._file.tell() and not _ends_with_newline(job.path):
+            job._file.write("\n")  # 書き込み途中で落ちた行を閉じる（読み込み時は読み飛ばす）
+
+    def _mark_finished(self, job: BulkJob, finished_at: float | None = None):
+        self._finished[job.id] = finished_at or time.time()
+        self._finished.move_to_end(job.id)
+        self._trim(time.time())
+
+    def _trim(self, now: float):
+        """期限切れ・件数超過の終了済みジョブをファイルごと消す"""
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if now - finished_at < self.ttl_seconds and len(self._finished) <= self.max_finished:
+                break
+            del self._finished[job_id]
+            self.jobs.pop(job_id, None)
+            for path in (self._path(job_id), self._lease(job_id).path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.evicted += 1
+        self._trim_memory()
+
+    def _trim_memory(self):
+        """終了済みジョブは最近参照した cache_size 件だけメモリに残す（ファイルからいつでも読み直せる）"""
+        loaded = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in loaded[:max(0, len(loaded) - self.cache_size)]:
+            del self.jobs[job_id]
+
+    def create(self, request: dict, persona_ids: list[str]) -> BulkJob:
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        job = BulkJob(uuid.uuid4().hex[:12], request, persona_ids)
+        job.path = self._path(job.id)
+        job.lease = self._lease(job.id)
+        job.lease.acquire()
+        job._file = open(job.path, "a", encoding="utf-8")
+        header = {
+            "type": "job",
+            "id": job.id,
+            "request": request,
+            "persona_ids": persona_ids,
+            "created_at": job.created_at,
+        }
+        job._file.write(json.dumps(header, ensure_ascii=False) + "\n")
+        job._file.flush()
+        self.jobs[job.id] = job
+        return job
+
+    def start(self, job: BulkJob, runner):
+        """
+        runner(job) はコルーチン。未回答のペルソナだけを問い合わせて job.record_progress() する。
+        戻り値の dict は done イベントに含める（打ち切り理由など）
+        """
+        async def run():
+            try:
+                data = await runner(job)
+            except asyncio.CancelledError:
+                # シャットダウン時: 途中までの回答はファイルに残っているので次回起動時（か他のワーカー）が再開する
+                job.close()
+                raise
+            except Exception as e:
+                job.fail(str(e))
+            else:
+                job.finish(data)
+            finally:
+                if job.lease is not None:
+                    job.lease.release()
+            self._mark_finished(job)
+        job.task = asyncio.create_task(run())
+
+    def resume(self, runner) -> list[BulkJob]:
+        """未完了のジョブのうちリースを取れたもの（他のワーカーが実行していないもの）を再開して返す"""
+        self.runner = runner
+        pending = self.load_all()
+        for job in pending:
+            self.start(job, runner)
+        return pending
+
+    def load_all(self) -> list[BulkJob]:
+        """
+        保存済みのジョブを調べ、未完了でリースを取れたものだけ読み込んで返す。
+        終了済みのものは終了時刻（ファイルの更新時刻）だけ覚えておき、期限切れなら消す
+        """
+        if not os.path.isdir(self.jobs_dir):
+            return []
+        pending, finished = [], []
+        for name in sorted(os.listdir(self.jobs_dir)):
+            if not name.endswith(".jsonl"):
+                continue
+            path = os.path.join(self.jobs_dir, name)
+            job_id = name[:-len(".jsonl")]
+            if _last_record_type(path) in ("done", "error"):
+                finished.append((os.path.getmtime(path), job_id))
+                continue
+            # 他のワーカーが実行中なら任せる（参照されたらファイルから追従する）
+            lease = self._lease(job_id)
+            if not lease.acquire():
+                continue
+            job = self._load(path, lease)
+            if job is None or job.finished:
+                lease.release()
+                if job is not None:
+                    finished.append((os.path.getmtime(path), job_id))
+                continue
+            self.jobs[job.id] = job
+            self._open_for_append(job)
+            pending.append(job)
+        for finished_at, job_id in sorted(finished):
+            self._finished[job_id] = finished_at
+        self._trim(time.time())
+        return pending
+
+    def _load(self, path: str, lease: FileLease | None = None) -> BulkJob | None:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        # 改行まで書き終わった行だけ読む（続きは refresh で読む）
+        end = data.rfind(b"\n") + 1
+        lines = data[:end].splitlines()
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return None
+        job = BulkJob(header["id"], header["request"], header["persona_ids"], header.get("created_at"))
+        job.path = path
+        job.lease = lease or self._lease(job.id)
+        job._offset = end
+        for line in lines[1:]:
+            job._replay(line)
+        return job
+
+    async def shutdown(self):
+        tasks = [j.task for j in self.jobs.values() if j.task and not j.task.done()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+bulk_jobs = BulkJobManager(os.getenv("BULK_JOBS_DIR") or DEFAULT_DIR)
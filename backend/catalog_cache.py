@@ -0,0 +1,123 @@
+"""
+読み取り専用カタログ（/api/personas, /api/prefectures）の応答キャッシュ
+- ペルソナはロード後に変わらないので、応答の JSON は1回だけ組み立ててバイト列で持つ
+  （エンコードは orjson。無ければ標準の json）
+- gzip / brotli（brotli パッケージがあれば）で事前に圧縮し、Accept-Encoding に合わせて返す
+- 強い ETag（本文の SHA-256）と Cache-Control を付け、If-None-Match が一致すれば 304 を本文なしで返す
+  → ブラウザの再読み込みは 304 になり、サーバー側の処理はヘッダの比較だけ
+- フィルタ条件ごとの応答は LRU で CATALOG_CACHE_SIZE 件まで保持。ペルソナを再ロードしたら clear() する
+"""
+import gzip, hashlib, json, os
+from collections import OrderedDict
+from starlette.requests import Request
+from starlette.responses import Response
+from metrics import CACHE_REQUESTS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 0 なら毎回再検証させる（no-cache）。ETag が一致すれば 304 なので転送量はほぼない
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", "0"))
+# これより小さい応答は圧縮しない
+MIN_COMPRESS_BYTES = 512
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _accepts(request: Request) -> set[str]:
+    """Accept-Encoding のうち q=0 でないもの"""
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+class PrecomputedResponse:
+    """シリアライズ・圧縮済みの JSON 応答（エンコーディングごとの本文と ETag）"""
+
+    def __init__(self, obj):
+        body = dumps(obj)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # 表現（エンコーディング）ごとに別の強い ETag を付ける
+        self.variants: dict[str, tuple[bytes, str]] = {"identity": (body, f'"{digest}"')}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            self.variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"')
+            if brotli is not None:
+                self.variants["br"] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+        self._etags = {etag for _, etag in self.variants.values()}
+        self.size = sum(len(b) for b, _ in self.variants.values())
+
+    def _not_modified(self, request: Request) -> bool:
+        header = request.headers.get("if-none-match")
+        if not header:
+            return False
+        # If-None-Match は弱い比較（W/ を無視して比べる）
+        tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+        return "*" in tags or not tags.isdisjoint(self._etags)
+
+    def respond(self, request: Request, cache: str) -> Response:
+        headers = {
+            "Cache-Control": f"public, max-age={CATALOG_MAX_AGE}" if CATALOG_MAX_AGE else "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        accepted = _accepts(request)
+        coding = next((c for c in ("br", "gzip") if c in self.variants and c in accepted), "identity")
+        body, etag = self.variants[coding]
+        headers["ETag"] = etag
+        if self._not_modified(request):
+            CACHE_REQUESTS.inc(cache=cache, result="not_modified")
+            return Response(status_code=304, headers=headers)
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+class CatalogCache:
+    MAX_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "256"))
+
+    def __init__(self, max_size: int | None = None):
+        self.max_size = max_size or self.MAX_SIZE
+        self._entries: OrderedDict[tuple, PrecomputedResponse] = OrderedDict()
+        self.version = 0
+
+    def clear(self):
+        """元データが変わったとき（ペルソナの再ロードなど）に呼ぶ"""
+        self._entries.clear()
+        self.version += 1
+
+    def get(self, key: tuple, build, cache: str) -> PrecomputedResponse:
+        """key の応答を返す。無ければ build() の結果をシリアライズして保持する"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            CACHE_REQUESTS.inc(cache=cache, result="hit")
+            return entry
+        CACHE_REQUESTS.inc(cache=cache, result="miss")
+        entry = self._entries[key] = PrecomputedResponse(build())
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return entry
+
+    def serve(self, request: Request, key: tuple, build, cache: str = "catalog") -> Response:
+        return self.get(key, build, cache).respond(request, cache)
+
+    def get_status(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "bytes": sum(e.size for e in self._entries.values()),
+            "encoder": "orjson" if orjson is not None else "json",
+            "encodings": ["identity", "gzip"] + (["br"] if brotli is not None else []),
+        }
+
+catalog_cache = CatalogCache()
@@ -105,12 +105,27 @@ INDUSTRIES = {
     "沖縄県": ["観光", "サービス業", "農業", "基地関連"],
 }
 
+# 総人口（千人, 2020年国勢調査）: 大規模生成時の都道府県別人数の按分に使う
+POPULATION = {
+    "北海道": 5225, "青森県": 1238, "岩手県": 1211, "宮城県": 2302, "秋田県": 960,
+    "山形県": 1068, "福島県": 1833, "茨城県": 2867, "栃木県": 1933, "群馬県": 1939,
+    "埼玉県": 7345, "千葉県": 6284, "東京都": 14048, "神奈川県": 9237, "新潟県": 2201,
+    "富山県": 1035, "石川県": 1133, "福井県": 767, "山梨県": 810, "長野県": 2048,
+    "岐阜県": 1979, "静岡県": 3633, "愛知県": 7542, "三重県": 1770, "滋賀県": 1414,
+    "京都府": 2578, "大阪府": 8838, "兵庫県": 5465, "奈良県": 1324, "和歌山県": 923,
+    "鳥取県": 553, "島根県": 671, "岡山県": 1888, "広島県": 2800, "山口県": 1342,
+    "徳島県": 720, "香川県": 950, "愛媛県": 1335, "高知県": 692, "福岡県": 5135,
+    "佐賀県": 811, "長崎県": 1312, "熊本県": 1738, "大分県": 1124, "宮崎県": 1070,
+    "鹿児島県": 1588, "沖縄県": 1467,
+}
+
 def build_stats():
     result = {}
     for name, v in PREFECTURES.items():
         avg_inc, ldp, homeown, single, aging, commute, food, housing, entertain, region = v
         result[name] = {
             "region": region,
+            "population": POPULATION[name] * 1000,
             "avg_annual_income": avg_inc,
             "income_distribution": {
                 "under_200": round(max(0.05, 0.30 - avg_inc * 0.0003), 2),
@@ -156,6 +171,9 @@ def build_stats():
 if __name__ == "__main__":
     out_path = os.path.join(os.path.dirname(__file__), "stats_by_prefecture.json")
     data = build_stats()
-    with open(out_path, "w", encoding="utf-8") as f:
+    # 起動中のサーバーが書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, out_path)
     print(f"Generated stats for {len(data)} prefectures → {out_path}")
@@ -1,133 +1,171 @@
 """
 Gemini APIクライアント with レート制限 & 使用量トラッキング
 - gemini-2.0-flash 無料枠: 15 RPM / 1,500 RPD
+- レート制限は rate_limiter.UsageTracker（GCRA）。API に届かなかった呼び出しは枠を返却する
+- 呼び出しは SDK の非同期API（client.aio）で行う。スレッドは使わず、同時実行数はレート制限だけで決まる
+- 応答の usage_metadata は token_usage.token_ledger に記録し、TPM の予約も実際のトークン数に合わせる
+- 呼び出し先は llm_backends（LLM_BACKEND=gemini / fake / openai）。レート制限・記録はどのバックエンドでも共通
 """
-import asyncio, os, time
-from google import genai
-from google.genai import types
+import asyncio, hashlib, json, os, time
+from collections import OrderedDict
+from google.genai import errors, types
 from models import Persona, PersonaProfile
+from lifelog_engine import PROFILE_VERSION
+from answer_cache import answer_cache
+from rate_limiter import UsageTracker, usage_tracker, Reservation, QuotaExceededError
+from metrics import GEMINI_LATENCY, GEMINI_ERRORS, PROMPT_BUILD, CACHE_REQUESTS, BULK_TASKS_IN_FLIGHT, BULK_BACKPRESSURE, BULK_CANCELLED, error_kind
+from token_usage import token_ledger, current_meter
+from llm_backends import RequestSend, call_tracking_send, create_backend
+from retry_policy import AdaptiveConcurrency, RetryPolicy, is_rate_limited
 
-_client: genai.Client | None = None
-
-# ── 使用量トラッカー ────────────────────────────────────────────
-class UsageTracker:
-    RPM_LIMIT = int(os.getenv("GEMINI_RPM_LIMIT", "15"))
-    RPD_LIMIT = int(os.getenv("GEMINI_RPD_LIMIT", "1500"))
-
-    def __init__(self):
-        self.requests_today = 0
-        self.requests_this_minute: list[float] = []
-        self.day_start = time.time()
-        self._lock = asyncio.Lock()
-
-    def _reset_day_if_needed(self):
-        now = time.time()
-        if now - self.day_start >= 86400:
-            self.requests_today = 0
-            self.day_start = now
-
-    async def wait_if_needed(self):
-        """RPM制限を守るためのスロットリング"""
-        async with self._lock:
-            now = time.time()
-            # 1分以上前のリクエストを除去
-            self.requests_this_minute = [t for t in self.requests_this_minute if now - t < 60]
-            # RPM上限に達している場合は待機
-            if len(self.requests_this_minute) >= self.RPM_LIMIT:
-                oldest = self.requests_this_minute[0]
-                wait_sec = 60 - (now - oldest) + 0.5
-                if wait_sec > 0:
-                    await asyncio.sleep(wait_sec)
-            # 記録
-            self.requests_this_minute.append(time.time())
-            self._reset_day_if_needed()
-            self.requests_today += 1
+# 1回の呼び出しのタイムアウト（秒）
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
 
-    def get_status(self) -> dict:
-        now = time.time()
-        self._reset_day_if_needed()
-        rpm_current = len([t for t in self.requests_this_minute if now - t < 60])
-        return {
-            "requests_today": self.requests_today,
-            "requests_remaining_today": max(0, self.RPD_LIMIT - self.requests_today),
-            "rpm_current": rpm_current,
-            "rpm_limit": self.RPM_LIMIT,
-            "rpd_limit": self.RPD_LIMIT,
-            "quota_pct_used": round(self.requests_today / self.RPD_LIMIT * 100, 1),
-        }
+# TPM 予約用のトークン数見積もり（日本語は概ね1〜2文字で1トークン。多めに見積もる）
+CHARS_PER_TOKEN = 1.5
 
-usage_tracker = UsageTracker()
+# llm_backends のいずれか（init_llm_backend で設定）
+_backend = None
 
-def init_gemini():
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY environment variable is not set")
-    global _client
-    _client = genai.Client(api_key=api_key)
 
-def build_system_prompt(persona: Persona, profile: "PersonaProfile | None" = None) -> str:
-    traits = "、".join(persona.personality_traits)
-    brands_lines = "\n".join(
-        f"  {cat}: {brand}" for cat, brand in persona.preferred_brands.items()
-    )
+def _reached_api(e: BaseException, sent: bool) -> bool:
+    """API にリクエストが届いた（可能性が高い）例外か。それ以外は枠を返却する"""
+    if isinstance(e, errors.APIError):
+        return True
+    # 送信後のタイムアウト・キャンセル（ヘッジで負けた方など）は届いた上で応答を待たなかっただけなので返却しない。
+    # 送信前（接続プールの空き待ち・接続中）に来たものは届いていない
+    return sent
 
-    # ── ライフログセクション ──────────────────────────────────────
-    lifelog_section = ""
-    if profile and profile.lifelog:
-        events_text = "\n".join(
-            f"  {e.year}年（{e.age}歳）: {e.event}" for e in profile.lifelog
+async def _generate(
+    model_name: str,
+    contents,
+    config: "types.GenerateContentConfig | None",
+    prompt_chars: int,
+    timeout: float | None = None,
+    persona_ids: list[str] | tuple = (),
+):
+    """
+    枠を予約して generate_content を呼ぶ。API に届かなかった場合は予約を取り消す。
+    トークン予算（TokenMeter）を使い切っていれば呼ばずに TokenBudgetExceeded を送出する。
+    """
+    meter = current_meter()
+    if meter is not None:
+        meter.check()
+    reservation = await _acquire(model_name, prompt_chars)
+    started = time.perf_counter()
+    send = RequestSend()
+    try:
+        response = await asyncio.wait_for(
+            call_tracking_send(
+                send,
+                _backend.generate_content,
+                model=model_name,
+                contents=contents,
+                config=config,
+            ),
+            min(timeout, GEMINI_TIMEOUT) if timeout else GEMINI_TIMEOUT,
         )
-        lifelog_section = f"""
+    except BaseException as e:
+        if not _reached_api(e, send.sent):
+            usage_tracker.refund(reservation)
+        _observe_call(model_name, started, e)
+        raise
+    _observe_call(model_name, started)
+    _record_usage(reservation, response.usage_metadata, persona_ids)
+    return response
+
+async def _acquire(model_name: str, prompt_chars: int) -> Reservation:
+    try:
+        return await usage_tracker.acquire(model_name, int(prompt_chars / CHARS_PER_TOKEN) + 1)
+    except QuotaExceededError:
+        GEMINI_ERRORS.inc(model=model_name, kind="daily_quota")
+        raise
+
+def _observe_call(model_name: str, started: float, error: BaseException | None = None):
+    """呼び出し時間と失敗の種類を記録する（キャンセルは記録しない）"""
+    if isinstance(error, asyncio.CancelledError):
+        return
+    outcome = "ok" if error is None else error_kind(error)
+    GEMINI_LATENCY.observe(time.perf_counter() - started, model=model_name, outcome=outcome)
+    if error is not None:
+        GEMINI_ERRORS.inc(model=model_name, kind=outcome)
+
+def _record_usage(reservation: Reservation, usage, persona_ids: list[str] | tuple = ()) -> dict:
+    """実際のトークン数を記録し、TPM の予約（文字数からの見積もり）を入力トークン数に合わせる"""
+    usage = _usage_dict(usage)
+    if usage:
+        usage_tracker.settle(reservation, usage["prompt_tokens"])
+        token_ledger.record(reservation.model, usage, persona_ids)
+    return usage
+
+def _record_partial_usage(reservation: Reservation, usage, output_chars: int, persona_ids: list[str] | tuple = ()):
+    """
+    途中で打ち切られたストリームの使用量を記録する。
+    usage_metadata は最後のチャンクにしか付かないことが多いので、無ければ入力は予約時の見積もり、出力は受信した文字数から見積もる。
+    """
+    if usage is not None:
+        _record_usage(reservation, usage, persona_ids)
+    elif output_chars:
+        output = int(output_chars / CHARS_PER_TOKEN) + 1
+        token_ledger.record(reservation.model, {
+            "prompt_tokens": reservation.tokens,
+            "output_tokens": output,
+            "total_tokens": reservation.tokens + output,
+        }, persona_ids)
+
+def init_llm_backend():
+    """LLM_BACKEND に応じて呼び出し先を設定する（gemini のときだけ GEMINI_API_KEY が必要）"""
+    global _backend
+    _backend = create_backend(GEMINI_TIMEOUT)
+    return _backend
+
+# 旧名
+init_gemini = init_llm_backend
+
+# ── システムプロンプト ───────────────────────────────────────────
+_LIFELOG_SECTION_TEMPLATE = """
 === あなたの経歴（ライフログ） ===
 {events_text}
 """
 
-    # ── 心理プロファイルセクション ───────────────────────────────
-    psych_section = ""
-    if profile and profile.psych:
-        ps = profile.psych
-        anxiety_text = "、".join(ps.future_anxiety)
-        habits_text = "、".join(ps.lifestyle_habits)
-        sns_text = "、".join(f"{k}（{v}）" for k, v in ps.sns_usage.items())
-        sources_text = "、".join(ps.info_sources)
-        psych_section = f"""
+_PSYCH_SECTION_TEMPLATE = """
 === あなたの内面・悩み ===
-生活満足度: {ps.life_satisfaction}
+生活満足度: {life_satisfaction}
 将来の不安: {anxiety_text}
-仕事観: {ps.work_values}
+仕事観: {work_values}
 
 === あなたの習慣・変化 ===
 ライフスタイル: {habits_text}
-価値観の変遷: {ps.values_shift}
+価値観の変遷: {values_shift}
 
 === あなたの情報収集スタイル ===
 SNS利用: {sns_text}
-メディアへの信頼: {ps.media_trust}
+メディアへの信頼: {media_trust}
 主な情報源: {sources_text}
 """
 
-    return f"""あなたは以下のプロフィールを持つ、{persona.prefecture}在住の{persona.age}歳{persona.gender}です。
+_SYSTEM_PROMPT_TEMPLATE = """あなたは以下のプロフィールを持つ、{p.prefecture}在住の{p.age}歳{p.gender}です。
 
 【重要な設定】
 あなたは今、リサーチャー（インタビュアー）から生活実態や価値観について話を聞かれている、ごく普通の日本人です。
 あなたはAIでも相談窓口でもありません。インタビューに応じている一般市民として、自分の言葉で素直に答えてください。
 
 === あなたのプロフィール ===
-居住地: {persona.prefecture}
-年齢: {persona.age}歳
-性別: {persona.gender}
-職業: {persona.occupation}
-年収: 約{persona.annual_income}万円
-世帯構成: {persona.household_type}
-住居: {persona.housing}
-月の食費: 約{persona.monthly_food:,}円
-月の住居費: 約{persona.monthly_housing:,}円
-月の趣味・娯楽費: 約{persona.monthly_entertainment:,}円
-通勤時間: 約{persona.commute_minutes}分
-生活習慣: {persona.daily_routine}
-政治的傾向: {persona.political_leaning}
+居住地: {p.prefecture}
+年齢: {p.age}歳
+性別: {p.gender}
+職業: {p.occupation}
+年収: 約{p.annual_income}万円
+世帯構成: {p.household_type}
+住居: {p.housing}
+月の食費: 約{p.monthly_food:,}円
+月の住居費: 約{p.monthly_housing:,}円
+月の趣味・娯楽費: 約{p.monthly_entertainment:,}円
+通勤時間: 約{p.commute_minutes}分
+生活習慣: {p.daily_routine}
+政治的傾向: {p.political_leaning}
 性格: {traits}
-主な関連産業: {persona.major_industry}
+主な関連産業: {p.major_industry}
 
 === 普段使いのブランド・商品 ===
 {brands_lines}
@@ -144,17 +182,168 @@ SNS利用: {sns_text}
 - 経歴に記載のある過去の出来事については、実体験として自然に語ることができる
 """
 
+# テンプレートの内容から決まるバージョン（文面を変えると自動的に別キーになる）
+PROMPT_TEMPLATE_VERSION = hashlib.sha256(
+    (_SYSTEM_PROMPT_TEMPLATE + _LIFELOG_SECTION_TEMPLATE + _PSYCH_SECTION_TEMPLATE).encode("utf-8")
+).hexdigest()[:12]
 
-async def ask_persona(persona: Persona, question: str, model_name: str = "gemini-2.0-flash", profile: "PersonaProfile | None" = None) -> str:
-    await usage_tracker.wait_if_needed()
-    response = await asyncio.to_thread(
-        _client.models.generate_content,
-        model=model_name,
-        contents=question,
-        config=types.GenerateContentConfig(system_instruction=build_system_prompt(persona, profile)),
+def build_system_prompt(persona: Persona, profile: "PersonaProfile | None" = None) -> str:
+    traits = "、".join(persona.personality_traits)
+    brands_lines = "\n".join(
+        f"  {cat}: {brand}" for cat, brand in persona.preferred_brands.items()
+    )
+
+    # ── ライフログセクション ──────────────────────────────────────
+    lifelog_section = ""
+    if profile and profile.lifelog:
+        events_text = "\n".join(
+            f"  {e.year}年（{e.age}歳）: {e.event}" for e in profile.lifelog
+        )
+        lifelog_section = _LIFELOG_SECTION_TEMPLATE.format(events_text=events_text)
+
+    # ── 心理プロファイルセクション ───────────────────────────────
+    psych_section = ""
+    if profile and profile.psych:
+        ps = profile.psych
+        psych_section = _PSYCH_SECTION_TEMPLATE.format(
+            life_satisfaction=ps.life_satisfaction,
+            anxiety_text="、".join(ps.future_anxiety),
+            work_values=ps.work_values,
+            habits_text="、".join(ps.lifestyle_habits),
+            values_shift=ps.values_shift,
+            sns_text="、".join(f"{k}（{v}）" for k, v in ps.sns_usage.items()),
+            media_trust=ps.media_trust,
+            sources_text="、".join(ps.info_sources),
+        )
+
+    return _SYSTEM_PROMPT_TEMPLATE.format(
+        p=persona,
+        traits=traits,
+        brands_lines=brands_lines,
+        lifelog_section=lifelog_section,
+        psych_section=psych_section,
+    )
+
+# ── プロンプトキャッシュ ───────────────────────────────────────────
+class PromptCache:
+    """(ペルソナID, プロファイルバージョン, テンプレートバージョン) ごとに組み立て済みのシステムプロンプトを保持"""
+    MAX_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "10000"))
+
+    def __init__(self, max_size: int | None = None):
+        self.max_size = max_size or self.MAX_SIZE
+        self._prompts: OrderedDict[tuple, str] = OrderedDict()
+        self._template_version = PROMPT_TEMPLATE_VERSION
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, persona: Persona, profile: "PersonaProfile | None" = None) -> str:
+        # テンプレートが差し替わっていたら古いエントリは全て捨てる
+        if self._template_version != PROMPT_TEMPLATE_VERSION:
+            self._prompts.clear()
+            self._template_version = PROMPT_TEMPLATE_VERSION
+        key = (persona.id, PROFILE_VERSION if profile is not None else None, PROMPT_TEMPLATE_VERSION)
+        prompt = self._prompts.get(key)
+        if prompt is not None:
+            self._prompts.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="prompt", result="hit")
+            return prompt
+        self.misses += 1
+        CACHE_REQUESTS.inc(cache="prompt", result="miss")
+        with PROMPT_BUILD.time():
+            prompt = build_system_prompt(persona, profile)
+        self._prompts[key] = prompt
+        while len(self._prompts) > self.max_size:
+            self._prompts.popitem(last=False)
+        return prompt
+
+    def invalidate(self, persona_ids=None):
+        if persona_ids is None:
+            self._prompts.clear()
+            return
+        ids = set(persona_ids)
+        # 統計の再読み込み（スレッド）から呼ばれるので、キーの一覧を先に取ってから消す
+        for key in [k for k in list(self._prompts) if k[0] in ids]:
+            self._prompts.pop(key, None)
+
+    def get_status(self) -> dict:
+        return {
+            "size": len(self._prompts),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "template_version": PROMPT_TEMPLATE_VERSION,
+        }
+
+prompt_cache = PromptCache()
+
+
+async def ask_persona(persona: Persona, question: str, model_name: str = "gemini-2.0-flash", profile: "PersonaProfile | None" = None,
+                      timeout: float | None = None) -> str:
+    system_prompt = prompt_cache.get(persona, profile)
+    response = await _generate(
+        model_name,
+        question,
+        types.GenerateContentConfig(system_instruction=system_prompt),
+        len(system_prompt) + len(question),
+        timeout=timeout,
+        persona_ids=(persona.id,),
     )
     return response.text
 
+# ── 複数ペルソナ一括回答（バルク質問用） ──────────────────────────────
+_BATCH_SYSTEM_TEMPLATE = """これから {count} 人の回答者それぞれになりきって、同じ質問に答えてもらいます。
+回答者ごとに下記の設定（プロフィール・話し方のルール）に従い、他の回答者の設定は混ぜないでください。
+
+{blocks}
+=== 出力形式 ===
+JSON オブジェクトのみを出力してください。キーは回答者ID、値はその回答者としての回答（文字列）です。
+全ての回答者ID（{ids}）について必ず回答を含めてください。
+"""
+
+_BATCH_BLOCK_TEMPLATE = """##### 回答者ID: {persona_id} #####
+{system_prompt}
+"""
+
+def parse_batch_answers(text: str, persona_ids: list[str]) -> dict[str, str]:
+    """一括回答のJSONを検証し、ID が一致して中身のある回答だけを返す"""
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    wanted = set(persona_ids)
+    return {
+        pid: answer.strip()
+        for pid, answer in data.items()
+        if pid in wanted and isinstance(answer, str) and answer.strip()
+    }
+
+async def ask_personas_batch(personas: list[Persona], question: str, model_name: str = "gemini-2.0-flash",
+                             timeout: float | None = None) -> dict[str, str]:
+    """1リクエストで複数ペルソナに回答させる。取得できた分だけ ペルソナID → 回答 で返す"""
+    ids = [p.id for p in personas]
+    system_prompt = _BATCH_SYSTEM_TEMPLATE.format(
+        count=len(personas),
+        blocks="\n".join(
+            _BATCH_BLOCK_TEMPLATE.format(persona_id=p.id, system_prompt=prompt_cache.get(p)) for p in personas
+        ),
+        ids="、".join(ids),
+    )
+    response = await _generate(
+        model_name,
+        question,
+        types.GenerateContentConfig(
+            system_instruction=system_prompt,
+            response_mime_type="application/json",
+        ),
+        len(system_prompt) + len(question),
+        timeout=timeout,
+        persona_ids=ids,
+    )
+    return parse_batch_answers(response.text, ids)
+
 async def ask_persona_with_history(
     persona: Persona,
     message: str,
@@ -162,20 +351,108 @@ async def ask_persona_with_history(
     model_name: str = "gemini-2.0-flash",
     profile: "PersonaProfile | None" = None,
 ) -> str:
-    await usage_tracker.wait_if_needed()
-    system_prompt = build_system_prompt(persona, profile)
+    system_prompt = prompt_cache.get(persona, profile)
+    response = await _generate(
+        model_name,
+        _history_contents(history, message),
+        types.GenerateContentConfig(system_instruction=system_prompt),
+        len(system_prompt) + len(message) + sum(len(h["content"]) for h in history),
+        persona_ids=(persona.id,),
+    )
+    return response.text
+
+def _history_contents(history: list[dict], message: str) -> list[types.Content]:
     contents = []
     for h in history:
         role = "user" if h["role"] == "user" else "model"
         contents.append(types.Content(role=role, parts=[types.Part(text=h["content"])]))
     contents.append(types.Content(role="user", parts=[types.Part(text=message)]))
-    response = await asyncio.to_thread(
-        _client.models.generate_content,
-        model=model_name,
-        contents=contents,
-        config=types.GenerateContentConfig(system_instruction=system_prompt),
-    )
-    return response.text
+    return contents
+
+def _usage_dict(usage) -> dict:
+    if usage is None:
+        return {}
+    return {
+        "prompt_tokens": usage.prompt_token_count or 0,
+        "output_tokens": usage.candidates_token_count or 0,
+        "cached_tokens": usage.cached_content_token_count or 0,
+        "thoughts_tokens": getattr(usage, "thoughts_token_count", None) or 0,
+        "total_tokens": usage.total_token_count or 0,
+    }
+
+async def stream_persona_with_history(
+    persona: Persona,
+    message: str,
+    history: list[dict],
+    model_name: str = "gemini-2.0-flash",
+    profile: "PersonaProfile | None" = None,
+):
+    """
+    ask_persona_with_history のストリーミング版。
+    {"type": "delta", "text": ...} を受信するたびに、最後に {"type": "done", "answer", "usage", "finish_reason"} を yield する。
+    """
+    system_prompt = prompt_cache.get(persona, profile)
+    prompt_chars = len(system_prompt) + len(message) + sum(len(h["content"]) for h in history)
+    meter = current_meter()
+    if meter is not None:
+        meter.check()
+    reservation = await _acquire(model_name, prompt_chars)
+    started = time.perf_counter()
+    send = RequestSend()
+    try:
+        stream = await asyncio.wait_for(
+            call_tracking_send(
+                send,
+                _backend.generate_content_stream,
+                model=model_name,
+                contents=_history_contents(history, message),
+                config=types.GenerateContentConfig(system_instruction=system_prompt),
+            ),
+            GEMINI_TIMEOUT,
+        )
+    except BaseException as e:
+        if not _reached_api(e, send.sent):
+            usage_tracker.refund(reservation)
+        _observe_call(model_name, started, e)
+        raise
+
+    parts: list[str] = []
+    usage = None
+    finish_reason = None
+    recorded = False
+    iterator = stream.__aiter__()
+    try:
+        while True:
+            # チャンク間の待ち時間にもタイムアウトをかける
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), GEMINI_TIMEOUT)
+            except StopAsyncIteration:
+                break
+            except BaseException as e:
+                _observe_call(model_name, started, e)
+                raise
+            if chunk.usage_metadata is not None:
+                usage = chunk.usage_metadata
+            if chunk.candidates and chunk.candidates[0].finish_reason is not None:
+                fr = chunk.candidates[0].finish_reason
+                finish_reason = getattr(fr, "value", str(fr))
+            text = chunk.text
+            if text:
+                parts.append(text)
+                yield {"type": "delta", "text": text}
+        _observe_call(model_name, started)
+        recorded = True
+        done = {
+            "type": "done",
+            "answer": "".join(parts),
+            "usage": _record_usage(reservation, usage, (persona.id,)),
+            "finish_reason": finish_reason,
+        }
+    finally:
+        # クライアントの切断（GeneratorExit / CancelledError）や途中のエラーでも、生成済みの分は消費されている
+        if not recorded:
+            _record_partial_usage(reservation, usage, sum(len(p) for p in parts), (persona.id,))
+    yield done
 
 async def enhance_persona_profile(
     persona: Persona,
@@ -183,7 +460,6 @@ async def enhance_persona_profile(
     model_name: str = "gemini-2.0-flash",
 ) -> str:
     """ルールベースで生成したプロファイルをGeminiが自然な文章に拡充する（オプション機能）"""
-    await usage_tracker.wait_if_needed()
     events_text = "\n".join(
         f"{e.year}年（{e.age}歳）: {e.event}" for e in profile.lifelog
     )
@@ -193,51 +469,168 @@ async def enhance_persona_profile(
 
 上記の経歴に基づき、この人物の人生を簡潔に振り返る「自己紹介コメント」を150〜200字で作成してください。
 一人称（「私は〜」）で書いてください。AIらしくなく、普通の日本人の話し言葉で。"""
-    response = await asyncio.to_thread(
-        _client.models.generate_content,
-        model=model_name,
-        contents=prompt,
-    )
+    response = await _generate(model_name, prompt, None, len(prompt), persona_ids=(persona.id,))
     return response.text
 
+def prompt_version(persona: Persona, profile: "PersonaProfile | None" = None) -> str:
+    """回答キャッシュのキーに使うシステムプロンプトのハッシュ"""
+    return hashlib.sha256(prompt_cache.get(persona, profile).encode("utf-8")).hexdigest()[:16]
+
+def _bulk_item(persona: Persona, answer: str, completed: int, total: int, cached: bool, failed: bool = False,
+               model: str | None = None) -> dict:
+    item = {
+        "completed": completed,
+        "total": total,
+        "persona_id": persona.id,
+        "persona_name": f"{persona.prefecture}の{persona.age}歳{persona.gender}",
+        "prefecture": persona.prefecture,
+        "age": persona.age,
+        "gender": persona.gender,
+        "occupation": persona.occupation,
+        "answer": answer,
+        "cached": cached,
+        "failed": failed,
+    }
+    # 使用量は毎回ではなく BULK_USAGE_EVERY 件ごとと最後だけ付ける（共有ストアでは1回ごとに問い合わせになるので）
+    if completed % BULK_USAGE_EVERY == 0 or completed == total:
+        item["usage"] = usage_tracker.usage_summary(model)
+    return item
+
+def _answer_for_error(e: Exception) -> str:
+    if is_rate_limited(e):
+        return "（APIクォータ超過のため回答できませんでした）"
+    return f"（エラー: {str(e)[:80]}）"
+
+# モデルごとに、直近の一括質問で AIMD が落ち着いた同時実行数（次の一括質問の初期値）
+_bulk_concurrency: dict[str, float] = {}
+# 一括質問で、読み手に渡していない結果（グループ単位）をこれだけためたら問い合わせを止める
+BULK_RESULT_BUFFER = max(1, int(os.getenv("BULK_RESULT_BUFFER", "8")))
+# 一括質問の progress に使用量（今日のリクエスト数・残り）を付ける間隔（件数）
+BULK_USAGE_EVERY = max(1, int(os.getenv("BULK_USAGE_EVERY", "10")))
+
 async def bulk_ask_stream(
     personas: list[Persona],
     question: str,
     concurrency: int = 5,
     model_name: str = "gemini-2.0-flash",
+    use_cache: bool = True,
+    batch_size: int = 1,
 ):
-    # バルク質問時は並列度を低く（レート制限を守るため）
-    effective_concurrency = min(concurrency, max(1, UsageTracker.RPM_LIMIT // 2))
-    semaphore = asyncio.Semaphore(effective_concurrency)
+    """
+    ペルソナごとの回答を完了順に yield する。
+    batch_size > 1 なら batch_size 人ずつ1リクエストにまとめ、欠けた回答だけ1人ずつ問い合わせ直す。
+    各 item の requests_saved は1人1リクエストの場合と比べて節約できたリクエスト数（累計）。
+    429・5xx・タイムアウトは retry_policy.RetryPolicy で再試行し、同時実行数は AIMD で調整する（concurrency が上限）。
+    retries は再試行した回数（累計）、concurrency はその時点の同時実行数の上限。
+    読み手が受け取っていない結果が BULK_RESULT_BUFFER 件たまると新しい問い合わせを止め、
+    ジェネレータを閉じると（aclose）未完了の問い合わせを取り消す。
+    """
+    total = len(personas)
+    completed = 0
+    requests_saved = 0
+
+    # キャッシュ済みの回答は先に全部流し、残りだけモデルに問い合わせる
+    versions = {p.id: prompt_version(p) for p in personas}
+    cached = await answer_cache.get_many_async(question, model_name, versions) if use_cache else {}
+    misses = []
+    for persona in personas:
+        if persona.id in cached:
+            completed += 1
+            item = _bulk_item(persona, cached[persona.id], completed, total, cached=True, model=model_name)
+            item["requests_saved"] = requests_saved
+            yield item
+        else:
+            misses.append(persona)
+
+    # 同時実行数は AIMD で調整する（concurrency が上限）。前回の一括質問で落ち着いた値から始める
+    limiter = AdaptiveConcurrency(
+        _bulk_concurrency.get(model_name, max(1, UsageTracker.RPM_LIMIT // 2)),
+        maximum=max(1, concurrency), label=model_name,
+    )
+    policy = RetryPolicy(label=model_name)
+    failed_ids: set[str] = set()
+
+    async def ask_one(persona: Persona) -> str:
+        try:
+            return await policy.run(lambda timeout: ask_persona(persona, question, model_name, timeout=timeout), limiter)
+        except Exception as e:
+            failed_ids.add(persona.id)
+            return _answer_for_error(e)
 
-    async def ask_one(persona: Persona) -> tuple[Persona, str]:
-        async with semaphore:
+    async def ask_group(group: list[Persona]) -> tuple[list[tuple[Persona, str]], int]:
+        """(回答一覧, 節約できたリクエスト数) を返す。回答はグループごとにまとめてキャッシュに書く"""
+        if len(group) == 1:
+            results, saved = [(group[0], await ask_one(group[0]))], 0
+        else:
             try:
-                answer = await ask_persona(persona, question, model_name)
+                answers = await policy.run(lambda timeout: ask_personas_batch(group, question, model_name, timeout=timeout), limiter)
+            except Exception:
+                answers = {}
+            results = [(p, answers[p.id]) for p in group if p.id in answers]
+            # 欠落・不正な回答は1人ずつ問い合わせ直す
+            retry = [p for p in group if p.id not in answers]
+            retried = await asyncio.gather(*(ask_one(p) for p in retry))
+            results.extend(zip(retry, retried))
+            # まとめた1回が全く使えなかった場合は1人ずつより1回多いが、節約数はマイナスにしない
+            saved = max(0, len(group) - 1 - len(retry))
+        await answer_cache.store([
+            (question, p.id, model_name, versions[p.id], answer) for p, answer in results if p.id not in failed_ids
+        ])
+        return results, saved
+
+    batch_size = max(1, batch_size)
+    groups = [misses[i:i + batch_size] for i in range(0, len(misses), batch_size)]
+    # 全員分のタスクを先に作らず、concurrency 個のワーカーが順にグループを取り出して問い合わせる。
+    # 結果は上限つきのキューで受け渡すので、読み手（SSE）が遅くてキューが埋まっている間は次のグループに進まない
+    pending = iter(groups)
+    started = asking = 0
+    finished: asyncio.Queue = asyncio.Queue(maxsize=BULK_RESULT_BUFFER)
+
+    async def worker():
+        nonlocal started, asking
+        for group in pending:
+            started += 1
+            asking += 1
+            BULK_TASKS_IN_FLIGHT.inc()
+            try:
+                result = await ask_group(group)
             except Exception as e:
-                err = str(e)
-                if "429" in err or "RESOURCE_EXHAUSTED" in err:
-                    answer = "（APIクォータ超過のため回答できませんでした）"
-                else:
-                    answer = f"（エラー: {err[:80]}）"
-            return persona, answer
-
-    tasks = [asyncio.create_task(ask_one(p)) for p in personas]
-    total = len(personas)
-    completed = 0
+                result = e
+            finally:
+                asking -= 1
+                BULK_TASKS_IN_FLIGHT.dec()
+            if finished.full():
+                t0 = time.perf_counter()
+                try:
+                    await finished.put(result)
+                finally:
+                    BULK_BACKPRESSURE.inc(time.perf_counter() - t0, model=model_name)
+            else:
+                finished.put_nowait(result)
 
-    for coro in asyncio.as_completed(tasks):
-        persona, answer = await coro
-        completed += 1
-        yield {
-            "completed": completed,
-            "total": total,
-            "persona_id": persona.id,
-            "persona_name": f"{persona.prefecture}の{persona.age}歳{persona.gender}",
-            "prefecture": persona.prefecture,
-            "age": persona.age,
-            "gender": persona.gender,
-            "occupation": persona.occupation,
-            "answer": answer,
-            "usage": usage_tracker.get_status(),
-        }
+    workers = [asyncio.create_task(worker()) for _ in range(min(len(groups), max(1, concurrency)))]
+    received = 0
+    try:
+        while received < len(groups):
+            result = await finished.get()
+            received += 1
+            if isinstance(result, Exception):
+                raise result
+            results, saved = result
+            requests_saved += saved
+            for persona, answer in results:
+                completed += 1
+                item = _bulk_item(persona, answer, completed, total, cached=False, failed=persona.id in failed_ids, model=model_name)
+                item["requests_saved"] = requests_saved
+                item["retries"] = policy.retries
+                item["concurrency"] = round(limiter.limit, 2)
+                yield item
+    finally:
+        _bulk_concurrency[model_name] = limiter.limit
+        # 途中で打ち切られた（クライアントの切断・購読の終了・トークン予算切れ）場合は未完了の問い合わせを取り消す
+        for task in workers:
+            task.cancel()
+        if len(groups) > started:
+            BULK_CANCELLED.inc(len(groups) - started, model=model_name, stage="queued")
+        if asking:
+            BULK_CANCELLED.inc(asking, model=model_name, stage="in_flight")
@@ -0,0 +1,299 @@
+"""
+インタビューのサーバー側セッション
+- クライアントは毎ターン新しいメッセージだけを送り、会話履歴はサーバーが保持する
+- 履歴はトークン予算（INTERVIEW_HISTORY_TOKENS）内に収める:
+    直近のやり取りはそのまま残し、予算を超えた古いやり取りは1行ずつの要約に畳んで先頭に付ける
+    要約自体も INTERVIEW_SUMMARY_TOKENS を超えたら古い行から捨てる
+  → 会話が何ターン続いても1ターンあたりのプロンプトはほぼ一定
+- 要約はルールベース（各発言の最初の一文を切り詰めて並べる）。要約のためにAPIの枠は使わない
+- セッションは LRU + 有効期限（INTERVIEW_SESSION_TTL 秒）で最大 INTERVIEW_SESSION_MAX 件まで保持
+- 保存先は INTERVIEW_SESSION_STORE で選ぶ:
+    local  : プロセス内（既定）。uvicorn --workers N では作ったワーカー以外で 404 になるので、ワーカー1つで使う
+    sqlite : INTERVIEW_SESSION_DB_PATH の SQLite（WAL）。全ワーカーで同じセッションを使える
+  同じセッションのターンを直列にするロックはプロセス内のもの。別々のワーカーに同時に届いた同じセッションの
+  ターンは後から保存した方が残る（1つのセッションは1つのクライアントが順に使う前提）
+"""
+import asyncio, json, os, re, sqlite3, threading, time, uuid
+from collections import OrderedDict, deque
+from weakref import WeakValueDictionary
+from gemini_client import CHARS_PER_TOKEN
+
+_SUMMARY_HEADER = "（これまでの会話の要約。古い順）"
+_SUMMARY_ACK = "はい、これまでのお話は覚えています。"
+_SENTENCE_END = re.compile(r"[。！？!?\n]")
+
+def _first_sentence(text: str, limit: int) -> str:
+    text = text.strip()
+    m = _SENTENCE_END.search(text)
+    head = text[:m.start() + 1].strip() if m else text
+    return head if len(head) <= limit else head[:limit] + "…"
+
+class InterviewSession:
+    HISTORY_TOKENS = int(os.getenv("INTERVIEW_HISTORY_TOKENS", "2000"))
+    SUMMARY_TOKENS = int(os.getenv("INTERVIEW_SUMMARY_TOKENS", "500"))
+    # 予算を超えても必ずそのまま残す直近のやり取り数
+    MIN_RECENT_TURNS = 2
+
+    def __init__(self, persona_id: str):
+        self.id = uuid.uuid4().hex
+        self.persona_id = persona_id
+        self.created_at = self.last_used = time.time()
+        self.turns: deque[tuple[str, str]] = deque()  # (質問, 返答)
+        self._turn_chars = 0
+        self.summary: deque[str] = deque()
+        self._summary_chars = 0
+        self.summarized_turns = 0
+        self.dropped_turns = 0
+        self.turn_count = 0
+
+    def add_turn(self, message: str, answer: str):
+        self.turns.append((message, answer))
+        self._turn_chars += len(message) + len(answer)
+        self.turn_count += 1
+        self._compact()
+
+    def seed(self, history: list[dict]):
+        """クライアント側の履歴（role / content の並び）から復元する"""
+        pending = None
+        for h in history:
+            if h.get("role") == "user":
+                pending = h.get("content", "")
+            elif pending is not None:
+                self.add_turn(pending, h.get("content", ""))
+                pending = None
+
+    def _compact(self):
+        budget = self.HISTORY_TOKENS * CHARS_PER_TOKEN
+        while len(self.turns) > self.MIN_RECENT_TURNS and self._turn_chars > budget:
+            message, answer = self.turns.popleft()
+            self._turn_chars -= len(message) + len(answer)
+            line = f"- 質問「{_first_sentence(message, 60)}」→ 返答「{_first_sentence(answer, 80)}」"
+            self.summary.append(line)
+            self._summary_chars += len(line)
+            self.summarized_turns += 1
+        summary_budget = self.SUMMARY_TOKENS * CHARS_PER_TOKEN
+        while len(self.summary) > 1 and self._summary_chars > summary_budget:
+            self._summary_chars -= len(self.summary.popleft())
+            self.dropped_turns += 1
+
+    def history(self) -> list[dict]:
+        """モデルに渡す履歴（要約 + 直近のやり取り）"""
+        history: list[dict] = []
+        if self.summary:
+            lines = [_SUMMARY_HEADER]
+            if self.dropped_turns:
+                lines.append(f"- （さらに前に {self.dropped_turns} 件のやり取りあり）")
+            lines.extend(self.summary)
+            history.append({"role": "user", "content": "\n".join(lines)})
+            history.append({"role": "model", "content": _SUMMARY_ACK})
+        for message, answer in self.turns:
+            history.append({"role": "user", "content": message})
+            history.append({"role": "model", "content": answer})
+        return history
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "persona_id": self.persona_id,
+            "created_at": self.created_at,
+            "turns": [list(t) for t in self.turns],
+            "summary": list(self.summary),
+            "summarized_turns": self.summarized_turns,
+            "dropped_turns": self.dropped_turns,
+            "turn_count": self.turn_count,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, last_used: float) -> "InterviewSession":
+        session = cls(data["persona_id"])
+        session.id = data["id"]
+        session.created_at = data["created_at"]
+        session.last_used = last_used
+        session.turns = deque((m, a) for m, a in data["turns"])
+        session._turn_chars = sum(len(m) + len(a) for m, a in session.turns)
+        session.summary = deque(data["summary"])
+        session._summary_chars = sum(map(len, session.summary))
+        session.summarized_turns = data["summarized_turns"]
+        session.dropped_turns = data["dropped_turns"]
+        session.turn_count = data["turn_count"]
+        return session
+
+    def info(self) -> dict:
+        return {
+            "session_id": self.id,
+            "persona_id": self.persona_id,
+            "turns": self.turn_count,
+            "verbatim_turns": len(self.turns),
+            "summarized_turns": self.summarized_turns,
+            "history_tokens": int((self._turn_chars + self._summary_chars) / CHARS_PER_TOKEN),
+        }
+
+class SessionStore:
+    """プロセス内のセッション（既定）。イベントループ上から呼ぶ"""
+    MAX_SIZE = int(os.getenv("INTERVIEW_SESSION_MAX", "1000"))
+    TTL_SECONDS = int(os.getenv("INTERVIEW_SESSION_TTL", "3600"))
+    # True のストアの操作は呼び出し側がスレッドで実行する
+    blocking = False
+
+    def __init__(self, max_size: int | None = None, ttl_seconds: int | None = None):
+        self.max_size = max_size or self.MAX_SIZE
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else self.TTL_SECONDS
+        self._sessions: OrderedDict[str, InterviewSession] = OrderedDict()
+        self._locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+        self.evicted = 0
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """1つのセッションで同時に2ターン進まないようにするロック（イベントループ上で取る）"""
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    def _expire(self, now: float):
+        # 最終利用順に並んでいるので、先頭から期限切れのものだけ捨てればよい
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used < self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def create(self, persona_id: str, history: list[dict] | None = None) -> InterviewSession:
+        self._expire(time.time())
+        session = InterviewSession(persona_id)
+        if history:
+            session.seed(history)
+        self._sessions[session.id] = session
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+        return session
+
+    def get(self, session_id: str) -> InterviewSession | None:
+        now = time.time()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def save(self, session: InterviewSession):
+        """ターンを進めたセッションを保存する（プロセス内のストアは同じオブジェクトを持っているので何もしない）"""
+
+    def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def get_status(self) -> dict:
+        return {
+            "store": "local",
+            "size": len(self._sessions),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "evicted": self.evicted,
+        }
+
+class SQLiteSessionStore(SessionStore):
+    """
+    全ワーカーで共有するセッション（SQLite, WAL）。get のたびに読み直すので、どのワーカーに届いても同じ履歴を使う。
+    操作はファイルを読み書きするので blocking = True（呼び出し側がスレッドで実行する）
+    """
+    blocking = True
+
+    def __init__(self, path: str, max_size: int | None = None, ttl_seconds: int | None = None):
+        super().__init__(max_size, ttl_seconds)
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS interview_sessions (
+                    id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS interview_sessions_last_used ON interview_sessions (last_used)")
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params=()) -> int:
+        """更新して変わった行数を返す"""
+        with self._db_lock:
+            return self._connect().execute(sql, params).rowcount
+
+    def _query(self, sql: str, params=()) -> list[tuple]:
+        with self._db_lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def _evict(self, sql: str, params):
+        with self._db_lock:
+            self.evicted += self._connect().execute(sql, params).rowcount
+
+    def _expire(self, now: float):
+        self._evict("DELETE FROM interview_sessions WHERE last_used <= ?", (now - self.ttl_seconds,))
+
+    def create(self, persona_id: str, history: list[dict] | None = None) -> InterviewSession:
+        now = time.time()
+        self._expire(now)
+        session = InterviewSession(persona_id)
+        if history:
+            session.seed(history)
+        self._execute(
+            "INSERT INTO interview_sessions (id, data, last_used) VALUES (?, ?, ?)",
+            (session.id, json.dumps(session.to_dict(), ensure_ascii=False), now),
+        )
+        # 上限を超えた分は最終利用が古いものから捨てる
+        self._evict(
+            "DELETE FROM interview_sessions WHERE id IN "
+            "(SELECT id FROM interview_sessions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,),
+        )
+        return session
+
+    def get(self, session_id: str) -> InterviewSession | None:
+        now = time.time()
+        self._expire(now)
+        rows = self._query("SELECT data FROM interview_sessions WHERE id = ?", (session_id,))
+        if not rows:
+            return None
+        self._execute("UPDATE interview_sessions SET last_used = ? WHERE id = ?", (now, session_id))
+        return InterviewSession.from_dict(json.loads(rows[0][0]), now)
+
+    def save(self, session: InterviewSession):
+        session.last_used = time.time()
+        self._execute(
+            "UPDATE interview_sessions SET data = ?, last_used = ? WHERE id = ?",
+            (json.dumps(session.to_dict(), ensure_ascii=False), session.last_used, session.id),
+        )
+
+    def delete(self, session_id: str) -> bool:
+        return self._execute("DELETE FROM interview_sessions WHERE id = ?", (session_id,)) > 0
+
+    def get_status(self) -> dict:
+        ((size,),) = self._query("SELECT COUNT(*) FROM interview_sessions")
+        return {
+            "store": "sqlite",
+            "size": size,
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "evicted": self.evicted,
+        }
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), "data", "interview_sessions.sqlite3")
+
+def create_session_store() -> SessionStore:
+    """INTERVIEW_SESSION_STORE に応じたストアを作る"""
+    name = os.getenv("INTERVIEW_SESSION_STORE", "local").strip().lower()
+    if name == "sqlite":
+        return SQLiteSessionStore(os.getenv("INTERVIEW_SESSION_DB_PATH") or DEFAULT_DB_PATH)
+    if name != "local":
+        raise ValueError(f"Unknown INTERVIEW_SESSION_STORE: {name}")
+    return SessionStore()
+
+interview_sessions = create_session_store()
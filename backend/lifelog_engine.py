@@ -5,16 +5,24 @@
   2. 内面・悩み: 生活満足度、将来の不安、仕事観（国民生活世論調査ベース）
   3. 習慣・変化: ライフスタイル、価値観の変遷（生活定点ベース）
   4. 情報収集: SNS利用率、メディア信頼度（SNS利用動向調査ベース）
+プロファイルはペルソナIDから導いたseedで生成し、ProfileCache（LRU）で使い回す。
+同じペルソナには毎回同じ経歴が返る。
 """
-import random
+import hashlib, os, random, threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from models import Persona, LifeLogEvent, PsychProfile, PersonaProfile
+from metrics import CACHE_REQUESTS, PROFILE_BUILD
 
 CURRENT_YEAR = 2026
+# 生成ルールを変えたら上げる（seed とプロンプトキャッシュのキーに含まれる）
+PROFILE_VERSION = 2
 
 # ── ライフログ生成 ──────────────────────────────────────────────────
 
 # 学歴ルール: 雇用形態・職業・年収から最終学歴を推定
-def _estimate_education(occupation: str, employment_type: str, annual_income: int) -> str:
+def _estimate_education(occupation: str, employment_type: str, annual_income: int, rng=None) -> str:
+    rng = rng or random
     occ_lower = occupation.lower()
     high_edu_keywords = ["エンジニア", "研究員", "教員", "大学", "薬剤師", "看護師", "医師", "アナリスト", "MR"]
     if any(k in occupation for k in high_edu_keywords) or annual_income >= 600:
@@ -23,12 +31,13 @@ def _estimate_education(occupation: str, employment_type: str, annual_income: in
         return "highschool"
     if any(k in occupation for k in ["職人", "漁師", "農家", "溶接工", "運転手", "工場"]):
         return "vocational"  # 専門・工業高校
-    return random.choice(["highschool", "university", "vocational"])
+    return rng.choice(["highschool", "university", "vocational"])
 
-def generate_lifelog_events(persona: Persona) -> list[LifeLogEvent]:
+def generate_lifelog_events(persona: Persona, rng=None) -> list[LifeLogEvent]:
+    rng = rng or random
     birth_year = CURRENT_YEAR - persona.age
     events: list[LifeLogEvent] = []
-    edu = _estimate_education(persona.occupation, persona.employment_type, persona.annual_income)
+    edu = _estimate_education(persona.occupation, persona.employment_type, persona.annual_income, rng)
 
     def add(age: int, event: str, category: str):
         events.append(LifeLogEvent(
@@ -71,41 +80,42 @@ def generate_lifelog_events(persona: Persona) -> list[LifeLogEvent]:
         if persona.employment_type == "unemployed":
             add(work_start_age, "就職活動を開始（現在求職中）", "work")
         elif persona.employment_type == "self_employed":
-            add(work_start_age + random.randint(0, 5), f"{persona.major_industry}分野で独立・開業", "work")
+            add(work_start_age + rng.randint(0, 5), f"{persona.major_industry}分野で独立・開業", "work")
         else:
             add(work_start_age, f"{persona.major_industry}関連の企業に就職", "work")
 
     # 転職 (20代後半〜30代で低確率)
     if persona.age >= 28 and persona.employment_type == "full_time":
-        if random.random() < 0.45:
-            t_age = random.randint(26, min(35, persona.age - 1))
+        if rng.random() < 0.45:
+            t_age = rng.randint(26, min(35, persona.age - 1))
             add(t_age, "転職。現在の職場に就く", "work")
 
     # 結婚 (世帯構成から判断)
     marriage_types = {"夫婦二人暮らし（子なし）", "夫婦と子供", "三世代同居"}
     if persona.household_type in marriage_types and persona.age >= 25:
-        m_age = random.randint(24, min(35, persona.age - 1)) if persona.age > 25 else 25
+        m_age = rng.randint(24, min(35, persona.age - 1)) if persona.age > 25 else 25
         add(m_age, "結婚。新生活を開始", "family")
 
     # 第一子誕生
     if "子供" in persona.household_type and persona.age >= 28:
-        c_age = random.randint(26, min(38, persona.age - 3))
+        # 28歳は子供が3歳以上になるよう25歳で（26歳からだと範囲が空になる）
+        c_age = rng.randint(min(26, persona.age - 3), min(38, persona.age - 3))
         add(c_age, "第一子が誕生", "family")
 
     # 住宅購入
     if persona.housing == "持ち家" and persona.age >= 30:
-        buy_age = random.randint(29, min(45, persona.age - 1))
+        buy_age = rng.randint(29, min(45, persona.age - 1))
         add(buy_age, "マイホームを購入。現在の住居へ移転", "residence")
 
     # 昇進・転機
     if persona.age >= 35 and persona.employment_type == "full_time" and persona.annual_income >= 450:
-        if random.random() < 0.5:
-            senior_age = random.randint(32, min(45, persona.age - 1))
+        if rng.random() < 0.5:
+            senior_age = rng.randint(32, min(45, persona.age - 1))
             add(senior_age, "チームリーダー・主任に昇進", "work")
 
     # 子供の独立（60代以上）
     if persona.age >= 60 and "子供" in persona.household_type:
-        add(persona.age - random.randint(3, 8), "子供が独立・巣立ちしていく", "family")
+        add(persona.age - rng.randint(3, 8), "子供が独立・巣立ちしていく", "family")
 
     # 退職（65歳以上）
     if persona.age >= 65 and persona.employment_type not in ("part_time",):
@@ -216,12 +226,13 @@ INFO_SOURCES_BY_AGE = {
     "60s+": ["テレビ", "新聞", "ラジオ", "口コミ・近所との会話"],
 }
 
-def generate_psych_profile(persona: Persona) -> PsychProfile:
+def generate_psych_profile(persona: Persona, rng=None) -> PsychProfile:
+    rng = rng or random
     tier = _income_tier(persona.annual_income)
     age_br = _age_bracket(persona.age)
 
     satisfaction_opts = SATISFACTION_MAP.get(tier, SATISFACTION_MAP["mid_low"])
-    life_satisfaction = random.choice(satisfaction_opts)
+    life_satisfaction = rng.choice(satisfaction_opts)
 
     anxieties = list(ANXIETY_MAP.get(tier, ANXIETY_MAP["mid_low"]))
     # 子育て世帯は教育費不安を追加
@@ -230,13 +241,13 @@ def generate_psych_profile(persona: Persona) -> PsychProfile:
     # ひとり親は孤立不安追加
     if "ひとり親" in persona.household_type:
         anxieties.append("育児と仕事の両立")
-    random.shuffle(anxieties)
+    rng.shuffle(anxieties)
 
     work_opts = WORK_VALUES_MAP.get(persona.employment_type, WORK_VALUES_MAP["full_time"])
-    work_values = random.choice(work_opts)
+    work_values = rng.choice(work_opts)
 
     lifestyle_opts = LIFESTYLE_HABITS_MAP.get(tier, LIFESTYLE_HABITS_MAP["mid_low"])
-    lifestyle_habits = list(random.choice(lifestyle_opts))
+    lifestyle_habits = list(rng.choice(lifestyle_opts))
 
     # 性格特性から習慣を1つ追加
     trait_habit_map = {
@@ -280,9 +291,91 @@ def generate_psych_profile(persona: Persona) -> PsychProfile:
     )
 
 
-def generate_persona_profile(persona: Persona) -> PersonaProfile:
-    """ライフログ + 心理プロファイルを一括生成"""
+def profile_seed(persona_id: str) -> int:
+    """ペルソナIDから決まるseed（プロセスやPYTHONHASHSEEDに依存しない）"""
+    digest = hashlib.sha256(f"{PROFILE_VERSION}:{persona_id}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+def generate_persona_profile(persona: Persona, rng=None) -> PersonaProfile:
+    """ライフログ + 心理プロファイルを一括生成（rng 省略時はペルソナID由来のseedで決定的に生成）"""
+    rng = rng or random.Random(profile_seed(persona.id))
     return PersonaProfile(
-        lifelog=generate_lifelog_events(persona),
-        psych=generate_psych_profile(persona),
+        lifelog=generate_lifelog_events(persona, rng),
+        psych=generate_psych_profile(persona, rng),
     )
+
+# ── プロファイルキャッシュ ───────────────────────────────────────────
+class ProfileCache:
+    MAX_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+
+    def __init__(self, max_size: int | None = None):
+        self.max_size = max_size or self.MAX_SIZE
+        self._profiles: OrderedDict[str, PersonaProfile] = OrderedDict()
+        # スレッドプールの同期エンドポイントと統計の再読み込み（スレッド）から触るので、LRU の操作はロックの下で行う
+        self._lock = threading.Lock()
+        # 生成前に問い合わせる共有スナップショット（persona_id → PersonaProfile | None）
+        self.source = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, persona: Persona) -> PersonaProfile:
+        with self._lock:
+            profile = self._profiles.get(persona.id)
+            if profile is not None:
+                self._profiles.move_to_end(persona.id)
+                self.hits += 1
+        if profile is not None:
+            CACHE_REQUESTS.inc(cache="profile", result="hit")
+            return profile
+        profile = self.source(persona.id) if self.source is not None else None
+        if profile is not None:
+            CACHE_REQUESTS.inc(cache="profile", result="snapshot")
+            self._put(persona.id, profile, hit=True)
+            return profile
+        CACHE_REQUESTS.inc(cache="profile", result="miss")
+        with PROFILE_BUILD.time():
+            profile = generate_persona_profile(persona)
+        self._put(persona.id, profile, hit=False)
+        return profile
+
+    def _put(self, persona_id: str, profile: PersonaProfile, hit: bool | None = None):
+        with self._lock:
+            if hit is not None:
+                self.hits += hit
+                self.misses += not hit
+            self._profiles[persona_id] = profile
+            self._profiles.move_to_end(persona_id)
+            while len(self._profiles) > self.max_size:
+                self._profiles.popitem(last=False)
+
+    def precompute(self, personas: list[Persona], workers: int | None = None):
+        """起動時に一括生成しておく（キャッシュ上限を超える分は生成しない）"""
+        with self._lock:
+            targets = [p for p in personas if p.id not in self._profiles][: self.max_size]
+        workers = workers if workers is not None else (os.cpu_count() or 1)
+        if workers > 1 and len(targets) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                profiles = list(pool.map(generate_persona_profile, targets, chunksize=64))
+        else:
+            profiles = [generate_persona_profile(p) for p in targets]
+        for p, profile in zip(targets, profiles):
+            self._put(p.id, profile)
+
+    def invalidate(self, persona_ids=None):
+        with self._lock:
+            if persona_ids is None:
+                self._profiles.clear()
+                return
+            for pid in persona_ids:
+                self._profiles.pop(pid, None)
+
+    def get_status(self) -> dict:
+        return {
+            "size": len(self._profiles),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "version": PROFILE_VERSION,
+        }
+
+profile_cache = ProfileCache()
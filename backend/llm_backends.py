@@ -0,0 +1,346 @@
+"""
+LLM バックエンド（LLM_BACKEND 環境変数で切り替え）
+  gemini : Google Gemini（既定。GEMINI_API_KEY が必要）
+  fake   : 決定的なローカル偽モデル。API キー不要で、遅延分布・429 注入・ストリーミングを再現する（負荷試験・CI 用）
+  openai : OpenAI 互換 HTTP API（llama.cpp server / vLLM / Ollama などのローカルモデル）
+どのバックエンドも google-genai と同じ形の generate_content / generate_content_stream を持ち、
+応答も types.GenerateContentResponse で返す。レート制限・使用量記録・メトリクスは gemini_client 側で共通に行う。
+エラーは errors.APIError（429 なら "429 RESOURCE_EXHAUSTED ..."）に揃えるので、retry_policy.is_rate_limited の判定がそのまま使える。
+"""
+import asyncio, hashlib, importlib.util, json, math, os, random, re
+from contextvars import ContextVar
+from google import genai
+from google.genai import errors, types
+
+DEFAULT_BACKEND = "gemini"
+
+# ── 共通 ───────────────────────────────────────────────────────────
+def _messages(contents, config: "types.GenerateContentConfig | None") -> list[tuple[str, str]]:
+    """(role, text) の並びにする。role は system / user / model"""
+    messages: list[tuple[str, str]] = []
+    system = getattr(config, "system_instruction", None) if config is not None else None
+    if system:
+        messages.append(("system", system if isinstance(system, str) else str(system)))
+    if isinstance(contents, str):
+        messages.append(("user", contents))
+        return messages
+    for c in contents:
+        if isinstance(c, str):
+            messages.append(("user", c))
+        else:
+            messages.append((c.role or "user", "".join(p.text or "" for p in (c.parts or []))))
+    return messages
+
+def _json_mode(config: "types.GenerateContentConfig | None") -> bool:
+    return config is not None and getattr(config, "response_mime_type", None) == "application/json"
+
+def _response(text: str, usage: dict | None, finish_reason: "types.FinishReason | None" = types.FinishReason.STOP) -> types.GenerateContentResponse:
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+            finish_reason=finish_reason,
+        )],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(**usage) if usage else None,
+    )
+
+def _rate_limited(message: str) -> errors.APIError:
+    return errors.ClientError(429, {"error": {"code": 429, "message": message, "status": "RESOURCE_EXHAUSTED"}})
+
+# ── 送信の追跡 ─────────────────────────────────────────────────────
+class RequestSend:
+    """
+    1回の呼び出しでリクエストを送り始めたか。
+    送信前（接続プールの空き待ち・接続中）のキャンセル・タイムアウトは API に届いていないので、gemini_client が枠を返却する
+    """
+    __slots__ = ("sent",)
+
+    def __init__(self):
+        self.sent = False
+
+_current_send: ContextVar["RequestSend | None"] = ContextVar("llm_request_send", default=None)
+
+def mark_sent():
+    send = _current_send.get()
+    if send is not None:
+        send.sent = True
+
+async def call_tracking_send(send: RequestSend, fn, **kwargs):
+    """バックエンドの呼び出し中に送信したら send.sent を立てる"""
+    token = _current_send.set(send)
+    try:
+        return await fn(**kwargs)
+    finally:
+        _current_send.reset(token)
+
+async def _trace(event: str, info: dict):
+    if event.endswith("send_request_headers.started"):
+        mark_sent()
+
+async def _trace_send(request):
+    """httpx の request フック。httpcore の trace でリクエストヘッダーを書き始めた時点を送信とみなす"""
+    request.extensions["trace"] = _trace
+
+HTTPX_EVENT_HOOKS = {"request": [_trace_send]}
+
+# ── Gemini ─────────────────────────────────────────────────────────
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self, api_key: str, timeout: float):
+        # SDK の非同期クライアントは接続プールを共有する（keep-alive で使い回す）
+        self._client = genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(timeout=int(timeout * 1000), async_client_args={"event_hooks": HTTPX_EVENT_HOOKS}),
+        )
+        # aiohttp が入っていると SDK はそちらを使い、httpx のフックが効かない。その場合は呼び出した時点で送信とみなす
+        self._traced = importlib.util.find_spec("aiohttp") is None
+
+    async def generate_content(self, model, contents, config=None):
+        if not self._traced:
+            mark_sent()
+        return await self._client.aio.models.generate_content(model=model, contents=contents, config=config)
+
+    async def generate_content_stream(self, model, contents, config=None):
+        if not self._traced:
+            mark_sent()
+        return await self._client.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+
+# ── 偽モデル ───────────────────────────────────────────────────────
+class LatencyDistribution:
+    """
+    "fixed:300" / "uniform:200,1500" / "normal:800,200" / "lognormal:800,0.5"（中央値ms, σ）
+    いずれもミリ秒で指定し、負の値は 0 に丸める
+    """
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        self.kind = kind.strip() or "fixed"
+        self.params = [float(x) for x in params.split(",") if x.strip()] or [0.0]
+        if self.kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"unknown latency distribution: {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        """秒で返す"""
+        p = self.params
+        if self.kind == "uniform":
+            ms = rng.uniform(p[0], p[1] if len(p) > 1 else p[0])
+        elif self.kind == "normal":
+            ms = rng.gauss(p[0], p[1] if len(p) > 1 else 0.0)
+        elif self.kind == "lognormal":
+            ms = p[0] * math.exp(rng.gauss(0.0, p[1] if len(p) > 1 else 0.5))
+        else:
+            ms = p[0]
+        return max(0.0, ms) / 1000
+
+_BATCH_ID_RE = re.compile(r"回答者ID: (\S+) #")
+_OPTIONS_RE = re.compile(r"選択肢: (.+)")
+_FAKE_OPENINGS = [
+    "そうですね、", "うーん、正直に言うと", "私の場合は", "難しいですけど、", "個人的には",
+]
+_FAKE_BODIES = [
+    "毎日の生活費とのバランスを考えて決めると思います。",
+    "家族の意見も聞いてから判断したいですね。",
+    "周りの評判を見てから考えるタイプです。",
+    "値段が手頃なら前向きに検討します。",
+    "今の暮らしに大きな不満はないので、急いではいません。",
+    "仕事が忙しくて、あまり考えたことがありませんでした。",
+]
+
+class FakeBackend:
+    """
+    同じ入力には常に同じ回答を返す偽モデル（回答はプロンプトのハッシュで決まる）。
+    遅延と 429 は FAKE_LLM_SEED から始まる乱数列で決まるので、呼び出し順が同じなら再現できる。
+    FAKE_LLM_LATENCY     : 応答までの遅延分布（LatencyDistribution の書式）
+    FAKE_LLM_429_RATE    : 429 を返す確率
+    FAKE_LLM_CHUNK_CHARS : ストリーミング時の1チャンクの文字数
+    """
+    name = "fake"
+
+    def __init__(self, latency: str | None = None, rate_429: float | None = None, seed: int | None = None, chunk_chars: int | None = None):
+        self.latency = LatencyDistribution(latency or os.getenv("FAKE_LLM_LATENCY", "lognormal:800,0.4"))
+        self.rate_429 = rate_429 if rate_429 is not None else float(os.getenv("FAKE_LLM_429_RATE", "0"))
+        self.chunk_chars = chunk_chars or int(os.getenv("FAKE_LLM_CHUNK_CHARS", "8"))
+        self._rng = random.Random(seed if seed is not None else int(os.getenv("FAKE_LLM_SEED", "0")))
+        self.calls = 0
+
+    def _answer(self, model: str, messages: list[tuple[str, str]], json_mode: bool) -> str:
+        digest = hashlib.sha256(json.dumps([model, messages], ensure_ascii=False).encode("utf-8")).digest()
+        system = next((text for role, text in messages if role == "system"), "")
+        question = messages[-1][1] if messages else ""
+
+        def reply(salt: str) -> str:
+            h = hashlib.sha256(digest + salt.encode("utf-8")).digest()
+            text = _FAKE_OPENINGS[h[0] % len(_FAKE_OPENINGS)] + _FAKE_BODIES[h[1] % len(_FAKE_BODIES)]
+            # 選択肢付きの質問なら選択肢を1つ選んで冒頭に書く（サンプリング・集計の符号化用）
+            m = _OPTIONS_RE.search(question)
+            if m:
+                options = re.findall(r"「([^」]+)」", m.group(1))
+                if options:
+                    text = f"{options[h[2] % len(options)]}です。{text}"
+            return text
+
+        if json_mode:
+            ids = _BATCH_ID_RE.findall(system)
+            return json.dumps({pid: reply(pid) for pid in ids}, ensure_ascii=False)
+        return reply("")
+
+    def _usage(self, messages: list[tuple[str, str]], answer: str) -> dict:
+        prompt = sum(len(text) for _, text in messages)
+        prompt_tokens, output_tokens = int(prompt / 1.5) + 1, int(len(answer) / 1.5) + 1
+        return {
+            "prompt_token_count": prompt_tokens,
+            "candidates_token_count": output_tokens,
+            "total_token_count": prompt_tokens + output_tokens,
+        }
+
+    def _draw(self) -> tuple[float, bool]:
+        self.calls += 1
+        return self.latency.sample(self._rng), self._rng.random() < self.rate_429
+
+    async def generate_content(self, model, contents, config=None):
+        mark_sent()
+        delay, limited = self._draw()
+        await asyncio.sleep(delay)
+        if limited:
+            raise _rate_limited("fake backend: injected rate limit")
+        messages = _messages(contents, config)
+        answer = self._answer(model, messages, _json_mode(config))
+        return _response(answer, self._usage(messages, answer))
+
+    async def generate_content_stream(self, model, contents, config=None):
+        mark_sent()
+        delay, limited = self._draw()
+        # 最初のチャンクまでに遅延の 3 割、残りをチャンク間に均等に配分する
+        await asyncio.sleep(delay * 0.3)
+        if limited:
+            raise _rate_limited("fake backend: injected rate limit")
+        messages = _messages(contents, config)
+        answer = self._answer(model, messages, _json_mode(config))
+        chunks = [answer[i:i + self.chunk_chars] for i in range(0, len(answer), self.chunk_chars)] or [""]
+        gap = delay * 0.7 / len(chunks)
+        usage = self._usage(messages, answer)
+
+        async def stream():
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(gap)
+                last = i == len(chunks) - 1
+                yield _response(chunk, usage if last else None, types.FinishReason.STOP if last else None)
+        return stream()
+
+# ── OpenAI 互換 ────────────────────────────────────────────────────
+class OpenAICompatibleBackend:
+    """
+    /v1/chat/completions を話すサーバー向け。
+    OPENAI_BASE_URL : 例 http://127.0.0.1:8080/v1
+    OPENAI_API_KEY  : 不要なサーバーなら空でよい
+    OPENAI_MODEL    : 指定するとリクエストのモデル名（GEMINI_MODEL）の代わりに使う
+    """
+    name = "openai"
+
+    def __init__(self, base_url: str, api_key: str | None, model: str | None, timeout: float):
+        import httpx
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._http = httpx.AsyncClient(base_url=base_url.rstrip("/"), headers=headers, timeout=timeout, event_hooks=HTTPX_EVENT_HOOKS)
+        self.model = model
+
+    def _payload(self, model, contents, config, stream: bool) -> dict:
+        roles = {"system": "system", "user": "user", "model": "assistant"}
+        payload = {
+            "model": self.model or model,
+            "messages": [{"role": roles.get(role, "user"), "content": text} for role, text in _messages(contents, config)],
+            "stream": stream,
+        }
+        if _json_mode(config):
+            payload["response_format"] = {"type": "json_object"}
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    @staticmethod
+    def _usage(usage: dict | None) -> dict | None:
+        if not usage:
+            return None
+        return {
+            "prompt_token_count": usage.get("prompt_tokens", 0),
+            "candidates_token_count": usage.get("completion_tokens", 0),
+            "total_token_count": usage.get("total_tokens", 0),
+        }
+
+    @staticmethod
+    def _finish(reason: str | None) -> "types.FinishReason | None":
+        if reason is None:
+            return None
+        return types.FinishReason.MAX_TOKENS if reason == "length" else types.FinishReason.STOP
+
+    @staticmethod
+    async def _raise_for_status(res):
+        if res.status_code < 400:
+            return
+        body = (await res.aread()).decode("utf-8", "replace")
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = {"error": {"message": body[:200]}}
+        error = data.get("error") if isinstance(data.get("error"), dict) else {"message": str(data.get("error") or body[:200])}
+        if res.status_code == 429:
+            error.setdefault("status", "RESOURCE_EXHAUSTED")
+            # Retry-After は Gemini と同じ RetryInfo の形にしておく（retry_policy が読む）
+            retry_after = res.headers.get("retry-after", "")
+            if retry_after.replace(".", "", 1).isdigit():
+                error.setdefault("details", []).append({"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_after}s"})
+        error.setdefault("code", res.status_code)
+        cls = errors.ServerError if res.status_code >= 500 else errors.ClientError
+        raise cls(res.status_code, {"error": error})
+
+    async def generate_content(self, model, contents, config=None):
+        res = await self._http.post("/chat/completions", json=self._payload(model, contents, config, stream=False))
+        await self._raise_for_status(res)
+        data = res.json()
+        choice = data["choices"][0]
+        return _response(choice["message"].get("content") or "", self._usage(data.get("usage")), self._finish(choice.get("finish_reason")))
+
+    async def generate_content_stream(self, model, contents, config=None):
+        request = self._http.build_request("POST", "/chat/completions", json=self._payload(model, contents, config, stream=True))
+        res = await self._http.send(request, stream=True)
+        try:
+            await self._raise_for_status(res)
+        except BaseException:
+            await res.aclose()
+            raise
+
+        async def stream():
+            try:
+                async for line in res.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    choice = (chunk.get("choices") or [{}])[0]
+                    text = (choice.get("delta") or {}).get("content") or ""
+                    usage = self._usage(chunk.get("usage"))
+                    finish = self._finish(choice.get("finish_reason"))
+                    if text or usage or finish:
+                        yield _response(text, usage, finish)
+            finally:
+                await res.aclose()
+        return stream()
+
+def create_backend(timeout: float):
+    """LLM_BACKEND に応じたバックエンドを作る"""
+    name = os.getenv("LLM_BACKEND", DEFAULT_BACKEND).strip().lower()
+    if name == "fake":
+        return FakeBackend()
+    if name == "openai":
+        base_url = os.getenv("OPENAI_BASE_URL")
+        if not base_url:
+            raise ValueError("OPENAI_BASE_URL environment variable is not set")
+        return OpenAICompatibleBackend(base_url, os.getenv("OPENAI_API_KEY"), os.getenv("OPENAI_MODEL"), timeout)
+    if name != "gemini":
+        raise ValueError(f"Unknown LLM_BACKEND: {name}")
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY environment variable is not set")
+    return GeminiBackend(api_key, timeout)
@@ -1,43 +1,143 @@
 """
 FastAPI メインアプリ
 エンドポイント:
-  GET  /api/personas          - ペルソナ一覧
+  GET  /api/personas          - ペルソナ一覧（カーソルでページ分割・fields で項目を選択。事前シリアライズ・圧縮済み、ETag 付き）
   GET  /api/personas/{id}     - ペルソナ詳細
   POST /api/bulk-question     - 一括質問（SSEストリーミング）
+  POST /api/bulk-question/sample - 層化サンプリングで一部に質問し回答分布を推計（SSE）
+  POST /api/bulk-jobs         - 一括質問ジョブの作成（サーバー側で実行・途中再開可）
+  GET  /metrics               - Prometheus 形式のメトリクス
+  GET  /api/bulk-jobs/{id}/events - ジョブのイベント（SSE, Last-Event-ID で再接続）
   POST /api/interview/{id}    - 個別インタビュー（会話履歴付き）
+  POST /api/interview/{id}/stream - 個別インタビュー（SSEで逐次返答）
+  POST /api/interview/{id}/sessions - インタビューセッションの作成（以降は新しいメッセージだけ送ればよい）
 """
-import json, os, asyncio
-from contextlib import asynccontextmanager
+import base64, json, os, asyncio
+from bisect import bisect_right
+from contextlib import asynccontextmanager, aclosing
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from sse_starlette.sse import EventSourceResponse
 
-from models import Persona, BulkQuestionRequest, InterviewRequest
-from persona_engine import load_all_personas
-from lifelog_engine import generate_persona_profile
-from gemini_client import init_gemini, bulk_ask_stream, ask_persona_with_history, enhance_persona_profile, usage_tracker
+from models import PersonaFilter, PersonaListQuery, BulkQuestionRequest, SampledQuestionRequest, InterviewRequest, InterviewSessionRequest
+from persona_engine import load_or_generate_personas, generate_prefectures, open_shared_personas
+from population_engine import load_population
+from persona_store import PersonaStore, PERSONA_FIELDS
+from lifelog_engine import profile_cache
+from gemini_client import (
+    init_llm_backend, bulk_ask_stream, ask_persona_with_history, stream_persona_with_history,
+    enhance_persona_profile, usage_tracker, prompt_cache,
+)
+from answer_cache import answer_cache
+from bulk_jobs import bulk_jobs, BulkJob
+from sampling import sampled_ask_stream, coded_question
+from bulk_aggregator import BulkAggregator
+from bulk_broadcast import bulk_flights, flight_key
+from interview_sessions import interview_sessions, InterviewSession
+from token_usage import token_ledger, TokenMeter, attribute_usage
+from metrics import MetricsMiddleware, SSE_EVENTS, SSE_DISCONNECTS, render_metrics
+from catalog_cache import catalog_cache
+from stats_index import StatsIndex, STATS_RELOAD_INTERVAL
+from retry_policy import is_rate_limited
 
 # ── グローバルストア ──────────────────────────────────────────────
-PERSONAS: dict[str, Persona] = {}
+PERSONAS = PersonaStore()
 STATS_PATH = os.path.join(os.path.dirname(__file__), "data", "stats_by_prefecture.json")
+STATS = StatsIndex(STATS_PATH)
+SNAPSHOT_PATH = os.getenv("PERSONA_SNAPSHOT_PATH") or os.path.join(os.path.dirname(__file__), "data", "personas_snapshot.jsonl.gz")
+PERSONA_SEED = int(os.getenv("PERSONA_SEED", "42"))
+# 設定すると uvicorn --workers N の全ワーカーで同じペルソナ（とプロファイル）を mmap で共有する
+SHARED_SNAPSHOT_PATH = os.getenv("PERSONA_SHARED_SNAPSHOT_PATH", "")
+# 0 なら各都道府県10人（470人）。1万〜100万などを指定すると人口比の大規模母集団を生成して使う（population_engine）
+PERSONA_POPULATION = int(os.getenv("PERSONA_POPULATION", "0"))
+PERSONA_POPULATION_WORKERS = int(os.getenv("PERSONA_POPULATION_WORKERS", "1"))
+BULK_BATCH_SIZE_MAX = 20
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 起動時: 統計データを生成 → ペルソナをロード
+    # 起動時: 統計データを生成 → ペルソナをスナップショットからロード（なければseed付きで生成）
     if not os.path.exists(STATS_PATH):
         import subprocess, sys
         subprocess.run([sys.executable, os.path.join(os.path.dirname(__file__), "data", "generate_stats.py")])
 
-    init_gemini()
-    personas = load_all_personas(STATS_PATH)
-    for p in personas:
-        PERSONAS[p.id] = p
-    print(f"[OK] {len(PERSONAS)} personas loaded.")
+    init_llm_backend()
+    STATS.load()
+    source = _load_personas()
+    print(f"[OK] {len(PERSONAS)} personas loaded ({source}, seed={PERSONA_SEED}).")
+
+    # 前回の起動で未完了だった一括質問ジョブを再開（--workers N でも、リースを取れた1ワーカーだけが再開する）
+    for job in bulk_jobs.resume(_run_bulk_job):
+        print(f"[OK] bulk job {job.id} resumed ({len(job.answered)}/{job.total} answered).")
+    # 統計ファイルの更新を監視（generate_stats.py の再実行を再起動なしで反映）
+    STATS.subscribe(_on_stats_changed)
+    watcher = asyncio.create_task(STATS.watch()) if STATS_RELOAD_INTERVAL > 0 else None
     yield
+    if watcher is not None:
+        watcher.cancel()
+    await bulk_jobs.shutdown()
+
+def _load_personas() -> str:
+    """
+    ペルソナを読み込む。PERSONA_SHARED_SNAPSHOT_PATH があれば全ワーカーで共有する mmap スナップショットを開き
+    （PROFILE_PRECOMPUTE=1 ならプロファイルも入れる）、なければプロセスごとに読み込む
+    """
+    precompute = os.getenv("PROFILE_PRECOMPUTE", "0") == "1"
+    if SHARED_SNAPSHOT_PATH:
+        opened = open_shared_personas(
+            PERSONAS, STATS_PATH, SNAPSHOT_PATH, SHARED_SNAPSHOT_PATH, PERSONA_SEED, with_profiles=precompute,
+            population=PERSONA_POPULATION, population_workers=PERSONA_POPULATION_WORKERS,
+        )
+        profile_cache.source = PERSONAS.profile
+        catalog_cache.clear()
+        return "shared snapshot" if opened else "shared snapshot, rebuilt"
+    if PERSONA_POPULATION:
+        # 大規模母集団は列形式のまま取り込む（Persona は参照されたときに組み立てる。プロファイルは事前生成しない）
+        PERSONAS.load_columns(load_population(STATS_PATH, PERSONA_POPULATION, PERSONA_SEED, PERSONA_POPULATION_WORKERS))
+        catalog_cache.clear()
+        return f"population of {PERSONA_POPULATION}"
+    personas, from_snapshot = load_or_generate_personas(STATS_PATH, SNAPSHOT_PATH, PERSONA_SEED)
+    PERSONAS.load(personas)
+    catalog_cache.clear()
+    if precompute:
+        profile_cache.precompute(personas)
+    return "snapshot" if from_snapshot else "generated"
+
+def _prefecture_ids(prefectures) -> set[str]:
+    return {PERSONAS.id_at(r) for pref in prefectures for r in PERSONAS.query_rows(prefecture=pref)}
+
+def _on_stats_changed(prefectures: set[str]):
+    """統計が変わった都道府県のペルソナを作り直し、関連するキャッシュを捨てる"""
+    if SHARED_SNAPSHOT_PATH:
+        # 共有スナップショットを作り直す（最初に気づいたワーカーが作り、他のワーカーはそれを開く）
+        removed = _prefecture_ids(prefectures)
+        _load_personas()
+        added = _prefecture_ids(prefectures)
+        profile_cache.invalidate(removed | added)
+        prompt_cache.invalidate(removed | added)
+        print(f"[OK] stats reloaded: {len(prefectures)} prefectures changed, shared snapshot reopened.")
+        return
+    if PERSONA_POPULATION:
+        # 人数の按分が全都道府県の人口で決まるので、母集団ごと作り直す
+        _load_personas()
+        profile_cache.invalidate()
+        prompt_cache.invalidate()
+        print(f"[OK] stats reloaded: {len(prefectures)} prefectures changed, population of {len(PERSONAS)} regenerated.")
+        return
+    counts = PERSONAS.count_by("prefecture")
+    personas = []
+    for pref in sorted(prefectures):
+        personas.extend(generate_prefectures(STATS.stats, [pref], PERSONA_SEED, num=counts.get(pref) or 10))
+    removed = PERSONAS.replace_prefectures(prefectures, personas)
+    affected = set(removed) | {p.id for p in personas}
+    profile_cache.invalidate(affected)
+    prompt_cache.invalidate(affected)
+    catalog_cache.clear()
+    print(f"[OK] stats reloaded: {len(prefectures)} prefectures changed, {len(personas)} personas regenerated.")
 
 app = FastAPI(title="仮想ペルソナシミュレータ API", lifespan=lifespan)
 
@@ -52,17 +152,86 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+def _sse(endpoint: str, events):
+    """
+    SSE の送信イベント数を数えながら EventSourceResponse で返す。
+    クライアントが切断したら events を閉じ、その先で実行中の問い合わせ（bulk_ask_stream など）を取り消す
+    """
+    async def counted():
+        async with aclosing(events):
+            async for ev in events:
+                SSE_EVENTS.inc(endpoint=endpoint, event=ev.get("event", "message"))
+                yield ev
+
+    stream = counted()
+
+    async def on_disconnect(message):
+        SSE_DISCONNECTS.inc(endpoint=endpoint)
+        try:
+            await stream.aclose()
+        except RuntimeError:
+            pass  # 次のイベントを待っている最中。この後の EventSourceResponse の取り消しで閉じられる
+
+    return EventSourceResponse(stream, client_close_handler_callable=on_disconnect)
 
 # ── エンドポイント ────────────────────────────────────────────────
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus のスクレイプ用（text/plain; version=0.0.4）"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+PERSONA_PAGE_MAX = 1000
+
+def _encode_cursor(persona_id: str) -> str:
+    return base64.urlsafe_b64encode(persona_id.encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str) -> int:
+    """カーソル（前ページ最後のペルソナID）をその行番号にする"""
+    try:
+        persona_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+    except ValueError:
+        persona_id = None
+    row = PERSONAS.row_of(persona_id) if persona_id else None
+    if row is None:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return row
+
+def _personas_body(filters: dict, fields: tuple[str, ...] = PERSONA_FIELDS, limit: int | None = None,
+                   after_row: int | None = None, count_only: bool = False) -> dict:
+    rows = PERSONAS.query_rows(**filters)
+    if count_only:
+        return {"total": len(rows)}
+    start = 0 if after_row is None else bisect_right(rows, after_row)
+    page = rows[start:] if limit is None else rows[start:start + limit]
+    has_more = limit is not None and start + limit < len(rows)
+    return {
+        "personas": PERSONAS.project(page, fields),
+        "total": len(rows),
+        "next_cursor": _encode_cursor(PERSONAS.id_at(page[-1])) if has_more else None,
+    }
+
 @app.get("/api/personas")
-def get_personas(prefecture: str | None = None, region: str | None = None):
-    personas = list(PERSONAS.values())
-    if prefecture:
-        personas = [p for p in personas if p.prefecture == prefecture]
-    if region:
-        personas = [p for p in personas if p.region == region]
-    return {"personas": [p.model_dump() for p in personas], "total": len(personas)}
+def get_personas(request: Request, query: PersonaListQuery = Depends()):
+    """
+    ペルソナ一覧（ロード順）。シリアライズ・圧縮済みの応答を返す（ETag が一致すれば 304）
+    fields=id,age,gender で返すフィールドを絞り、limit と next_cursor でページ送りする。count_only=true なら件数だけ
+    """
+    conditions = query.model_dump(include=set(PersonaFilter.model_fields), exclude_none=True)
+    fields = PERSONA_FIELDS
+    if query.fields:
+        requested = [f.strip() for f in query.fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in PERSONA_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        fields = ("id", *dict.fromkeys(f for f in requested if f != "id"))
+    if query.limit is not None and not 1 <= query.limit <= PERSONA_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {PERSONA_PAGE_MAX}")
+    after_row = _decode_cursor(query.cursor) if query.cursor else None
+    key = ("personas", *sorted(conditions.items()), fields, query.limit, after_row, query.count_only)
+    return catalog_cache.serve(request, key, lambda: _personas_body(conditions, fields, query.limit, after_row, query.count_only))
 
 @app.get("/api/personas/{persona_id}")
 def get_persona(persona_id: str):
@@ -71,44 +240,51 @@ def get_persona(persona_id: str):
         raise HTTPException(status_code=404, detail="Persona not found")
     return p.model_dump()
 
-@app.get("/api/prefectures")
-def get_prefectures():
-    """都道府県一覧とペルソナ数を返す"""
-    from collections import Counter
-    counts = Counter(p.prefecture for p in PERSONAS.values())
+def _prefectures_body() -> dict:
     regions: dict[str, list] = {}
     for p in PERSONAS.values():
-        if p.region not in regions:
-            regions[p.region] = []
-        if p.prefecture not in regions[p.region]:
-            regions[p.region].append(p.prefecture)
-    return {"prefectures": dict(counts), "regions": regions}
+        prefectures = regions.setdefault(p.region, [])
+        if p.prefecture not in prefectures:
+            prefectures.append(p.prefecture)
+    return {"prefectures": PERSONAS.count_by("prefecture"), "regions": regions}
+
+@app.get("/api/prefectures")
+def get_prefectures(request: Request):
+    """都道府県一覧とペルソナ数を返す"""
+    return catalog_cache.serve(request, ("prefectures",), _prefectures_body)
 
 @app.get("/api/stats/{prefecture}")
-def get_stats(prefecture: str):
-    """指定された都道府県の統計データを返す"""
-    try:
-        with open(STATS_PATH, "r", encoding="utf-8") as f:
-            all_stats = json.load(f)
-        stats = all_stats.get(prefecture)
-        if not stats:
-            raise HTTPException(status_code=404, detail="Stats not found")
-        return stats
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+def get_stats(request: Request, prefecture: str):
+    """指定された都道府県の統計データを返す（読み込み時にシリアライズ済み）"""
+    response = STATS.response(prefecture)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Stats not found")
+    return response.respond(request, "stats")
 
 @app.get("/api/usage")
 def get_usage():
-    """Gemini API使用量と残量を返す"""
-    return usage_tracker.get_status()
+    """Gemini API使用量と残量を返す（トークン数・コストの集計とキャッシュのヒット状況も含む）"""
+    return {
+        **usage_tracker.get_status(),
+        "tokens": token_ledger.get_status(),
+        "caches": {
+            "profile": profile_cache.get_status(),
+            "prompt": prompt_cache.get_status(),
+            "answer": answer_cache.get_status(),
+            "interview_sessions": interview_sessions.get_status(),
+            "catalog": catalog_cache.get_status(),
+        },
+        "bulk_flights": bulk_flights.get_status(),
+        "stats": STATS.get_status(),
+    }
 
 @app.get("/api/personas/{persona_id}/profile")
 def get_persona_profile(persona_id: str):
-    """ライフログ + 心理プロファイルをルールベースで即時生成して返す（API消費なし）"""
+    """ライフログ + 心理プロファイルをルールベースで生成して返す（API消費なし・ペルソナごとにキャッシュ）"""
     p = PERSONAS.get(persona_id)
     if not p:
         raise HTTPException(status_code=404, detail="Persona not found")
-    profile = generate_persona_profile(p)
+    profile = profile_cache.get(p)
     return profile.model_dump()
 
 @app.post("/api/personas/{persona_id}/profile/enhance")
@@ -117,65 +293,311 @@ async def enhance_profile(persona_id: str):
     p = PERSONAS.get(persona_id)
     if not p:
         raise HTTPException(status_code=404, detail="Persona not found")
-    profile = generate_persona_profile(p)
+    profile = profile_cache.get(p)
     model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+    attribute_usage(endpoint="profile-enhance")
     try:
         narrative = await enhance_persona_profile(p, profile, model_name)
     except Exception as e:
         msg = str(e)
-        if "429" in msg or "RESOURCE_EXHAUSTED" in msg:
+        if is_rate_limited(e):
             raise HTTPException(status_code=429, detail="APIの無料枠上限に達しました。")
         raise HTTPException(status_code=500, detail=f"Gemini APIエラー: {msg}")
     return {**profile.model_dump(), "narrative": narrative}
 
+def _bulk_settings(req: BulkQuestionRequest) -> tuple[str, int, int]:
+    """(モデル名, 並列度, バッチサイズ)"""
+    model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+    concurrency = int(os.getenv("BULK_CONCURRENCY", "5"))
+    batch_size = req.batch_size or int(os.getenv("BULK_BATCH_SIZE", "1"))
+    return model_name, concurrency, max(1, min(batch_size, BULK_BATCH_SIZE_MAX))
+
+def _bulk_prompt(question: str, options: list[str] | None) -> str:
+    return coded_question(question, options) if options else question
+
+def _summary_due(aggregator: BulkAggregator, every: int) -> bool:
+    return aggregator.completed % every == 0 or aggregator.completed == aggregator.total
+
+def _summary_every(every: int | None) -> int:
+    return max(1, every or int(os.getenv("BULK_SUMMARY_EVERY", "10")))
+
+def _with_region(result: dict) -> dict:
+    # Attach region for frontend filtering
+    p_obj = PERSONAS.get(result["persona_id"])
+    result["region"] = p_obj.region if p_obj else ""
+    return result
+
 @app.post("/api/bulk-question")
 async def bulk_question(req: BulkQuestionRequest):
     """
     SSEで進捗をストリーミングしながら一括質問。
-    各ペルソナの回答が完了するたびに data: JSON を送信。
+    各ペルソナの回答が完了するたびに progress を、summary_every 件ごとに集計結果の summary を送信。
     """
-    personas = list(PERSONAS.values())
-    if req.prefecture_filter:
-        personas = [p for p in personas if p.prefecture == req.prefecture_filter]
+    personas = PERSONAS.query(**req.persona_filters())
+    by_id = {p.id: p for p in personas}
+    model_name, concurrency, batch_size = _bulk_settings(req)
+    aggregator = BulkAggregator(len(personas), req.options)
+    every = _summary_every(req.summary_every)
+    meter = TokenMeter(req.token_budget)
+    attribute_usage(endpoint="bulk-question", meter=meter)
 
-    model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-    concurrency = int(os.getenv("BULK_CONCURRENCY", "5"))
+    prompt = _bulk_prompt(req.question, req.options)
+
+    def ask():
+        return bulk_ask_stream(personas, prompt, concurrency, model_name, use_cache=not req.bypass_cache, batch_size=batch_size)
 
     async def event_generator():
+        requests_saved = 0
+        stopped = None
+        flight, shared = None, False
         try:
-            async for result in bulk_ask_stream(personas, req.question, concurrency, model_name):
-                # Attach region for frontend filtering
-                p_obj = PERSONAS.get(result["persona_id"])
-                result["region"] = p_obj.region if p_obj else ""
-                yield {
-                    "event": "progress",
-                    "data": json.dumps(result, ensure_ascii=False),
-                }
-            yield {"event": "done", "data": json.dumps({"message": "完了"}, ensure_ascii=False)}
+            if req.token_budget is None:
+                # 実行中の同じ質問があれば相乗りする（既に出た回答から受け取り、以降は同じ進捗を流す）
+                key = flight_key(prompt, req.persona_filters(), model_name, batch_size, not req.bypass_cache)
+                flight, shared = bulk_flights.join(key, ask)
+                source = flight.subscribe()
+            else:
+                source = ask()
+            async with aclosing(source) as stream:
+                async for result in stream:
+                    requests_saved = result["requests_saved"]
+                    option = aggregator.add(by_id[result["persona_id"]], result["answer"], result["failed"], result["cached"])
+                    if not req.summary_only:
+                        if req.options:
+                            result["option"] = option
+                        yield {
+                            "event": "progress",
+                            "data": json.dumps(_with_region(result), ensure_ascii=False),
+                        }
+                    if _summary_due(aggregator, every):
+                        yield {"event": "summary", "data": json.dumps(aggregator.summary(), ensure_ascii=False)}
+                    if meter.exhausted:
+                        stopped = "token_budget"
+                        break
+            if stopped:
+                yield {"event": "summary", "data": json.dumps(aggregator.summary(), ensure_ascii=False)}
+            done = {
+                "message": "完了",
+                "requests_saved": requests_saved,
+                "tokens_used": flight.meter.used if flight else meter.used,
+                "stopped": stopped,
+                "shared": shared,
+            }
+            yield {"event": "done", "data": json.dumps(done, ensure_ascii=False)}
         except Exception as e:
             yield {"event": "error", "data": json.dumps({"error": str(e)}, ensure_ascii=False)}
 
-    return EventSourceResponse(event_generator())
+    return _sse("bulk-question", event_generator())
+
+@app.post("/api/bulk-question/sample")
+async def bulk_question_sample(req: SampledQuestionRequest):
+    """
+    層化サンプリング版の一括質問。条件に合うペルソナから層化標本を選んで順に質問し、
+    progress（回答と符号化した選択肢）/ estimate（重み付き推計と信頼区間）/ done（打ち切り理由）を送る。
+    """
+    options = [o.strip() for o in req.options if o.strip()]
+    if len(options) < 2:
+        raise HTTPException(status_code=400, detail="options には2つ以上の選択肢を指定してください")
+    personas = PERSONAS.query(**req.persona_filters())
+    model_name, concurrency, batch_size = _bulk_settings(req)
+    attribute_usage(endpoint="bulk-question-sample", meter=TokenMeter(req.token_budget))
+
+    async def event_generator():
+        try:
+            async for ev in sampled_ask_stream(
+                personas, STATS.stats, req.question, options,
+                sample_size=max(1, req.sample_size), min_sample=req.min_sample,
+                wave_size=max(1, req.wave_size), margin=req.margin, tolerance=req.tolerance,
+                seed=PERSONA_SEED if req.seed is None else req.seed,
+                concurrency=concurrency, model_name=model_name,
+                use_cache=not req.bypass_cache, batch_size=batch_size,
+            ):
+                event = ev.pop("type")
+                data = _with_region(ev) if event == "progress" else ev
+                yield {"event": event, "data": json.dumps(data, ensure_ascii=False)}
+        except Exception as e:
+            yield {"event": "error", "data": json.dumps({"error": str(e)}, ensure_ascii=False)}
+
+    return _sse("bulk-question-sample", event_generator())
+
+# ── 一括質問ジョブ ────────────────────────────────────────────────
+async def _run_bulk_job(job: BulkJob):
+    """未回答のペルソナだけに問い合わせて、回答と集計結果をジョブに記録する"""
+    req = job.request
+    options = req.get("options")
+    every = _summary_every(req.get("summary_every"))
+    aggregator = BulkAggregator(job.total, options)
+    # 再開時: 回答済みの分を集計に戻す
+    for ev in job.events:
+        data = ev["data"]
+        if ev["event"] == "progress" and not data.get("failed") and data["persona_id"] in PERSONAS:
+            aggregator.add(PERSONAS[data["persona_id"]], data["answer"], cached=data.get("cached", False))
+
+    # トークン予算は再開をまたいで通算する（progress に累計を残している）
+    used = next((ev["data"].get("tokens_used", 0) for ev in reversed(job.events) if ev["event"] == "progress"), 0)
+    meter = TokenMeter(req.get("token_budget"), used)
+    attribute_usage(endpoint="bulk-jobs", job_id=job.id, meter=meter)
+
+    personas = [PERSONAS[pid] for pid in job.persona_ids if pid in PERSONAS and pid not in job.answered]
+    async with aclosing(bulk_ask_stream(
+        personas, _bulk_prompt(req["question"], options), req["concurrency"], req["model"],
+        use_cache=not req["bypass_cache"], batch_size=req["batch_size"],
+    )) as stream:
+        async for result in stream:
+            option = aggregator.add(PERSONAS[result["persona_id"]], result["answer"], result["failed"], result["cached"])
+            if options:
+                result["option"] = option
+            result["tokens_used"] = meter.used
+            job.record_progress(_with_region(result))
+            if _summary_due(aggregator, every):
+                job.record_summary(aggregator.summary())
+            if meter.exhausted:
+                job.record_summary(aggregator.summary())
+                return {"stopped": "token_budget", "tokens_used": meter.used}
+    return {"tokens_used": meter.used}
+
+@app.post("/api/bulk-jobs")
+async def create_bulk_job(req: BulkQuestionRequest):
+    """一括質問をサーバー側のジョブとして開始し、ジョブIDを返す"""
+    personas = PERSONAS.query(**req.persona_filters())
+    model_name, concurrency, batch_size = _bulk_settings(req)
+    job = bulk_jobs.create(
+        {**req.model_dump(), "model": model_name, "concurrency": concurrency, "batch_size": batch_size},
+        [p.id for p in personas],
+    )
+    bulk_jobs.start(job, _run_bulk_job)
+    return job.summary()
+
+@app.get("/api/bulk-jobs/{job_id}")
+async def get_bulk_job(job_id: str):
+    job = bulk_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.summary()
+
+@app.get("/api/bulk-jobs/{job_id}/events")
+async def bulk_job_events(job_id: str, request: Request, last_event_id: int | None = None, summary_only: bool = False):
+    """
+    ジョブのイベントをSSEで流す。Last-Event-ID ヘッダ（または last_event_id クエリ）より後を再送してから新着に追従する。
+    summary_only=true なら個々の回答（progress）は送らず、集計結果（summary）と終了イベントだけを送る。
+    """
+    job = bulk_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if last_event_id is None:
+        header = request.headers.get("last-event-id", "")
+        last_event_id = int(header) if header.isdigit() else 0
+
+    async def event_generator():
+        async for ev in job.follow(last_event_id, summary_only):
+            yield {"id": str(ev["id"]), "event": ev["event"], "data": json.dumps(ev["data"], ensure_ascii=False)}
+
+    return _sse("bulk-job-events", event_generator())
+
+# ── インタビュー ──────────────────────────────────────────────────
+async def _sessions(fn, *args):
+    """セッションストアの操作。共有ストア（sqlite）はスレッドで実行してイベントループを止めない"""
+    if interview_sessions.blocking:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+async def _interview_session(persona_id: str, req: InterviewRequest) -> InterviewSession | None:
+    if not req.session_id:
+        return None
+    session = await _sessions(interview_sessions.get, req.session_id)
+    if not session or session.persona_id != persona_id:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+@asynccontextmanager
+async def _session_turn(session: InterviewSession | None):
+    """
+    セッションのターンを1つずつ進める。ロックを待つ間に進んだターン（共有ストアでは他のワーカーの分も）を
+    読み直したセッションを渡す。進めたら呼び出し側が _sessions(interview_sessions.save, ...) で保存する
+    """
+    if session is None:
+        yield None
+        return
+    async with interview_sessions.lock(session.id):
+        yield await _sessions(interview_sessions.get, session.id) or session
+
+@app.post("/api/interview/{persona_id}/sessions")
+async def create_interview_session(persona_id: str, req: InterviewSessionRequest | None = None):
+    """サーバー側で履歴を持つインタビューセッションを作る（history を渡すとその続きから始める）"""
+    if persona_id not in PERSONAS:
+        raise HTTPException(status_code=404, detail="Persona not found")
+    session = await _sessions(interview_sessions.create, persona_id, req.history if req else None)
+    return session.info()
+
+@app.delete("/api/interview/sessions/{session_id}")
+async def delete_interview_session(session_id: str):
+    if not await _sessions(interview_sessions.delete, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"deleted": session_id}
 
 @app.post("/api/interview/{persona_id}")
 async def interview(persona_id: str, req: InterviewRequest):
-    """個別インタビュー: 会話履歴を受け取り、ペルソナが返答する（プロファイル自動注入）"""
+    """個別インタビュー: 会話履歴（または session_id）を受け取り、ペルソナが返答する（プロファイル自動注入）"""
     p = PERSONAS.get(persona_id)
     if not p:
         raise HTTPException(status_code=404, detail="Persona not found")
+    session = await _interview_session(persona_id, req)
 
-    # ライフログ+心理プロファイルを自動生成してシステムプロンプトに注入
-    profile = generate_persona_profile(p)
+    # ライフログ+心理プロファイル（キャッシュ済み）をシステムプロンプトに注入
+    profile = profile_cache.get(p)
 
     model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-    try:
-        answer = await ask_persona_with_history(p, req.message, req.history, model_name, profile)
-    except Exception as e:
-        msg = str(e)
-        if "429" in msg or "RESOURCE_EXHAUSTED" in msg:
-            raise HTTPException(
-                status_code=429,
-                detail="APIの無料枠の上限に達しました。しばらく待ってから再試行してください。"
-            )
-        raise HTTPException(status_code=500, detail=f"Gemini APIエラー: {msg}")
+    attribute_usage(endpoint="interview")
+    async with _session_turn(session) as session:
+        history = session.history() if session else req.history
+        try:
+            answer = await ask_persona_with_history(p, req.message, history, model_name, profile)
+        except Exception as e:
+            msg = str(e)
+            if is_rate_limited(e):
+                raise HTTPException(
+                    status_code=429,
+                    detail="APIの無料枠の上限に達しました。しばらく待ってから再試行してください。"
+                )
+            raise HTTPException(status_code=500, detail=f"Gemini APIエラー: {msg}")
+        if session:
+            session.add_turn(req.message, answer)
+            await _sessions(interview_sessions.save, session)
+            return {"answer": answer, "persona_id": persona_id, "session": session.info()}
     return {"answer": answer, "persona_id": persona_id}
+
+@app.post("/api/interview/{persona_id}/stream")
+async def interview_stream(persona_id: str, req: InterviewRequest):
+    """個別インタビューのストリーミング版: delta イベントで返答を逐次送り、done で使用量と終了理由を送る"""
+    p = PERSONAS.get(persona_id)
+    if not p:
+        raise HTTPException(status_code=404, detail="Persona not found")
+    session = await _interview_session(persona_id, req)
+
+    profile = profile_cache.get(p)
+    model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+    attribute_usage(endpoint="interview-stream")
+
+    async def event_generator():
+        async with _session_turn(session) as turn:
+            history = turn.history() if turn else req.history
+            try:
+                async for ev in stream_persona_with_history(p, req.message, history, model_name, profile):
+                    if ev["type"] == "delta":
+                        yield {"event": "delta", "data": json.dumps({"text": ev["text"]}, ensure_ascii=False)}
+                    else:
+                        done = {k: v for k, v in ev.items() if k != "type"}
+                        if turn:
+                            turn.add_turn(req.message, done["answer"])
+                            await _sessions(interview_sessions.save, turn)
+                            done["session"] = turn.info()
+                        yield {"event": "done", "data": json.dumps({**done, "persona_id": persona_id}, ensure_ascii=False)}
+            except Exception as e:
+                msg = str(e)
+                if is_rate_limited(e):
+                    err = {"status": 429, "error": "APIの無料枠の上限に達しました。しばらく待ってから再試行してください。"}
+                else:
+                    err = {"status": 500, "error": f"Gemini APIエラー: {msg}"}
+                yield {"event": "error", "data": json.dumps(err, ensure_ascii=False)}
+
+    return _sse("interview-stream", event_generator())
@@ -0,0 +1,200 @@
+"""
+Prometheus 形式のメトリクス（/metrics）
+prometheus_client には依存せず、必要な Counter / Gauge / Histogram だけを実装している。
+- ラベルはメトリクス定義時に名前を固定し、observe / inc の引数で値を渡す
+- 記録は dict の更新だけ。スレッドプールの同期エンドポイントや answer_cache のスレッドからも記録するので、
+  メトリクスごとのロックの下で更新・出力する
+"""
+import threading, time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 秒単位の既定バケット（prometheus_client と同じ）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+# Gemini 呼び出し・レート制限待ちは数秒〜数十秒になる
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0)
+# プロファイル生成・プロンプト組み立て（ミリ秒未満が中心）
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            samples = self._samples()
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *samples]
+
+    @abstractmethod
+    def _samples(self) -> list[str]:
+        """render() で HELP / TYPE の後に続ける行"""
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in self._values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベル値 → [バケットごとの件数（累積ではない）..., +Inf], 合計
+        self._counts: dict[tuple, list[int]] = {}
+        self._sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[bucket] += 1
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {self._sums[key]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+REGISTRY: list[_Metric] = []
+
+def render_metrics() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# ── メトリクス定義 ─────────────────────────────────────────────────
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP応答開始までの時間（SSEはヘッダ送信まで）",
+    ("method", "route", "status"),
+)
+GEMINI_LATENCY = Histogram(
+    "gemini_request_duration_seconds", "Gemini API呼び出しの所要時間（レート制限の待ちを除く）",
+    ("model", "outcome"), SLOW_BUCKETS,
+)
+GEMINI_ERRORS = Counter("gemini_errors_total", "Gemini API呼び出しの失敗数（kind=rate_limited は 429）", ("model", "kind"))
+RATE_LIMIT_WAIT = Histogram("rate_limiter_wait_seconds", "レート制限の枠が空くまでの待ち時間", ("model",), SLOW_BUCKETS)
+PROFILE_BUILD = Histogram("profile_generation_seconds", "ライフログ・心理プロファイルの生成時間", (), FAST_BUCKETS)
+PROMPT_BUILD = Histogram("prompt_build_seconds", "システムプロンプトの組み立て時間", (), FAST_BUCKETS)
+CACHE_REQUESTS = Counter("cache_requests_total", "キャッシュの参照数", ("cache", "result"))
+SSE_EVENTS = Counter("sse_events_total", "送信した SSE イベント数", ("endpoint", "event"))
+SSE_DISCONNECTS = Counter("sse_client_disconnects_total", "送信の途中でクライアントが切断した SSE の数", ("endpoint",))
+BULK_TASKS_IN_FLIGHT = Gauge("bulk_tasks_in_flight", "一括質問で実行中（レート制限・再試行の待機中を含む）の問い合わせ数")
+BULK_BACKPRESSURE = Counter("bulk_backpressure_seconds_total", "一括質問の読み手が遅く、結果の受け渡し待ちで問い合わせを止めていた時間の合計", ("model",))
+BULK_CANCELLED = Counter(
+    "bulk_cancelled_requests_total",
+    "一括質問が途中で打ち切られて取り消した問い合わせ数（stage=queued は未送信で枠を使わずに済んだ分、in_flight は実行中に取り消した分）",
+    ("model", "stage"),
+)
+BULK_RETRIES = Counter("bulk_retries_total", "一括質問で再試行した回数（kind は直前の失敗の種類）", ("model", "kind"))
+BULK_HEDGES = Counter("bulk_hedged_requests_total", "遅い呼び出しに重ねて送った問い合わせのうち先に返った方", ("model", "winner"))
+BULK_SINGLE_FLIGHT = Counter("bulk_single_flight_total", "一括質問のうち自分で問い合わせた（leader）/ 実行中の同じ質問に相乗りした（joined）数", ("role",))
+BULK_CONCURRENCY_LIMIT = Gauge("bulk_concurrency_limit", "一括質問の同時実行数の上限（AIMD で調整）", ("model",))
+
+def error_kind(e: BaseException) -> str:
+    # retry_policy はこのモジュールのメトリクスを使うので、循環しないよう呼び出し時に読み込む
+    from retry_policy import is_rate_limited
+    if is_rate_limited(e):
+        return "rate_limited"
+    if isinstance(e, TimeoutError):
+        return "timeout"
+    return type(e).__name__
+
+class MetricsMiddleware:
+    """ルート（パスのテンプレート）ごとに応答開始までの時間を記録する ASGI ミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        observed = False
+
+        def observe(status: int):
+            nonlocal observed
+            if observed:
+                return
+            observed = True
+            route = scope.get("route")
+            # ルートに一致しなかったパスはラベルの種類が増えないようにまとめる
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=scope["method"], route=path, status=status)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            observe(500)
+            raise
@@ -46,13 +46,60 @@ class PersonaProfile(BaseModel):
     psych: PsychProfile
 
 # ── リクエスト/レスポンス ──────────────────────────────────────────
-class BulkQuestionRequest(BaseModel):
+class PersonaFilter(BaseModel):
+    """ペルソナ検索条件（PersonaStore.query にそのまま渡す）。範囲は両端を含む"""
+    prefecture: Optional[str] = None
+    region: Optional[str] = None
+    gender: Optional[str] = None
+    employment_type: Optional[str] = None
+    major_industry: Optional[str] = None
+    age_min: Optional[int] = None
+    age_max: Optional[int] = None
+    income_min: Optional[int] = None
+    income_max: Optional[int] = None
+    commute_min: Optional[int] = None
+    commute_max: Optional[int] = None
+
+class PersonaListQuery(PersonaFilter):
+    """/api/personas のクエリ。limit を指定するとカーソル方式でページ分割する（並びはロード順で固定）"""
+    fields: Optional[str] = None     # 返すフィールド（カンマ区切り。id は常に含む）
+    limit: Optional[int] = None      # 1ページの件数（省略時は全件）
+    cursor: Optional[str] = None     # 前のページの next_cursor
+    count_only: bool = False         # True なら件数（total）だけ返す
+
+class BulkQuestionRequest(PersonaFilter):
     question: str
-    prefecture_filter: Optional[str] = None
+    prefecture_filter: Optional[str] = None  # 旧パラメータ（prefecture と同じ意味）
+    bypass_cache: bool = False               # True なら回答キャッシュを使わず全員に問い合わせる
+    batch_size: Optional[int] = None         # 1リクエストで回答させる人数（省略時は BULK_BATCH_SIZE）
+    options: Optional[List[str]] = None      # 指定すると選択肢付きで質問し、回答を選択肢に符号化して集計する
+    summary_every: Optional[int] = None      # summary イベントを送る間隔（件数。省略時は BULK_SUMMARY_EVERY）
+    summary_only: bool = False               # True なら progress を送らず summary と done だけ送る
+    token_budget: Optional[int] = None       # 使ってよいトークン数の上限。超えたら残りは問い合わせずに打ち切る
+
+    def persona_filters(self) -> dict:
+        filters = self.model_dump(include=set(PersonaFilter.model_fields), exclude_none=True)
+        if self.prefecture_filter and "prefecture" not in filters:
+            filters["prefecture"] = self.prefecture_filter
+        return filters
+
+class SampledQuestionRequest(BulkQuestionRequest):
+    """層化サンプリングで一部のペルソナだけに聞き、選択肢ごとの比率を推計する"""
+    options: List[str]            # 回答の選択肢（2つ以上）
+    sample_size: int = 80         # 質問する最大人数
+    min_sample: int = 30          # 打ち切りを判定し始める回答数
+    wave_size: int = 10           # 推計を更新する間隔（人数）
+    margin: float = 0.1           # 95%信頼区間の半幅がこれ以下になったら打ち切る
+    tolerance: float = 0.02       # 2回続けて推計値の変化がこれ以下なら打ち切る
+    seed: Optional[int] = None    # 標本の選び方（省略時は PERSONA_SEED）
 
 class InterviewRequest(BaseModel):
     message: str
-    history: List[Dict[str, str]] = []
+    history: List[Dict[str, str]] = []   # session_id を使わない場合のみ（全履歴を毎回送る）
+    session_id: Optional[str] = None     # サーバー側セッション。指定時は history を無視する
+
+class InterviewSessionRequest(BaseModel):
+    history: List[Dict[str, str]] = []   # 既存の会話から始める場合の初期履歴
 
 class BulkResultItem(BaseModel):
     persona_id: str
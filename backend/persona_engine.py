@@ -1,8 +1,16 @@
 """
 ペルソナ生成エンジン: 都道府県別統計データから470人のペルソナを確率的に生成
+- seed を指定すると都道府県ごとに独立した乱数系列で再現可能に生成
+- 生成結果はバージョン/seedヘッダ付きのスナップショット（gzip JSON Lines）に保存し、起動時に再利用
 """
-import json, random, os
+import gzip, hashlib, json, random, os
 from models import Persona
+from persona_store import PersonaStore, read_shared_meta
+from shared_state import file_lock
+from lifelog_engine import PROFILE_VERSION, generate_persona_profile
+
+# 生成ロジックやスナップショット形式を変えたら上げる（古いスナップショットは自動で再生成される）
+SNAPSHOT_VERSION = 1
 
 GENDERS = ["男性", "女性"]
 
@@ -129,8 +137,9 @@ def _income_tier(annual_income: int) -> str:
     else:
         return "high"
 
-def assign_brands(age: int, gender: str, annual_income: int) -> dict[str, str]:
+def assign_brands(age: int, gender: str, annual_income: int, rng=None) -> dict[str, str]:
     """属性に応じて実在ブランドを割り当てる"""
+    rng = rng or random
     tier = _income_tier(annual_income)
     brands: dict[str, str] = {}
 
@@ -139,8 +148,8 @@ def assign_brands(age: int, gender: str, annual_income: int) -> dict[str, str]:
             # 高齢男性ほど喫煙率高め
             smoke_prob = 0.35 if gender == "男性" and age >= 40 else \
                          0.20 if gender == "男性" else 0.08
-            if random.random() < smoke_prob:
-                brands[category] = random.choice(options["all"])
+            if rng.random() < smoke_prob:
+                brands[category] = rng.choice(options["all"])
             else:
                 brands[category] = options["not_smoker"]
         elif category == "化粧品":
@@ -148,28 +157,30 @@ def assign_brands(age: int, gender: str, annual_income: int) -> dict[str, str]:
                 brands[category] = options["male"]
             else:
                 choices = options.get(tier) or options.get("mid") or ["（特になし）"]
-                brands[category] = random.choice(choices)
+                brands[category] = rng.choice(choices)
         elif category == "コンビニ":
-            brands[category] = random.choice(options["all"])
+            brands[category] = rng.choice(options["all"])
         else:
             choices = options.get(tier) or options.get("mid") or ["（特になし）"]
-            brands[category] = random.choice(choices)
+            brands[category] = rng.choice(choices)
 
     return brands
 
-def weighted_choice(distribution: dict) -> str:
+def weighted_choice(distribution: dict, rng=None) -> str:
+    rng = rng or random
     keys = list(distribution.keys())
     weights = list(distribution.values())
-    return random.choices(keys, weights=weights, k=1)[0]
+    return rng.choices(keys, weights=weights, k=1)[0]
 
-def get_political_leaning(ldp_share: float) -> str:
-    r = random.random()
+def get_political_leaning(ldp_share: float, rng=None) -> str:
+    rng = rng or random
+    r = rng.random()
     if r < ldp_share:
         return "自民党支持"
     elif r < ldp_share + 0.15:
         return "公明党支持"
     elif r < ldp_share + 0.15 + (1 - ldp_share - 0.15) * 0.6:
-        return random.choice(["立憲民主党支持", "維新支持", "共産党支持", "国民民主党支持"])
+        return rng.choice(["立憲民主党支持", "維新支持", "共産党支持", "国民民主党支持"])
     else:
         return "無党派・政治無関心"
 
@@ -180,26 +191,27 @@ def generate_daily_routine(commute: int, age: int, household: str, occupation: s
               "週末は趣味や地域活動に参加" if age > 50 else "週末は友人と外出したり趣味を楽しむ"
     return f"平日は{wake}時起床、{commute}分かけて通勤し、{sleep_time}時頃就寝。{weekend}。"
 
-def generate_personas_for_prefecture(pref_name: str, stats: dict, num: int = 10) -> list[Persona]:
+def generate_personas_for_prefecture(pref_name: str, stats: dict, num: int = 10, rng=None) -> list[Persona]:
+    rng = rng or random
     personas = []
     industries = stats["major_industries"]
 
     for i in range(num):
-        gender = random.choice(GENDERS)
-        age_group = weighted_choice(stats["age_distribution"])
+        gender = rng.choice(GENDERS)
+        age_group = weighted_choice(stats["age_distribution"], rng)
         age = {
-            "20s": random.randint(20, 29),
-            "30s": random.randint(30, 39),
-            "40s": random.randint(40, 49),
-            "50s": random.randint(50, 59),
-            "60s": random.randint(60, 69),
-            "70plus": random.randint(70, 80),
+            "20s": rng.randint(20, 29),
+            "30s": rng.randint(30, 39),
+            "40s": rng.randint(40, 49),
+            "50s": rng.randint(50, 59),
+            "60s": rng.randint(60, 69),
+            "70plus": rng.randint(70, 80),
         }[age_group]
 
-        emp_type = weighted_choice(stats["employment_type"])
-        industry = random.choice(industries)
+        emp_type = weighted_choice(stats["employment_type"], rng)
+        industry = rng.choice(industries)
         occ_list = OCCUPATIONS.get(industry, ["会社員", "自営業"])
-        occupation = random.choice(occ_list)
+        occupation = rng.choice(occ_list)
         if emp_type == "part_time":
             occupation = f"{occupation}（パート・アルバイト）"
         elif emp_type == "self_employed":
@@ -207,31 +219,31 @@ def generate_personas_for_prefecture(pref_name: str, stats: dict, num: int = 10)
         elif emp_type == "unemployed":
             occupation = "無職・求職中"
 
-        income_band = weighted_choice(stats["income_distribution"])
+        income_band = weighted_choice(stats["income_distribution"], rng)
         income = {
-            "under_200": random.randint(80, 199),
-            "200_400": random.randint(200, 399),
-            "400_600": random.randint(400, 599),
-            "600_800": random.randint(600, 799),
-            "over_800": random.randint(800, 1200),
+            "under_200": rng.randint(80, 199),
+            "200_400": rng.randint(200, 399),
+            "400_600": rng.randint(400, 599),
+            "600_800": rng.randint(600, 799),
+            "over_800": rng.randint(800, 1200),
         }[income_band]
 
-        household_key = weighted_choice(stats["household_type"])
+        household_key = weighted_choice(stats["household_type"], rng)
         household = HOUSEHOLD_LABELS[household_key]
-        housing = "持ち家" if random.random() < stats["homeownership_rate"] else "賃貸"
+        housing = "持ち家" if rng.random() < stats["homeownership_rate"] else "賃貸"
 
-        food_var = int(stats["avg_monthly_food"] * random.uniform(0.8, 1.2))
-        house_var = int(stats["avg_monthly_housing"] * random.uniform(0.7, 1.3))
-        ent_var = int(stats["avg_monthly_entertainment"] * random.uniform(0.6, 1.4))
+        food_var = int(stats["avg_monthly_food"] * rng.uniform(0.8, 1.2))
+        house_var = int(stats["avg_monthly_housing"] * rng.uniform(0.7, 1.3))
+        ent_var = int(stats["avg_monthly_entertainment"] * rng.uniform(0.6, 1.4))
 
-        political = get_political_leaning(stats["ldp_vote_share"])
-        traits = random.choice(TRAITS_POOL)
+        political = get_political_leaning(stats["ldp_vote_share"], rng)
+        traits = rng.choice(TRAITS_POOL)
         routine = generate_daily_routine(stats["avg_commute_minutes"], age, household, occupation)
 
         pref_id = pref_name.replace("都", "").replace("道", "").replace("府", "").replace("県", "")
         persona_id = f"{pref_id}_{i+1:02d}"
 
-        preferred_brands = assign_brands(age, gender, income)
+        preferred_brands = assign_brands(age, gender, income, rng)
 
         personas.append(Persona(
             id=persona_id,
@@ -247,7 +259,7 @@ def generate_personas_for_prefecture(pref_name: str, stats: dict, num: int = 10)
             monthly_food=food_var,
             monthly_housing=house_var,
             monthly_entertainment=ent_var,
-            commute_minutes=stats["avg_commute_minutes"] + random.randint(-10, 15),
+            commute_minutes=stats["avg_commute_minutes"] + rng.randint(-10, 15),
             sleep_hours=stats["avg_sleep_hours"],
             daily_routine=routine,
             political_leaning=political,
@@ -257,10 +269,139 @@ def generate_personas_for_prefecture(pref_name: str, stats: dict, num: int = 10)
         ))
     return personas
 
-def load_all_personas(stats_path: str) -> list[Persona]:
+def prefecture_rng(seed: int, pref_name: str) -> random.Random:
+    """都道府県ごとの乱数系列（他県の人数や生成順に影響されない）"""
+    return random.Random(f"{seed}:{pref_name}")
+
+def load_all_personas(stats_path: str, num: int = 10, seed: int | None = None) -> list[Persona]:
     with open(stats_path, "r", encoding="utf-8") as f:
         stats = json.load(f)
     all_personas = []
     for pref_name, pref_stats in stats.items():
-        all_personas.extend(generate_personas_for_prefecture(pref_name, pref_stats, num=10))
+        rng = prefecture_rng(seed, pref_name) if seed is not None else None
+        all_personas.extend(generate_personas_for_prefecture(pref_name, pref_stats, num=num, rng=rng))
     return all_personas
+
+def generate_prefectures(stats: dict, prefectures, seed: int, num: int = 10) -> list[Persona]:
+    """指定した都道府県だけ生成する（都道府県ごとの乱数系列なので全体を生成したときと同じ結果になる）"""
+    personas = []
+    for pref_name in prefectures:
+        if pref_name in stats:
+            personas.extend(generate_personas_for_prefecture(pref_name, stats[pref_name], num=num, rng=prefecture_rng(seed, pref_name)))
+    return personas
+
+# ── スナップショット ───────────────────────────────────────────────
+# 1行目: ヘッダ {"version", "seed", "num", "stats_sha256", "fields"}
+# 2行目以降: fields の順に並べた1ペルソナ = 1 JSON配列
+
+def stats_digest(stats_path: str) -> str:
+    # 改行コードや整形の差で再生成されないよう、正規化したJSONでハッシュを取る
+    with open(stats_path, "r", encoding="utf-8") as f:
+        canonical = json.dumps(json.load(f), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def save_snapshot(path: str, personas: list[Persona], seed: int, num: int, stats_sha256: str) -> None:
+    fields = list(Persona.model_fields)
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "seed": seed,
+        "num": num,
+        "stats_sha256": stats_sha256,
+        "fields": fields,
+    }
+    # --workers N で複数のワーカーが同時に書いても互いの一時ファイルを壊さないよう、プロセスごとに分ける
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    # mtime=0 で同じ入力からは同じバイト列になるようにする
+    with open(tmp_path, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as gz:
+        gz.write((json.dumps(header, ensure_ascii=False) + "\n").encode("utf-8"))
+        for p in personas:
+            row = [getattr(p, name) for name in fields]
+            gz.write((json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+    os.replace(tmp_path, path)
+
+def read_snapshot_header(path: str) -> dict | None:
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+
+def load_snapshot(path: str) -> list[Persona]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        fields = json.loads(f.readline())["fields"]
+        # 自前で書き出したデータなので検証は省略して高速に復元する
+        return [Persona.model_construct(**dict(zip(fields, json.loads(line)))) for line in f]
+
+def load_or_generate_personas(stats_path: str, snapshot_path: str, seed: int, num: int = 10) -> tuple[list[Persona], bool]:
+    """
+    ヘッダが一致するスナップショットがあればそのまま読み込み、なければseed付きで生成して保存する。
+    戻り値: (ペルソナ一覧, スナップショットから読み込んだか)
+    """
+    digest = stats_digest(stats_path)
+    expected = {
+        "version": SNAPSHOT_VERSION,
+        "seed": seed,
+        "num": num,
+        "stats_sha256": digest,
+        "fields": list(Persona.model_fields),
+    }
+    header = read_snapshot_header(snapshot_path) if os.path.exists(snapshot_path) else None
+    if header == expected:
+        return load_snapshot(snapshot_path), True
+
+    personas = load_all_personas(stats_path, num=num, seed=seed)
+    try:
+        save_snapshot(snapshot_path, personas, seed, num, digest)
+    except OSError as e:
+        print(f"[WARN] persona snapshot not saved: {e}")
+    return personas, False
+
+# ── 共有スナップショット（複数ワーカー用） ───────────────────────────
+def open_shared_personas(store: PersonaStore, stats_path: str, snapshot_path: str, shared_path: str,
+                         seed: int, num: int = 10, with_profiles: bool = False,
+                         population: int = 0, population_workers: int = 1) -> bool:
+    """
+    共有スナップショット（PersonaStore.save_shared_snapshot の形式）を mmap して store に読み込む。
+    ヘッダが古ければ1つのワーカーだけが作り直し、他のワーカーはそれを待って同じファイルを開く。
+    with_profiles なら全員分のプロファイルも入れておく（ワーカーごとに生成しなくてよくなる）。
+    population > 0 なら population_engine で人口比の大規模母集団を作る（プロファイルは入れない）。
+    戻り値: 既存のスナップショットを開いたか
+    """
+    with_profiles = with_profiles and not population
+    expected = {
+        "version": SNAPSHOT_VERSION,
+        "seed": seed,
+        "num": num,
+        "stats_sha256": stats_digest(stats_path),
+        "fields": list(Persona.model_fields),
+        "profile_version": PROFILE_VERSION if with_profiles else None,
+        "population": population,
+    }
+    if read_shared_meta(shared_path) == expected:
+        store.open_shared(shared_path)
+        return True
+    with file_lock(f"{shared_path}.lock"):
+        # 待っている間に他のワーカーが作り終えていればそれを使う
+        if read_shared_meta(shared_path) == expected:
+            store.open_shared(shared_path)
+            return True
+        if population:
+            from population_engine import load_population  # population_engine がこのモジュールを import している
+            store.load_columns(load_population(stats_path, population, seed, population_workers))
+            profiles = None
+        else:
+            personas, _ = load_or_generate_personas(stats_path, snapshot_path, seed, num)
+            store.load(personas)
+            profiles = [generate_persona_profile(p).model_dump_json() for p in personas] if with_profiles else None
+        store.save_shared_snapshot(shared_path, expected, profiles)
+    store.open_shared(shared_path)
+    return False
+
+if __name__ == "__main__":
+    # スナップショットを事前生成する: python persona_engine.py
+    base = os.path.dirname(os.path.abspath(__file__))
+    seed = int(os.getenv("PERSONA_SEED", "42"))
+    snapshot = os.path.join(base, "data", "personas_snapshot.jsonl.gz")
+    stats = os.path.join(base, "data", "stats_by_prefecture.json")
+    personas, cached = load_or_generate_personas(stats, snapshot, seed)
+    print(f"{len(personas)} personas ({'up to date' if cached else 'regenerated'}) → {snapshot}")
@@ -0,0 +1,440 @@
+"""
+列指向ペルソナストア
+- 属性ごとに列（array）を持ち、カテゴリ属性は転置インデックス、数値属性はソート済みインデックスで検索
+- dict 互換の参照API（get / values / len ...）を持ち、main.PERSONAS の実体として使う
+- 結果はロード順（行番号順）で返すので、同じ条件なら常に同じ順序になる
+- 共有スナップショット（save_shared_snapshot / open_shared）: 列・インデックス・各行のJSON（とプロファイル）を
+  1ファイルに書き、読み取り専用で mmap する。複数ワーカーが同じファイルを開くとページキャッシュを共有するので、
+  ワーカーを増やしてもペルソナのメモリはほぼ増えず、全ワーカーが同じ母集団を返す
+  （数値はネイティブのバイト順で書くので、同じマシンで作って使うこと）
+"""
+import json, mmap, os, struct, threading
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from models import Persona, PersonaProfile
+
+# 等値検索用の転置インデックスを持つ属性
+CATEGORICAL_FIELDS = ("prefecture", "region", "gender", "employment_type", "major_industry")
+# 範囲検索用のソート済みインデックスを持つ属性（フィルタ名 → Personaのフィールド名）
+RANGE_FIELDS = {
+    "age": "age",
+    "income": "annual_income",
+    "commute": "commute_minutes",
+}
+
+PERSONA_FIELDS = tuple(Persona.model_fields)
+
+# ── 共有スナップショット ─────────────────────────────────────────────
+# 先頭: MAGIC, ヘッダ長（8バイト）, ヘッダJSON {"meta", "count", "codes", "sections"}
+# 以降: 8バイト境界に揃えた各セクション（sections[name] = [データ先頭からの位置, バイト数, array の型コード]）
+SNAPSHOT_MAGIC = b"PSNAP001"
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+class PersonaSnapshot:
+    """save_shared_snapshot で書いたファイルを読み取り専用で mmap する"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"not a persona snapshot: {path}")
+        (header_len,) = struct.unpack_from("<Q", self._mm, len(SNAPSHOT_MAGIC))
+        start = len(SNAPSHOT_MAGIC) + 8
+        header = json.loads(self._mm[start:start + header_len])
+        self.meta: dict = header["meta"]
+        self.count: int = header["count"]
+        self.codes: dict[str, list[str]] = header["codes"]
+        self._sections: dict[str, list] = header["sections"]
+        self._base = _align(start + header_len)
+        self._open_offsets()
+        # 読んでいる途中のスレッド数（PersonaStore のロックの下で増減する）
+        self.readers = 0
+
+    def _open_offsets(self):
+        self._row_offsets = self.array("row_offsets")
+        self._profile_offsets = self.array("profile_offsets") if "profile_offsets" in self._sections else None
+
+    def has(self, name: str) -> bool:
+        return name in self._sections
+
+    def array(self, name: str) -> memoryview:
+        """セクションをコピーせずに配列として見る"""
+        offset, length, typecode = self._sections[name]
+        start = self._base + offset
+        return memoryview(self._mm)[start:start + length].cast(typecode)
+
+    def _blob(self, name: str, offsets: memoryview, i: int) -> bytes:
+        start = self._base + self._sections[name][0]
+        return self._mm[start + offsets[i]:start + offsets[i + 1]]
+
+    def row(self, i: int) -> list:
+        return json.loads(self._blob("rows", self._row_offsets, i))
+
+    def profile(self, i: int) -> bytes | None:
+        if self._profile_offsets is None:
+            return None
+        return self._blob("profiles", self._profile_offsets, i)
+
+    def ids(self) -> list[str]:
+        offset, length, _ = self._sections["ids"]
+        start = self._base + offset
+        return self._mm[start:start + length].decode("utf-8").split("\n") if length else []
+
+    def close(self) -> bool:
+        """mmap を閉じる。まだこのスナップショットを読んでいる読み手がいれば閉じずに False を返す（そのまま読める）"""
+        if self.readers:
+            return False
+        # 自分の持つ配列も mmap の参照なので、手放してから閉じる
+        self._row_offsets = self._profile_offsets = None
+        try:
+            self._mm.close()
+        except BufferError:
+            # 外に渡した配列がまだ参照されている。閉じずに元の状態に戻す
+            self._open_offsets()
+            return False
+        return True
+
+    @property
+    def closed(self) -> bool:
+        return self._mm.closed
+
+def read_shared_meta(path: str) -> dict | None:
+    try:
+        with open(path, "rb") as f:
+            head = f.read(len(SNAPSHOT_MAGIC) + 8)
+            if len(head) < len(SNAPSHOT_MAGIC) + 8 or head[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                return None
+            (header_len,) = struct.unpack_from("<Q", head, len(SNAPSHOT_MAGIC))
+            return json.loads(f.read(header_len))["meta"]
+    except (OSError, ValueError):
+        return None
+
+class PersonaStore:
+    def __init__(self):
+        # 差し替えた後もまだ読み手が配列を参照していて閉じられなかったスナップショット
+        self._retired: list[PersonaSnapshot] = []
+        self._snapshot: PersonaSnapshot | None = None
+        # スナップショットの差し替え・読み手の出入り・旧スナップショットを閉じる処理を直列にする
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            if self._snapshot is not None:
+                self._retired.append(self._snapshot)
+            self._snapshot = None
+        self._columns: dict[str, list] = {f: [] for f in PERSONA_FIELDS}
+        self._ids: list[str] = self._columns["id"]
+        # Persona オブジェクトは参照されたときに列から組み立ててキャッシュする
+        self._personas: list[Persona | None] = []
+        self._row_of: dict[str, int] = {}
+        # カテゴリ属性: 値 → コード, 行ごとのコード列, コード → 該当行番号（昇順）
+        self._codes: dict[str, dict[str, int]] = {f: {} for f in CATEGORICAL_FIELDS}
+        self._code_cols: dict[str, array] = {f: array("H") for f in CATEGORICAL_FIELDS}
+        self._postings: dict[str, list[array]] = {f: [] for f in CATEGORICAL_FIELDS}
+        # 数値属性: 行ごとの値, 値の昇順に並べた (値, 行番号)
+        self._num_cols: dict[str, array] = {f: array("i") for f in RANGE_FIELDS.values()}
+        self._sorted_vals: dict[str, array] = {}
+        self._sorted_rows: dict[str, array] = {}
+        # 古いスナップショットの配列はここで手放したので、他に読み手がいなければ mmap を閉じる
+        with self._lock:
+            self._close_retired()
+
+    def _close_retired(self):
+        self._retired = [snapshot for snapshot in self._retired if not snapshot.close()]
+
+    @contextmanager
+    def _pinned(self):
+        """今のスナップショット（なければ None）を読み終わるまで閉じさせない。
+        再読み込みは別スレッドから差し替えるので、読み手は必ずこの中で読む"""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                snapshot.readers += 1
+        try:
+            yield snapshot
+        finally:
+            if snapshot is not None:
+                with self._lock:
+                    snapshot.readers -= 1
+                    if not snapshot.readers and snapshot in self._retired:
+                        self._close_retired()
+
+    def load(self, personas: list[Persona]):
+        columns = {f: [getattr(p, f) for p in personas] for f in PERSONA_FIELDS}
+        self.load_columns(columns, personas)
+
+    def load_columns(self, columns: dict[str, list], personas: list[Persona] | None = None):
+        """列形式（フィールド名 → 値リスト）のまま取り込む。大規模生成（population_engine）用"""
+        self._rebuild(lambda fresh: fresh._fill_columns(columns, personas))
+
+    def _rebuild(self, fill):
+        """
+        新しい内容を別のストアに組み立ててから、まとめて差し替える。
+        再読み込みはスレッドで行うので、読み手（イベントループ・スレッドプール）に組み立て途中の列やインデックスを見せない
+        """
+        fresh = PersonaStore()
+        fill(fresh)
+        state = {k: v for k, v in vars(fresh).items() if k not in ("_lock", "_retired")}
+        with self._lock:
+            if self._snapshot is not None:
+                self._retired.append(self._snapshot)
+            self.__dict__.update(state)
+            self._close_retired()
+
+    def _fill_columns(self, columns: dict[str, list], personas: list[Persona] | None):
+        ids = columns["id"]
+        self._columns = {f: columns[f] for f in PERSONA_FIELDS}
+        self._ids = ids
+        self._personas = list(personas) if personas is not None else [None] * len(ids)
+        self._row_of = {pid: row for row, pid in enumerate(ids)}
+        for field in CATEGORICAL_FIELDS:
+            codes, code_col, postings = self._codes[field], self._code_cols[field], self._postings[field]
+            for row, value in enumerate(columns[field]):
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(codes)
+                    postings.append(array("I"))
+                code_col.append(code)
+                postings[code].append(row)
+        for field in RANGE_FIELDS.values():
+            self._num_cols[field] = array("i", columns[field])
+        self._build_range_indexes()
+
+    def replace_prefectures(self, prefectures, personas: list[Persona]) -> list[str]:
+        """
+        指定した都道府県のペルソナを personas で置き換える（統計の再読み込み用）。
+        他県の並び順は保ち、置き換えた県は元の位置（新しい県は末尾）に入れる。取り除いたペルソナIDを返す
+        """
+        prefectures = set(prefectures)
+        by_pref: dict[str, list[Persona]] = {}
+        for p in personas:
+            by_pref.setdefault(p.prefecture, []).append(p)
+        merged: list[Persona] = []
+        removed: list[str] = []
+        for p in self.values():
+            if p.prefecture not in prefectures:
+                merged.append(p)
+                continue
+            removed.append(p.id)
+            merged.extend(by_pref.pop(p.prefecture, ()))
+        for group in by_pref.values():
+            merged.extend(group)
+        self.load(merged)
+        return removed
+
+    def _build_range_indexes(self):
+        for field, col in self._num_cols.items():
+            order = sorted(range(len(col)), key=col.__getitem__)
+            self._sorted_rows[field] = array("I", order)
+            self._sorted_vals[field] = array("i", (col[r] for r in order))
+
+    def _row_dict(self, row: int) -> dict:
+        with self._pinned() as snapshot:
+            if snapshot is not None:
+                return dict(zip(PERSONA_FIELDS, snapshot.row(row)))
+        return {f: self._columns[f][row] for f in PERSONA_FIELDS}
+
+    def _persona(self, row: int) -> Persona:
+        p = self._personas[row]
+        if p is None:
+            p = Persona.model_construct(**self._row_dict(row))
+            self._personas[row] = p
+        return p
+
+    # ── 共有スナップショット ─────────────────────────────────────────
+    def save_shared_snapshot(self, path: str, meta: dict, profiles: list[str] | None = None):
+        """現在の内容を共有スナップショットとして書き出す（一時ファイルに書いてから置き換える）"""
+        sections: list[tuple[str, bytes, str]] = []
+        for field in CATEGORICAL_FIELDS:
+            sections.append((f"code:{field}", self._code_cols[field].tobytes(), "H"))
+            postings = self._postings[field]
+            offsets = array("Q", [0])
+            for rows in postings:
+                offsets.append(offsets[-1] + len(rows))
+            sections.append((f"postings:{field}", b"".join(array("I", rows).tobytes() for rows in postings), "I"))
+            sections.append((f"posting_offsets:{field}", offsets.tobytes(), "Q"))
+        for field in RANGE_FIELDS.values():
+            sections.append((f"num:{field}", array("i", self._num_cols[field]).tobytes(), "i"))
+            sections.append((f"sorted_rows:{field}", array("I", self._sorted_rows[field]).tobytes(), "I"))
+            sections.append((f"sorted_vals:{field}", array("i", self._sorted_vals[field]).tobytes(), "i"))
+        rows = [json.dumps(list(self._row_dict(r).values()), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                for r in range(len(self))]
+        blobs = [("rows", "row_offsets", rows)]
+        if profiles is not None:
+            blobs.append(("profiles", "profile_offsets", [p.encode("utf-8") for p in profiles]))
+        for name, offsets_name, items in blobs:
+            offsets = array("Q", [0])
+            for item in items:
+                offsets.append(offsets[-1] + len(item))
+            sections.append((name, b"".join(items), "B"))
+            sections.append((offsets_name, offsets.tobytes(), "Q"))
+        sections.append(("ids", "\n".join(self._ids).encode("utf-8"), "B"))
+
+        layout, offset = {}, 0
+        for name, data, typecode in sections:
+            layout[name] = [offset, len(data), typecode]
+            offset = _align(offset + len(data))
+        header = json.dumps({
+            "meta": meta,
+            "count": len(self),
+            "codes": {f: list(self._codes[f]) for f in CATEGORICAL_FIELDS},
+            "sections": layout,
+        }, ensure_ascii=False).encode("utf-8")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC + struct.pack("<Q", len(header)) + header)
+            base = _align(f.tell())
+            for name, data, _ in sections:
+                f.seek(base + layout[name][0])
+                f.write(data)
+            f.truncate(base + offset)
+        os.replace(tmp_path, path)
+
+    def open_shared(self, path: str):
+        """共有スナップショットを mmap して読み込む。インデックスもファイル上のものをそのまま使う"""
+        snapshot = PersonaSnapshot(path)
+        self._rebuild(lambda fresh: fresh._fill_shared(snapshot))
+        return snapshot.meta
+
+    def _fill_shared(self, snapshot: PersonaSnapshot):
+        # 共有スナップショットを開いているときは列の代わりにそこから行を読む
+        self._snapshot = snapshot
+        self._personas = [None] * snapshot.count
+        self._ids = snapshot.ids()
+        self._row_of = {pid: row for row, pid in enumerate(self._ids)}
+        for field in CATEGORICAL_FIELDS:
+            self._codes[field] = {value: code for code, value in enumerate(snapshot.codes[field])}
+            self._code_cols[field] = snapshot.array(f"code:{field}")
+            postings, offsets = snapshot.array(f"postings:{field}"), snapshot.array(f"posting_offsets:{field}")
+            self._postings[field] = [postings[offsets[c]:offsets[c + 1]] for c in range(len(offsets) - 1)]
+        for field in RANGE_FIELDS.values():
+            self._num_cols[field] = snapshot.array(f"num:{field}")
+            self._sorted_rows[field] = snapshot.array(f"sorted_rows:{field}")
+            self._sorted_vals[field] = snapshot.array(f"sorted_vals:{field}")
+
+    @property
+    def shared(self) -> bool:
+        return self._snapshot is not None
+
+    def profile(self, persona_id: str) -> PersonaProfile | None:
+        """共有スナップショットに入っているプロファイル（なければ None）"""
+        row = self._row_of.get(persona_id)
+        if row is None:
+            return None
+        with self._pinned() as snapshot:
+            raw = snapshot.profile(row) if snapshot is not None else None
+        return PersonaProfile.model_validate_json(raw) if raw is not None else None
+
+    # ── dict互換API ───────────────────────────────────────────────
+    def get(self, persona_id: str, default=None):
+        row = self._row_of.get(persona_id)
+        return default if row is None else self._persona(row)
+
+    def __getitem__(self, persona_id: str) -> Persona:
+        return self._persona(self._row_of[persona_id])
+
+    def __contains__(self, persona_id: object) -> bool:
+        return persona_id in self._row_of
+
+    def __len__(self) -> int:
+        return len(self._personas)
+
+    def __iter__(self):
+        return iter(self._row_of)
+
+    def keys(self):
+        return self._row_of.keys()
+
+    def values(self) -> list[Persona]:
+        return [self._persona(r) for r in range(len(self._personas))]
+
+    def items(self):
+        return [(p.id, p) for p in self.values()]
+
+    # ── 集計 ──────────────────────────────────────────────────────
+    def distinct(self, field: str) -> list[str]:
+        """カテゴリ属性の値一覧（初出順）"""
+        return list(self._codes[field])
+
+    def count_by(self, field: str) -> dict[str, int]:
+        return {value: len(self._postings[field][code]) for value, code in self._codes[field].items()}
+
+    # ── 検索 ──────────────────────────────────────────────────────
+    def query_rows(self, **filters) -> list[int]:
+        """
+        条件に合う行番号を昇順で返す。
+        等値: prefecture / region / gender / employment_type / major_industry
+        範囲: age_min / age_max / income_min / income_max / commute_min / commute_max（両端含む）
+        None や空文字の条件は無視する。
+        """
+        eq: list[tuple[str, int]] = []
+        for field in CATEGORICAL_FIELDS:
+            value = filters.get(field)
+            if not value:
+                continue
+            code = self._codes[field].get(value)
+            if code is None:
+                return []
+            eq.append((field, code))
+
+        ranges: list[tuple[str, int | None, int | None]] = []
+        for name, field in RANGE_FIELDS.items():
+            lo, hi = filters.get(f"{name}_min"), filters.get(f"{name}_max")
+            if lo is not None or hi is not None:
+                ranges.append((field, lo, hi))
+
+        if not eq and not ranges:
+            return list(range(len(self._personas)))
+
+        # 候補集合: 転置リスト・範囲スライスのうち最も件数の少ないものから始める
+        best_size, best = None, None
+        for i, (field, code) in enumerate(eq):
+            size = len(self._postings[field][code])
+            if best_size is None or size < best_size:
+                best_size, best = size, ("eq", i, None, None)
+        for i, (field, lo, hi) in enumerate(ranges):
+            vals = self._sorted_vals[field]
+            start = 0 if lo is None else bisect_left(vals, lo)
+            end = len(vals) if hi is None else bisect_right(vals, hi)
+            if best_size is None or end - start < best_size:
+                best_size, best = end - start, ("range", i, start, end)
+        kind, i, start, end = best
+        if kind == "eq":
+            field, code = eq.pop(i)
+            candidates = self._postings[field][code]
+        else:
+            field = ranges.pop(i)[0]
+            candidates = sorted(self._sorted_rows[field][start:end])
+
+        # 残りの条件は列を直接参照して絞り込む
+        for field, code in eq:
+            col = self._code_cols[field]
+            candidates = [r for r in candidates if col[r] == code]
+        for field, lo, hi in ranges:
+            col = self._num_cols[field]
+            lo = -(2 ** 31) if lo is None else lo
+            hi = 2 ** 31 - 1 if hi is None else hi
+            candidates = [r for r in candidates if lo <= col[r] <= hi]
+        return list(candidates)
+
+    def row_of(self, persona_id: str) -> int | None:
+        return self._row_of.get(persona_id)
+
+    def id_at(self, row: int) -> str:
+        return self._ids[row]
+
+    def project(self, rows, fields=PERSONA_FIELDS) -> list[dict]:
+        """指定行の指定フィールドだけを dict にする（Persona を組み立てず列から直接読む）"""
+        with self._pinned() as snapshot:
+            if snapshot is not None:
+                rows = [dict(zip(PERSONA_FIELDS, snapshot.row(r))) for r in rows]
+                return [{f: d[f] for f in fields} for d in rows]
+        columns = [(f, self._columns[f]) for f in fields]
+        return [{f: col[r] for f, col in columns} for r in rows]
+
+    def query(self, **filters) -> list[Persona]:
+        return [self._persona(r) for r in self.query_rows(**filters)]
@@ -0,0 +1,187 @@
+"""
+大規模ペルソナ生成エンジン（市場規模推計用: 1万〜100万人）
+- 都道府県ごとの人数を実人口（stats の population）で按分
+- 属性は都道府県単位でまとめて一括抽選し、Persona を作らず列形式（フィールド名 → 値リスト）で返す
+- 都道府県ごとに独立した乱数系列を使うので、プロセス数を変えても結果は同じ
+生成結果は PersonaStore.load_columns() でそのまま取り込める（PERSONA_POPULATION を指定すると起動時にこれを使う）。
+
+速くなるのは「一括（バッチ）化」のおかげで、ベクトル化ではない: 要素ごとのループは Python のまま残っているが、
+1人ずつ Persona を組み立てて属性ごとに関数を呼ぶ代わりに、属性ごとに rng.choices(k=n) などでまとめて引き、
+列に直接詰めるので1人あたりの呼び出しとオブジェクト生成が減る（手元で1プロセス約5倍）。
+workers > 1 は都道府県ごとの列をプロセス間で pickle して戻すぶん余計にかかるので、
+コアが複数あり、1プロセスあたりの人数が大きい（目安: 数十万人以上）ときだけ速くなる。既定は1プロセス。
+"""
+import json, os, random
+from concurrent.futures import ProcessPoolExecutor
+from persona_engine import (
+    GENDERS, OCCUPATIONS, HOUSEHOLD_LABELS, TRAITS_POOL, BRAND_DB,
+    generate_daily_routine, prefecture_rng,
+)
+from persona_store import PERSONA_FIELDS
+
+AGE_RANGES = {
+    "20s": (20, 29),
+    "30s": (30, 39),
+    "40s": (40, 49),
+    "50s": (50, 59),
+    "60s": (60, 69),
+    "70plus": (70, 80),
+}
+INCOME_RANGES = {
+    "under_200": (80, 199),
+    "200_400": (200, 399),
+    "400_600": (400, 599),
+    "600_800": (600, 799),
+    "over_800": (800, 1200),
+}
+OTHER_PARTIES = ["立憲民主党支持", "維新支持", "共産党支持", "国民民主党支持"]
+
+def allocate_by_population(stats: dict, total: int) -> dict[str, int]:
+    """総人数を都道府県人口で按分する（最大剰余法）。population がない場合は均等割り"""
+    weights = {pref: s.get("population", 1) for pref, s in stats.items()}
+    weight_sum = sum(weights.values())
+    quotas = {pref: total * w / weight_sum for pref, w in weights.items()}
+    counts = {pref: int(q) for pref, q in quotas.items()}
+    remainder = total - sum(counts.values())
+    for pref in sorted(quotas, key=lambda p: quotas[p] - counts[p], reverse=True)[:remainder]:
+        counts[pref] += 1
+    return counts
+
+def _uniform_ints(rng: random.Random, ranges: list[tuple[int, int]]) -> list[int]:
+    rand = rng.random
+    return [lo + int(rand() * (hi - lo + 1)) for lo, hi in ranges]
+
+def _draw_brands(rng: random.Random, ages: list[int], genders: list[str], incomes: list[int]) -> list[dict[str, str]]:
+    """assign_brands と同じ規則をカテゴリ単位でまとめて抽選する"""
+    n = len(ages)
+    rand = rng.random
+    tiers = ["low" if i < 300 else "mid" if i < 600 else "high" for i in incomes]
+    brands: list[dict[str, str]] = [{} for _ in range(n)]
+    for category, options in BRAND_DB.items():
+        if category == "タバコ":
+            smokers = options["all"]
+            u = [rand() for _ in range(n)]
+            for b, age, gender, r in zip(brands, ages, genders, u):
+                p = 0.35 if gender == "男性" and age >= 40 else 0.20 if gender == "男性" else 0.08
+                b[category] = smokers[int(rand() * len(smokers))] if r < p else options["not_smoker"]
+            continue
+        if category == "コンビニ":
+            pool = options["all"]
+            for b in brands:
+                b[category] = pool[int(rand() * len(pool))]
+            continue
+        pools = {t: options.get(t) or options.get("mid") or ["（特になし）"] for t in ("low", "mid", "high")}
+        for b, tier, gender in zip(brands, tiers, genders):
+            if category == "化粧品" and gender == "男性":
+                b[category] = options["male"]
+            else:
+                pool = pools[tier]
+                b[category] = pool[int(rand() * len(pool))]
+    return brands
+
+def generate_prefecture_columns(pref_name: str, stats: dict, num: int, seed: int) -> dict[str, list]:
+    """1都道府県分を属性ごとの一括抽選で生成し、列形式で返す"""
+    rng = prefecture_rng(seed, pref_name)
+    rand = rng.random
+
+    def draw(distribution: dict) -> list[str]:
+        return rng.choices(list(distribution), weights=list(distribution.values()), k=num)
+
+    genders = rng.choices(GENDERS, k=num)
+    ages = _uniform_ints(rng, [AGE_RANGES[g] for g in draw(stats["age_distribution"])])
+    emp_types = draw(stats["employment_type"])
+    industries = rng.choices(stats["major_industries"], k=num)
+    occupations = []
+    for emp_type, industry in zip(emp_types, industries):
+        occ_list = OCCUPATIONS.get(industry, ["会社員", "自営業"])
+        occupation = occ_list[int(rand() * len(occ_list))]
+        if emp_type == "part_time":
+            occupation = f"{occupation}（パート・アルバイト）"
+        elif emp_type == "self_employed":
+            occupation = f"自営業（{industry}関連）"
+        elif emp_type == "unemployed":
+            occupation = "無職・求職中"
+        occupations.append(occupation)
+    incomes = _uniform_ints(rng, [INCOME_RANGES[b] for b in draw(stats["income_distribution"])])
+    households = [HOUSEHOLD_LABELS[h] for h in draw(stats["household_type"])]
+    own_rate = stats["homeownership_rate"]
+    housing = ["持ち家" if rand() < own_rate else "賃貸" for _ in range(num)]
+
+    food, house, ent = stats["avg_monthly_food"], stats["avg_monthly_housing"], stats["avg_monthly_entertainment"]
+    monthly_food = [int(food * (0.8 + 0.4 * rand())) for _ in range(num)]
+    monthly_housing = [int(house * (0.7 + 0.6 * rand())) for _ in range(num)]
+    monthly_ent = [int(ent * (0.6 + 0.8 * rand())) for _ in range(num)]
+
+    ldp = stats["ldp_vote_share"]
+    others_cut = ldp + 0.15 + (1 - ldp - 0.15) * 0.6
+    political = []
+    for r in (rand() for _ in range(num)):
+        if r < ldp:
+            political.append("自民党支持")
+        elif r < ldp + 0.15:
+            political.append("公明党支持")
+        elif r < others_cut:
+            political.append(OTHER_PARTIES[int(rand() * len(OTHER_PARTIES))])
+        else:
+            political.append("無党派・政治無関心")
+
+    traits = rng.choices(TRAITS_POOL, k=num)
+    commute_base = stats["avg_commute_minutes"]
+    routines = [
+        generate_daily_routine(commute_base, age, household, occupation)
+        for age, household, occupation in zip(ages, households, occupations)
+    ]
+    commutes = _uniform_ints(rng, [(commute_base - 10, commute_base + 15)] * num)
+
+    pref_id = pref_name.replace("都", "").replace("道", "").replace("府", "").replace("県", "")
+    return {
+        "id": [f"{pref_id}_{i+1:02d}" for i in range(num)],
+        "prefecture": [pref_name] * num,
+        "region": [stats["region"]] * num,
+        "age": ages,
+        "gender": genders,
+        "occupation": occupations,
+        "employment_type": emp_types,
+        "annual_income": incomes,
+        "household_type": households,
+        "housing": housing,
+        "monthly_food": monthly_food,
+        "monthly_housing": monthly_housing,
+        "monthly_entertainment": monthly_ent,
+        "commute_minutes": commutes,
+        "sleep_hours": [stats["avg_sleep_hours"]] * num,
+        "daily_routine": routines,
+        "political_leaning": political,
+        "personality_traits": [list(t) for t in traits],
+        "major_industry": industries,
+        "preferred_brands": _draw_brands(rng, ages, genders, incomes),
+    }
+
+def _generate_job(job: tuple[str, dict, int, int]) -> dict[str, list]:
+    return generate_prefecture_columns(*job)
+
+def generate_population(stats: dict, total: int, seed: int, workers: int = 1) -> dict[str, list]:
+    """
+    全国 total 人を人口比で生成して列形式で返す。
+    workers > 1 なら都道府県単位でプロセス並列化する（0 は CPU 数。小さい母集団では pickle の分かえって遅い）。
+    """
+    counts = allocate_by_population(stats, total)
+    jobs = [(pref, pref_stats, counts[pref], seed) for pref, pref_stats in stats.items() if counts[pref] > 0]
+    workers = workers or os.cpu_count() or 1
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_generate_job, jobs))
+    else:
+        parts = [_generate_job(job) for job in jobs]
+
+    columns: dict[str, list] = {f: [] for f in PERSONA_FIELDS}
+    for part in parts:
+        for field in PERSONA_FIELDS:
+            columns[field].extend(part[field])
+    return columns
+
+def load_population(stats_path: str, total: int, seed: int, workers: int = 1) -> dict[str, list]:
+    with open(stats_path, "r", encoding="utf-8") as f:
+        stats = json.load(f)
+    return generate_population(stats, total, seed, workers)
@@ -0,0 +1,147 @@
+"""
+Gemini API のレート制限（GCRA）& 使用量トラッキング
+- モデルごとに RPM / TPM の GCRA バケットと RPD の日次カウンタを持つ
+- 枠の予約は同期的に行う（イベントループ上では割り込まれない）ので、呼び出し順 = 実行順（FIFO）になる
+  （sqlite ストアはイベントループを止めないようスレッドで予約するので、同時に来た呼び出し同士の順序は保証しない）
+- 予約後はロックを持たずに自分の開始時刻まで眠るだけなので、待機者同士が直列化されない
+- API に届かなかったリクエスト（キャンセル・通信エラー等）は refund() で枠を返却する
+- 応答後は settle() で TPM の予約を実際のトークン数に合わせる
+- 状態は shared_state の RateLimitStore に置く（RATE_LIMIT_STORE=sqlite なら複数ワーカーで1つの枠を共有）
+"""
+import asyncio, logging, os
+from metrics import RATE_LIMIT_WAIT
+from shared_state import RateLimits, RateLimitStore, create_rate_limit_store
+
+logger = logging.getLogger(__name__)
+
+class QuotaExceededError(Exception):
+    """RPD を使い切った（API は呼ばずに失敗させる）。既存の 429 判定に合わせた文言にしている"""
+
+class Reservation:
+    __slots__ = ("model", "tokens", "started_at", "refunded")
+
+    def __init__(self, model: str, tokens: int):
+        self.model = model
+        self.tokens = tokens
+        self.started_at: float | None = None
+        self.refunded = False
+
+class UsageTracker:
+    RPM_LIMIT = int(os.getenv("GEMINI_RPM_LIMIT", "15"))
+    RPD_LIMIT = int(os.getenv("GEMINI_RPD_LIMIT", "1500"))
+    TPM_LIMIT = int(os.getenv("GEMINI_TPM_LIMIT", "250000"))
+    # RPM の連続実行許容数。1 なら 60/RPM 秒間隔に均す（どの60秒窓でも RPM を超えない）
+    RPM_BURST = int(os.getenv("GEMINI_RPM_BURST", "1"))
+
+    def __init__(self, default_model: str | None = None, store: RateLimitStore | None = None):
+        self.default_model = default_model or os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+        self.store = store or create_rate_limit_store()
+        self._models: dict[str, RateLimits] = {}
+
+    def _limits(self, model: str) -> RateLimits:
+        limits = self._models.get(model)
+        if limits is None:
+            limits = self._models[model] = RateLimits(self.RPM_LIMIT, self.RPD_LIMIT, self.TPM_LIMIT, self.RPM_BURST)
+        return limits
+
+    async def _call(self, fn, *args, undo=None):
+        """
+        ストアの操作を実行する。blocking なストアはスレッドで実行してイベントループを止めない。
+        スレッドで始めた操作は取り消せないので、待っている間にキャンセルされたら終わった後で undo(結果) を呼ぶ
+        """
+        if not self.store.blocking:
+            return fn(*args)
+        future = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if undo is not None:
+                future.add_done_callback(lambda f: None if f.cancelled() or f.exception() else undo(f.result()))
+            raise
+
+    def _call_soon(self, fn, *args):
+        """結果を待たないストアの操作（返却・TPM の調整）。blocking なストアはスレッドに任せる"""
+        if not self.store.blocking:
+            fn(*args)
+            return
+        future = asyncio.get_running_loop().run_in_executor(None, fn, *args)
+        future.add_done_callback(_log_store_error)
+
+    async def acquire(self, model: str | None = None, tokens: int = 0) -> Reservation:
+        """RPM/TPM/RPD の枠を予約し、実行可能な時刻まで待つ"""
+        model = model or self.default_model
+        limits = self._limits(model)
+        tokens = min(tokens, limits.tpm)
+        reservation = Reservation(model, tokens)
+        delay = await self._call(
+            self.store.reserve, model, limits, tokens,
+            undo=lambda d: None if d is None else self.refund(reservation),
+        )
+        if delay is None:
+            raise QuotaExceededError(f"429 RESOURCE_EXHAUSTED: {model} の1日のリクエスト上限（{limits.rpd}）に達しました")
+
+        RATE_LIMIT_WAIT.observe(max(0.0, delay), model=model)
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            reservation.started_at = await self._call(self.store.mark_started, model)
+        except asyncio.CancelledError:
+            self.refund(reservation)
+            raise
+        return reservation
+
+    async def wait_if_needed(self, model: str | None = None) -> Reservation:
+        """互換用: トークン数を見積もらずに1リクエスト分の枠を取る"""
+        return await self.acquire(model)
+
+    def refund(self, reservation: Reservation):
+        """API に届かなかったリクエストの枠を返す（二重返却はしない）"""
+        if reservation.refunded:
+            return
+        reservation.refunded = True
+        self._call_soon(self.store.refund, reservation.model, self._limits(reservation.model), reservation.tokens, reservation.started_at)
+
+    def settle(self, reservation: Reservation, actual_tokens: int):
+        """予約時に見積もった TPM を実際のトークン数に合わせる（差分を返却、または追加で消費）"""
+        if reservation.refunded:
+            return
+        limits = self._limits(reservation.model)
+        actual = min(actual_tokens, limits.tpm)
+        if actual != reservation.tokens:
+            self._call_soon(self.store.adjust_tokens, reservation.model, limits, actual - reservation.tokens)
+        reservation.tokens = actual
+
+    def _model_status(self, model: str) -> dict:
+        limits = self._limits(model)
+        requests_today, rpm_current = self.store.usage(model, limits)
+        return {
+            "requests_today": requests_today,
+            "requests_remaining_today": max(0, limits.rpd - requests_today),
+            "rpm_current": rpm_current,
+            "rpm_limit": limits.rpm,
+            "rpd_limit": limits.rpd,
+            "tpm_limit": limits.tpm,
+            "quota_pct_used": round(requests_today / limits.rpd * 100, 1),
+        }
+
+    def usage_summary(self, model: str | None = None) -> dict:
+        """進捗表示用の最小限の使用量（get_status より軽い）"""
+        model = model or self.default_model
+        limits = self._limits(model)
+        requests_today, _ = self.store.usage(model, limits)
+        return {"requests_today": requests_today, "requests_remaining_today": max(0, limits.rpd - requests_today)}
+
+    def get_status(self) -> dict:
+        """既定モデルの使用量をトップレベルに、全モデル分（他のワーカーが使ったモデルを含む）を models に入れて返す"""
+        status = self._model_status(self.default_model)
+        status["model"] = self.default_model
+        models = dict.fromkeys([*self._models, *self.store.models()])
+        status["models"] = {m: self._model_status(m) for m in models}
+        status["store"] = self.store.get_status()
+        return status
+
+def _log_store_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("rate limit store update failed", exc_info=future.exception())
+
+usage_tracker = UsageTracker()
@@ -0,0 +1,184 @@
+"""
+一括質問の再試行と並列度の自動調整
+- RetryPolicy: 429 / 5xx / タイムアウトを指数バックオフ（full jitter）で再試行する。
+  応答に retry-after（ヘッダ、または Gemini の RetryInfo.retryDelay）があればその時間は必ず待つ。
+  1人あたりの締め切り（deadline）を超える再試行はしない。
+  hedge_after 秒たっても返らない呼び出しには同じ問い合わせをもう1本送り、先に返った方を使う（遅い裾の短縮）
+- AdaptiveConcurrency: AIMD で同時実行数を決める。
+  成功して応答時間が落ち着いていれば +1/limit（1往復ぶんで約 +1）、429 なら半分に減らす
+  （同時に返ってきた 429 で何度も半減しないよう、1回減らしたら応答時間ぶんは減らさない）。
+  応答時間がいちばん速かったときの LATENCY_TOLERANCE 倍を超えている間は増やさない
+  （ローカルのレート制限待ちで遅くなっているときに並列度を上げても待ちが増えるだけなので）
+- 日次上限（QuotaExceededError）とトークン予算切れは待っても回復しないので再試行しない
+"""
+import asyncio, json, os, random, re, time
+from google.genai import errors
+from metrics import BULK_RETRIES, BULK_HEDGES, BULK_CONCURRENCY_LIMIT, error_kind
+from rate_limiter import QuotaExceededError
+from token_usage import TokenBudgetExceeded
+
+_RETRY_DELAY_RE = re.compile(r"retryDelay['\"]?\s*:\s*['\"](\d+(?:\.\d+)?)s")
+
+def is_rate_limited(e: BaseException) -> bool:
+    """API が返した 429 / RESOURCE_EXHAUSTED か、ローカルの日次上限（メッセージ中の数字では判定しない）"""
+    if isinstance(e, QuotaExceededError):
+        return True
+    return getattr(e, "code", None) == 429 or getattr(e, "status", None) == "RESOURCE_EXHAUSTED"
+
+def is_retryable(e: BaseException) -> bool:
+    if isinstance(e, (QuotaExceededError, TokenBudgetExceeded)):
+        return False
+    if isinstance(e, errors.ServerError) or isinstance(e, asyncio.TimeoutError):
+        return True
+    return is_rate_limited(e)
+
+def retry_after(e: BaseException) -> float | None:
+    """サーバーが指定した待ち時間（秒）。Retry-After ヘッダか Gemini の RetryInfo から読む"""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value and value.strip().replace(".", "", 1).isdigit():
+            return float(value)
+    details = getattr(e, "details", None)
+    text = json.dumps(details) if isinstance(details, (dict, list)) else str(details or e)
+    m = _RETRY_DELAY_RE.search(text)
+    return float(m.group(1)) if m else None
+
+class AdaptiveConcurrency:
+    """AIMD で上限を調整するセマフォ。async with limiter: で1枠使う"""
+    LATENCY_TOLERANCE = 2.0
+    DECREASE_FACTOR = 0.5
+
+    def __init__(self, initial: float, minimum: int = 1, maximum: int = 32, label: str = ""):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = min(self.maximum, max(float(minimum), initial))
+        self.label = label
+        self.in_flight = 0
+        self.min_latency: float | None = None
+        self.latency_ewma: float | None = None
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+        BULK_CONCURRENCY_LIMIT.set(self.limit, model=label)
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def _set(self, limit: float):
+        self.limit = min(self.maximum, max(float(self.minimum), limit))
+        BULK_CONCURRENCY_LIMIT.set(self.limit, model=self.label)
+
+    def on_success(self, latency: float):
+        self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        if latency <= self.min_latency * self.LATENCY_TOLERANCE:
+            self._set(self.limit + 1 / self.limit)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self._last_decrease < (self.latency_ewma or 1.0):
+            return
+        self._last_decrease = now
+        self._set(self.limit * self.DECREASE_FACTOR)
+
+    def hedge_delay(self, factor: float = 3.0) -> float | None:
+        """これより遅い呼び出しを「遅い裾」とみなす目安（まだ計測値がなければ None）"""
+        return None if self.latency_ewma is None else self.latency_ewma * factor
+
+class RetryPolicy:
+    ATTEMPTS = int(os.getenv("BULK_RETRY_ATTEMPTS", "4"))
+    BASE_DELAY = float(os.getenv("BULK_RETRY_BASE_DELAY", "1.0"))
+    MAX_DELAY = float(os.getenv("BULK_RETRY_MAX_DELAY", "30"))
+    DEADLINE = float(os.getenv("BULK_CALL_DEADLINE", "180"))
+    # 秒数、"auto"（平均応答時間の3倍）、または 0（ヘッジしない）
+    HEDGE_AFTER = os.getenv("BULK_HEDGE_AFTER", "0")
+
+    def __init__(self, attempts: int | None = None, base_delay: float | None = None, max_delay: float | None = None,
+                 deadline: float | None = None, hedge_after: str | float | None = None, label: str = ""):
+        self.attempts = max(1, attempts or self.ATTEMPTS)
+        self.base_delay = self.BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = self.MAX_DELAY if max_delay is None else max_delay
+        self.deadline = deadline or self.DEADLINE
+        self.hedge_after = str(self.HEDGE_AFTER if hedge_after is None else hedge_after).strip().lower()
+        self.label = label
+        self.retries = 0
+
+    def backoff(self, attempt: int, server_delay: float | None) -> float:
+        if server_delay is not None:
+            # 指定された時間は必ず待ち、再開が揃わないよう少しずらす
+            return server_delay + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _hedge_delay(self, limiter: AdaptiveConcurrency | None) -> float | None:
+        if self.hedge_after in ("", "0", "off"):
+            return None
+        if self.hedge_after == "auto":
+            return limiter.hedge_delay() if limiter is not None else None
+        return float(self.hedge_after)
+
+    async def _hedged(self, call, timeout: float, hedge_after: float | None):
+        if hedge_after is None or hedge_after >= timeout:
+            return await call(timeout)
+        primary = asyncio.create_task(call(timeout))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if done and not primary.cancelled():
+                return primary.result()
+            tasks.add(asyncio.create_task(call(timeout - hedge_after)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # 取り消された方は exception() 自体が CancelledError を送出するので先に確かめる
+                    if task.cancelled():
+                        continue
+                    if task.exception() is None:
+                        BULK_HEDGES.inc(model=self.label, winner="primary" if task is primary else "hedge")
+                        return task.result()
+                    error = task.exception()
+            raise error if error is not None else asyncio.CancelledError()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def run(self, call, limiter: AdaptiveConcurrency | None = None):
+        """
+        call(timeout) を再試行付きで実行する。timeout はその試行に使ってよい秒数（締め切りまでの残り）。
+        limiter があれば試行中だけ枠を使い（バックオフ中は返す）、結果を AIMD に反映する
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - loop.time()
+            try:
+                if limiter is None:
+                    return await asyncio.wait_for(self._hedged(call, remaining, self._hedge_delay(None)), remaining)
+                async with limiter:
+                    started = loop.time()
+                    remaining = deadline - started
+                    result = await asyncio.wait_for(self._hedged(call, remaining, self._hedge_delay(limiter)), remaining)
+                    limiter.on_success(loop.time() - started)
+                    return result
+            except Exception as e:
+                if limiter is not None and is_rate_limited(e) and not isinstance(e, QuotaExceededError):
+                    limiter.on_throttle()
+                attempt += 1
+                if attempt >= self.attempts or not is_retryable(e):
+                    raise
+                delay = self.backoff(attempt, retry_after(e))
+                if loop.time() + delay >= deadline:
+                    raise
+                self.retries += 1
+                BULK_RETRIES.inc(model=self.label, kind=error_kind(e))
+                await asyncio.sleep(delay)
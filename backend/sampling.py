@@ -0,0 +1,294 @@
+"""
+層化サンプリングによる一括質問（全員に聞かずに母集団での回答分布を推計する）
+- 層: 都道府県 × 年齢帯 × 性別 × 所得帯。母集団の構成は stats_by_prefecture.json の人口と年齢・所得分布から求める
+- 質問順: 都道府県を人口比（サン＝ラグ方式）で巡回し、都道府県内では構成比に対して最も不足している層から選ぶ
+  → どこで打ち切っても標本が母集団の縮図に近い
+- 推計: 回答を選択肢に符号化し、都道府県・年齢帯・性別・所得帯の周辺分布にレイキングした重みで比率を出す
+  信頼区間はキッシュの有効標本数を使ったウィルソンの 95% 区間
+- wave_size 人ごとに推計を更新し、区間が十分狭くなるか推計値が動かなくなったら打ち切る
+"""
+import heapq, math, random, unicodedata
+from collections import defaultdict
+from contextlib import aclosing
+from models import Persona
+from persona_engine import GENDERS
+from population_engine import AGE_RANGES, INCOME_RANGES
+from gemini_client import bulk_ask_stream
+from token_usage import current_meter
+
+UNCODED = "その他・不明"
+Z_95 = 1.96
+DIMENSIONS = ("prefecture", "age", "gender", "income")
+
+def age_band(age: int) -> str:
+    for band, (_, hi) in AGE_RANGES.items():
+        if age <= hi:
+            return band
+    return band
+
+def income_tier(annual_income: int) -> str:
+    for tier, (_, hi) in INCOME_RANGES.items():
+        if annual_income <= hi:
+            return tier
+    return tier
+
+def stratum_of(p: Persona) -> tuple[str, str, str, str]:
+    return (p.prefecture, age_band(p.age), p.gender, income_tier(p.annual_income))
+
+def population_margins(stats: dict, prefectures: set[str] | None = None) -> dict[str, dict[str, float]]:
+    """層の各次元の母集団人数（周辺分布）。性別は均等とみなす"""
+    margins: dict[str, dict[str, float]] = {d: defaultdict(float) for d in DIMENSIONS}
+    for pref, s in stats.items():
+        if prefectures is not None and pref not in prefectures:
+            continue
+        pop = s.get("population", 1)
+        margins["prefecture"][pref] += pop
+        for band, share in s["age_distribution"].items():
+            margins["age"][band] += pop * share
+        for tier, share in s["income_distribution"].items():
+            margins["income"][tier] += pop * share
+        for gender in GENDERS:
+            margins["gender"][gender] += pop / len(GENDERS)
+    return {d: dict(m) for d, m in margins.items()}
+
+# ── 質問順（標本の選び方） ─────────────────────────────────────────
+def sample_order(personas: list[Persona], stats: dict, limit: int, seed: int) -> list[Persona]:
+    """
+    先頭 k 人がどの k でも層化標本になるように並べた limit 人を返す。
+    都道府県: 人口 / (2 × 選出済み人数 + 1) が最大の県から順に選ぶ（サン＝ラグ方式）
+    県内    : 年齢帯・性別・所得帯それぞれの「全国の目標構成比 × (選出済み+1) − 選出済み」の和が
+              最大になる層から選ぶ（どの時点でも各次元の構成が母集団に近くなる）
+    同点や層内の順は seed で決まる（同じ条件なら同じ標本 → 回答キャッシュが効く）
+    """
+    rng = random.Random(seed)
+    buckets: dict[str, dict[tuple, list[Persona]]] = defaultdict(lambda: defaultdict(list))
+    for p in personas:
+        pref, band, gender, tier = stratum_of(p)
+        buckets[pref][(band, gender, tier)].append(p)
+    for cells in buckets.values():
+        for members in cells.values():
+            rng.shuffle(members)
+
+    margins = population_margins(stats, set(buckets))
+    shares = []
+    for dim in DIMENSIONS[1:]:
+        total = sum(margins[dim].values()) or 1.0
+        shares.append({c: v / total for c, v in margins[dim].items()})
+    taken: list[dict[str, int]] = [defaultdict(int) for _ in shares]
+
+    def deficit(cell: tuple, n: int) -> float:
+        return sum(share.get(c, 0.0) * (n + 1) - t[c] for c, share, t in zip(cell, shares, taken))
+
+    # (-優先度, 同点用の乱数, 県名, 選出済み人数)
+    heap = [(-stats.get(pref, {}).get("population", 1), rng.random(), pref, 0) for pref in buckets]
+    heapq.heapify(heap)
+    order: list[Persona] = []
+    while heap and len(order) < limit:
+        _, _, pref, k = heapq.heappop(heap)
+        cells = buckets[pref]
+        n = len(order)
+        cell = max((c for c, members in cells.items() if members), key=lambda c: deficit(c, n))
+        order.append(cells[cell].pop())
+        for c, t in zip(cell, taken):
+            t[c] += 1
+        k += 1
+        if any(cells.values()):
+            pop = stats.get(pref, {}).get("population", 1)
+            heapq.heappush(heap, (-pop / (2 * k + 1), rng.random(), pref, k))
+    return order
+
+# ── 回答の符号化 ───────────────────────────────────────────────────
+def _fold(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).lower()
+
+def coded_question(question: str, options: list[str]) -> str:
+    """選択肢を付けた質問文（回答の冒頭に選択肢を書かせて符号化しやすくする）"""
+    choices = " / ".join(f"「{o}」" for o in options)
+    return (
+        f"{question}\n\n"
+        f"次の選択肢から最も近いものを1つ選び、回答の最初に選択肢をそのまま書いてから理由を続けてください。\n"
+        f"選択肢: {choices}"
+    )
+
+def code_answer(answer: str, options: list[str]) -> str:
+    """回答中で最初に現れた選択肢を返す（同じ位置なら長い方）。どれも含まれなければ UNCODED"""
+    text = _fold(answer)
+    best: tuple[int, int] | None = None
+    choice = UNCODED
+    for option in options:
+        pos = text.find(_fold(option))
+        if pos >= 0 and (best is None or (pos, -len(option)) < best):
+            best, choice = (pos, -len(option)), option
+    return choice
+
+# ── 推計 ───────────────────────────────────────────────────────────
+def rake_weights(strata: list[tuple], margins: dict[str, dict[str, float]], iterations: int = 50, tol: float = 1e-6) -> list[float]:
+    """
+    標本の重みを各次元の周辺分布に合わせる（反復比例フィッティング）。
+    標本にない区分は目標から外し、各次元の合計を標本に含まれる都道府県の人口にそろえる。
+    """
+    n = len(strata)
+    if n == 0:
+        return []
+    targets: list[dict[str, float]] = []
+    total = sum(margins["prefecture"].get(pref, 0.0) for pref in {s[0] for s in strata}) or float(n)
+    for d, dim in enumerate(DIMENSIONS):
+        present = {s[d] for s in strata}
+        m = {c: margins[dim].get(c, 0.0) for c in present}
+        m_sum = sum(m.values())
+        targets.append({c: (v / m_sum * total if m_sum else total / len(present)) for c, v in m.items()})
+
+    weights = [total / n] * n
+    for _ in range(iterations):
+        worst = 0.0
+        for d, target in enumerate(targets):
+            sums: dict[str, float] = defaultdict(float)
+            for s, w in zip(strata, weights):
+                sums[s[d]] += w
+            factors = {c: (target[c] / sums[c] if sums[c] else 1.0) for c in target}
+            worst = max(worst, max(abs(f - 1.0) for f in factors.values()))
+            weights = [w * factors[s[d]] for s, w in zip(strata, weights)]
+        if worst < tol:
+            break
+    return weights
+
+def wilson_interval(p: float, n_eff: float, z: float = Z_95) -> tuple[float, float]:
+    if n_eff <= 0:
+        return 0.0, 1.0
+    denom = 1 + z * z / n_eff
+    center = (p + z * z / (2 * n_eff)) / denom
+    half = z * math.sqrt(p * (1 - p) / n_eff + z * z / (4 * n_eff * n_eff)) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+class SampleEstimator:
+    """符号化した回答を溜め、レイキング重み付きの比率と信頼区間を返す"""
+
+    def __init__(self, options: list[str], margins: dict[str, dict[str, float]]):
+        self.options = list(options)
+        self.margins = margins
+        self.strata: list[tuple] = []
+        self.codes: list[str] = []
+
+    def add(self, persona: Persona, answer: str) -> str:
+        code = code_answer(answer, self.options)
+        self.strata.append(stratum_of(persona))
+        self.codes.append(code)
+        return code
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def estimate(self) -> dict:
+        weights = rake_weights(self.strata, self.margins)
+        w_sum = sum(weights)
+        w_sq = sum(w * w for w in weights)
+        n_eff = w_sum * w_sum / w_sq if w_sq else 0.0
+        shares: dict[str, float] = defaultdict(float)
+        for code, w in zip(self.codes, weights):
+            shares[code] += w
+        estimates = []
+        for option in self.options + [UNCODED]:
+            p = shares[option] / w_sum if w_sum else 0.0
+            lo, hi = wilson_interval(p, n_eff)
+            estimates.append({
+                "option": option,
+                "share": round(p, 4),
+                "ci_low": round(lo, 4),
+                "ci_high": round(hi, 4),
+                "count": self.codes.count(option),
+            })
+        return {
+            "sampled": len(self.codes),
+            "effective_n": round(n_eff, 1),
+            "population": round(w_sum),
+            "max_half_width": round(max((e["ci_high"] - e["ci_low"]) / 2 for e in estimates), 4),
+            "estimates": estimates,
+        }
+
+# ── 実行 ───────────────────────────────────────────────────────────
+async def sampled_ask_stream(
+    personas: list[Persona],
+    stats: dict,
+    question: str,
+    options: list[str],
+    *,
+    sample_size: int = 80,
+    min_sample: int = 30,
+    wave_size: int = 10,
+    margin: float = 0.1,
+    tolerance: float = 0.02,
+    seed: int = 0,
+    concurrency: int = 5,
+    model_name: str = "gemini-2.5-flash",
+    use_cache: bool = True,
+    batch_size: int = 1,
+):
+    """
+    層化標本に wave_size 人ずつ質問し、{"type": "progress" | "estimate" | "done", ...} を yield する。
+    打ち切り条件（min_sample 人以上回答してから判定）:
+      margin    : すべての選択肢で 95% 区間の半幅が margin 以下
+      stable    : 2波続けて推計値の変化が tolerance 以下
+      sample_size / exhausted: 上限人数に達した / 候補がいない
+      token_budget: トークン予算（TokenMeter）を使い切った
+    失敗した回答は無回答として推計に含めない。
+    """
+    meter = current_meter()
+    order = sample_order(personas, stats, sample_size, seed)
+    estimator = SampleEstimator(options, population_margins(stats, {p.prefecture for p in personas}))
+    prompt = coded_question(question, options)
+    asked = requests_saved = failed = stable_waves = 0
+    previous: dict[str, float] | None = None
+    stopped = "exhausted" if len(order) < sample_size else "sample_size"
+
+    for start in range(0, len(order), wave_size):
+        wave = order[start:start + wave_size]
+        by_id = {p.id: p for p in wave}
+        wave_saved = 0
+        async with aclosing(bulk_ask_stream(wave, prompt, concurrency, model_name, use_cache=use_cache, batch_size=batch_size)) as stream:
+            async for item in stream:
+                asked += 1
+                wave_saved = item["requests_saved"]
+                if item["failed"]:
+                    failed += 1
+                    option = None
+                else:
+                    option = estimator.add(by_id[item["persona_id"]], item["answer"])
+                yield {"type": "progress", **item, "completed": asked, "total": len(order), "option": option}
+                if meter is not None and meter.exhausted:
+                    stopped = "token_budget"
+                    break
+        requests_saved += wave_saved
+        if stopped == "token_budget":
+            if len(estimator):
+                yield {"type": "estimate", **estimator.estimate()}
+            break
+
+        if not len(estimator):
+            continue
+        result = estimator.estimate()
+        shares = {e["option"]: e["share"] for e in result["estimates"]}
+        yield {"type": "estimate", **result}
+
+        if previous is not None and max(abs(shares[o] - previous[o]) for o in shares) <= tolerance:
+            stable_waves += 1
+        else:
+            stable_waves = 0
+        previous = shares
+        if len(estimator) >= min_sample:
+            if result["max_half_width"] <= margin:
+                stopped = "margin"
+                break
+            if stable_waves >= 2:
+                stopped = "stable"
+                break
+
+    yield {
+        "type": "done",
+        "stopped": stopped,
+        "asked": asked,
+        "answered": len(estimator),
+        "failed": failed,
+        "pool": len(personas),
+        "calls_avoided": len(personas) - asked + requests_saved,
+        "tokens_used": meter.used if meter is not None else None,
+    }
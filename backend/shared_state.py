@@ -0,0 +1,400 @@
+"""
+レート制限カウンタの保存先（プロセス間で共有するための層）
+uvicorn --workers N で動かすと、モジュール変数のカウンタはワーカーごとに別々になり
+Gemini の枠を N 倍の速さで使い切ってしまう。そこで UsageTracker の状態（GCRA の TAT・日次件数・
+直近60秒の開始時刻）をこの層に置き、RATE_LIMIT_STORE で保存先を選ぶ:
+  local  : プロセス内（既定。ワーカー1つならこれで十分）
+  sqlite : RATE_LIMIT_DB_PATH の SQLite（WAL）。同じマシンの全ワーカーで1つの枠を共有する
+RateLimitStore の各操作は「読んで・計算して・書く」を1回で不可分に行う単位になっているので、
+Redis で実装する場合も操作ごとに Lua スクリプト1本（EVALSHA）にすればよい。
+時刻はストアが決める（local は time.monotonic、共有ストアはプロセス間で比較できる time.time）。
+blocking なストア（sqlite）の操作は、UsageTracker がスレッドで実行してイベントループを止めないようにする。
+ファイルロック（file_lock / FileLease）も置く: 共有スナップショットの作成や一括質問ジョブの実行を1ワーカーに限る。
+"""
+import os, sqlite3, threading, time
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), "data", "rate_limits.sqlite3")
+DAY_SECONDS = 86400
+
+class RateLimits:
+    """1モデル分の上限（RPM / RPD / TPM と RPM の連続実行許容数）"""
+    __slots__ = ("rpm", "rpd", "tpm", "rpm_burst")
+
+    def __init__(self, rpm: int, rpd: int, tpm: int, rpm_burst: int = 1):
+        self.rpm = rpm
+        self.rpd = rpd
+        self.tpm = tpm
+        self.rpm_burst = rpm_burst
+
+    @property
+    def rpm_interval(self) -> float:
+        return 60.0 / self.rpm
+
+    @property
+    def rpm_tolerance(self) -> float:
+        return self.rpm_interval * (max(1, self.rpm_burst) - 1)
+
+    @property
+    def tpm_interval(self) -> float:
+        return 60.0 / self.tpm
+
+    @property
+    def tpm_tolerance(self) -> float:
+        # TPM は1分ぶんまでまとめて使ってよい
+        return self.tpm_interval * (self.tpm - 1)
+
+def gcra_reserve(tat: float, now: float, interval: float, tolerance: float, cost: float = 1) -> tuple[float, float]:
+    """Generic Cell Rate Algorithm。(実行してよい時刻, 新しい TAT) を返す"""
+    start = max(now, tat - tolerance)
+    return start, max(tat, start) + interval * cost
+
+class RateLimitStore(ABC):
+    """UsageTracker の状態の保存先。各メソッドは不可分に実行されること"""
+    name = ""
+    # True ならファイル等を待つことがある（UsageTracker はスレッドで呼ぶ）
+    blocking = False
+
+    @abstractmethod
+    def now(self) -> float:
+        """このストアの時刻（秒）。予約の計算はすべてこの時刻で行う"""
+
+    @abstractmethod
+    def reserve(self, model: str, limits: RateLimits, tokens: int) -> float | None:
+        """RPD を1件・RPM を1件・TPM を tokens 分予約し、実行までの待ち秒数を返す。RPD を使い切っていれば None"""
+
+    @abstractmethod
+    def mark_started(self, model: str) -> float:
+        """実行開始を記録し（rpm_current 用）、その時刻を返す"""
+
+    @abstractmethod
+    def refund(self, model: str, limits: RateLimits, tokens: int, started_at: float | None):
+        """reserve の取り消し（API に届かなかった呼び出し）"""
+
+    @abstractmethod
+    def adjust_tokens(self, model: str, limits: RateLimits, delta: int):
+        """TPM の予約を delta トークン増減する（負なら返却）"""
+
+    @abstractmethod
+    def usage(self, model: str, limits: RateLimits) -> tuple[int, int]:
+        """(今日のリクエスト数, 直近60秒の開始数)"""
+
+    @abstractmethod
+    def models(self) -> list[str]:
+        """状態を持っているモデル名（他のワーカーが使ったモデルを含む）"""
+
+    def get_status(self) -> dict:
+        return {"backend": self.name}
+
+# ── プロセス内 ─────────────────────────────────────────────────────
+class _LocalState:
+    __slots__ = ("rpm_tat", "tpm_tat", "requests_today", "day_start", "recent")
+
+    def __init__(self):
+        self.rpm_tat = 0.0
+        self.tpm_tat = 0.0
+        self.requests_today = 0
+        self.day_start = time.time()
+        # 直近60秒の開始時刻（古いものは読むときに捨てる。各要素は一度しか捨てないので償却 O(1)）
+        self.recent: deque[float] = deque()
+
+    def reset_day_if_needed(self):
+        now = time.time()
+        if now - self.day_start >= DAY_SECONDS:
+            self.requests_today = 0
+            self.day_start = now
+
+class LocalRateLimitStore(RateLimitStore):
+    """プロセス内の dict。イベントループ上で呼ぶのでロックは不要"""
+    name = "local"
+
+    def __init__(self):
+        self._states: dict[str, _LocalState] = {}
+
+    def _state(self, model: str) -> _LocalState:
+        state = self._states.get(model)
+        if state is None:
+            state = self._states[model] = _LocalState()
+        return state
+
+    def now(self) -> float:
+        return time.monotonic()
+
+    def reserve(self, model, limits, tokens):
+        state = self._state(model)
+        state.reset_day_if_needed()
+        if state.requests_today >= limits.rpd:
+            return None
+        now = self.now()
+        start, state.rpm_tat = gcra_reserve(state.rpm_tat, now, limits.rpm_interval, limits.rpm_tolerance)
+        if tokens:
+            tpm_start, state.tpm_tat = gcra_reserve(state.tpm_tat, now, limits.tpm_interval, limits.tpm_tolerance, tokens)
+            start = max(start, tpm_start)
+        state.requests_today += 1
+        return start - now
+
+    def mark_started(self, model):
+        started = self.now()
+        self._state(model).recent.append(started)
+        return started
+
+    def refund(self, model, limits, tokens, started_at):
+        state = self._state(model)
+        state.rpm_tat -= limits.rpm_interval
+        if tokens:
+            state.tpm_tat -= limits.tpm_interval * tokens
+        state.requests_today = max(0, state.requests_today - 1)
+        if started_at is not None:
+            try:
+                state.recent.remove(started_at)
+            except ValueError:
+                pass  # 既に60秒窓から外れている
+
+    def adjust_tokens(self, model, limits, delta):
+        self._state(model).tpm_tat += limits.tpm_interval * delta
+
+    def usage(self, model, limits):
+        state = self._state(model)
+        state.reset_day_if_needed()
+        now = self.now()
+        recent = state.recent
+        while recent and now - recent[0] >= 60:
+            recent.popleft()
+        return state.requests_today, len(recent)
+
+    def models(self):
+        return list(self._states)
+
+# ── SQLite（WAL）─────────────────────────────────────────────────
+class SQLiteRateLimitStore(RateLimitStore):
+    """
+    同じマシンの全ワーカーで共有する。更新は BEGIN IMMEDIATE のトランザクション1つ
+    （書き込みロックを取ってから読むので、ワーカー間で予約が重ならない）。
+    更新は他のワーカーと競合すると最大 timeout 秒待つので、UsageTracker はスレッドから呼ぶ（blocking = True）。
+    読むだけの usage / models はスレッドごとの読み取り用接続で BEGIN DEFERRED を使い、更新用の接続とロックには触らない
+    （WAL なので書き込み中でも待たずに読める）。進捗表示などイベントループ上から同期的に呼んでよい
+    """
+    name = "sqlite"
+    blocking = True
+    # 読み取り用接続の busy timeout（WAL の読み取りは通常待たない。チェックポイント等で詰まってもこれ以上は止めない）
+    READ_TIMEOUT = 0.5
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._readers = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    model TEXT PRIMARY KEY,
+                    rpm_tat REAL NOT NULL,
+                    tpm_tat REAL NOT NULL,
+                    requests_today INTEGER NOT NULL,
+                    day_start REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_limit_starts (model TEXT NOT NULL, started_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS rate_limit_starts_idx ON rate_limit_starts (model, started_at)")
+            self._conn = conn
+        return self._conn
+
+    def _transaction(self, fn):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            if self._conn is None:
+                with self._lock:
+                    self._connect()  # テーブルを作る（最初の1回だけ）
+            conn = self._readers.conn = sqlite3.connect(self.path, timeout=self.READ_TIMEOUT, isolation_level=None)
+        return conn
+
+    def _read(self, fn):
+        conn = self._reader()
+        conn.execute("BEGIN DEFERRED")
+        try:
+            return fn(conn)
+        finally:
+            conn.execute("COMMIT")
+
+    def _row(self, conn: sqlite3.Connection, model: str, now: float) -> list:
+        row = conn.execute(
+            "SELECT rpm_tat, tpm_tat, requests_today, day_start FROM rate_limits WHERE model = ?", (model,),
+        ).fetchone()
+        if row is None:
+            conn.execute("INSERT INTO rate_limits VALUES (?, 0, 0, 0, ?)", (model, now))
+            return [0.0, 0.0, 0, now]
+        row = list(row)
+        if now - row[3] >= DAY_SECONDS:
+            row[2], row[3] = 0, now
+        return row
+
+    def now(self) -> float:
+        return time.time()
+
+    def reserve(self, model, limits, tokens):
+        def op(conn):
+            now = self.now()
+            rpm_tat, tpm_tat, requests_today, day_start = self._row(conn, model, now)
+            if requests_today >= limits.rpd:
+                return None
+            start, rpm_tat = gcra_reserve(rpm_tat, now, limits.rpm_interval, limits.rpm_tolerance)
+            if tokens:
+                tpm_start, tpm_tat = gcra_reserve(tpm_tat, now, limits.tpm_interval, limits.tpm_tolerance, tokens)
+                start = max(start, tpm_start)
+            conn.execute(
+                "UPDATE rate_limits SET rpm_tat = ?, tpm_tat = ?, requests_today = ?, day_start = ? WHERE model = ?",
+                (rpm_tat, tpm_tat, requests_today + 1, day_start, model),
+            )
+            # 60秒より前の開始記録はここで掃除する
+            conn.execute("DELETE FROM rate_limit_starts WHERE model = ? AND started_at < ?", (model, now - 60))
+            return start - now
+        return self._transaction(op)
+
+    def mark_started(self, model):
+        started = self.now()
+        self._transaction(lambda conn: conn.execute("INSERT INTO rate_limit_starts VALUES (?, ?)", (model, started)))
+        return started
+
+    def refund(self, model, limits, tokens, started_at):
+        def op(conn):
+            conn.execute(
+                "UPDATE rate_limits SET rpm_tat = rpm_tat - ?, tpm_tat = tpm_tat - ?, "
+                "requests_today = MAX(0, requests_today - 1) WHERE model = ?",
+                (limits.rpm_interval, limits.tpm_interval * tokens, model),
+            )
+            if started_at is not None:
+                conn.execute(
+                    "DELETE FROM rate_limit_starts WHERE rowid = "
+                    "(SELECT rowid FROM rate_limit_starts WHERE model = ? AND started_at = ? LIMIT 1)",
+                    (model, started_at),
+                )
+        self._transaction(op)
+
+    def adjust_tokens(self, model, limits, delta):
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE rate_limits SET tpm_tat = tpm_tat + ? WHERE model = ?", (limits.tpm_interval * delta, model),
+        ))
+
+    def usage(self, model, limits):
+        def op(conn):
+            now = self.now()
+            row = conn.execute("SELECT requests_today, day_start FROM rate_limits WHERE model = ?", (model,)).fetchone()
+            requests_today = row[0] if row is not None and now - row[1] < DAY_SECONDS else 0
+            recent = conn.execute(
+                "SELECT COUNT(*) FROM rate_limit_starts WHERE model = ? AND started_at >= ?", (model, now - 60),
+            ).fetchone()[0]
+            return requests_today, recent
+        return self._read(op)
+
+    def models(self):
+        return self._read(lambda conn: [m for (m,) in conn.execute("SELECT model FROM rate_limits")])
+
+    def get_status(self) -> dict:
+        return {"backend": self.name, "path": self.path}
+
+def create_rate_limit_store() -> RateLimitStore:
+    """RATE_LIMIT_STORE に応じたストアを作る"""
+    name = os.getenv("RATE_LIMIT_STORE", "local").strip().lower()
+    if name == "sqlite":
+        return SQLiteRateLimitStore(os.getenv("RATE_LIMIT_DB_PATH") or DEFAULT_DB_PATH)
+    if name != "local":
+        raise ValueError(f"Unknown RATE_LIMIT_STORE: {name}")
+    return LocalRateLimitStore()
+
+# ── ファイルロック（同じマシンのプロセス間の排他） ─────────────────────
+def _lock(f, blocking: bool) -> bool:
+    if os.name == "nt":
+        # Windows には fcntl がないので、先頭1バイトを msvcrt でロックする
+        import msvcrt
+        f.seek(0)
+        if not blocking:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            except OSError:
+                return False
+            return True
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # 約10秒待って取れなければ OSError
+                return True
+            except OSError:
+                continue
+    import fcntl
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+def _unlock(f):
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+@contextmanager
+def file_lock(path: str):
+    """path のロックを取れるまで待ち、ブロックを抜けたら外す"""
+    with open(path, "a") as f:
+        _lock(f, blocking=True)
+        try:
+            yield
+        finally:
+            _unlock(f)
+
+class FileLease:
+    """
+    プロセス間で1つだけが持てるリース（ロックファイルの排他ロックを release まで持ち続ける）。
+    持っているプロセスが落ちれば OS がロックを外すので、他のプロセスが引き継げる。
+    ロックは開いたファイルごとなので、同じプロセス内でも別の FileLease とは排他になる
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        """待たずに取る。他が持っていれば False"""
+        if self._file is not None:
+            return True
+        f = open(self.path, "a")
+        if not _lock(f, blocking=False):
+            f.close()
+            return False
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            _unlock(self._file)
+        finally:
+            self._file.close()
+            self._file = None
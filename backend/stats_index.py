@@ -0,0 +1,97 @@
+"""
+都道府県別統計（stats_by_prefecture.json）のメモリ上のインデックス
+- 起動時に1回だけ読み込み、都道府県ごとの応答（/api/stats/{prefecture}）をシリアライズ・圧縮済みで持つ
+- ファイルの更新（mtime / サイズ）を STATS_RELOAD_INTERVAL 秒ごとに確認し、変わっていれば再読み込みする
+  → generate_stats.py で作り直した統計が再起動なしで反映される
+- 再読み込みでは内容が変わった都道府県だけを求め、subscribe() した関数に渡す（ペルソナの再生成など）
+- 書き込み途中などで読めなかった場合は前の内容のまま、次の確認で再試行する
+- 通知先が例外を出しても記録するだけで、他の通知先と監視は続ける
+- 監視では読み込みと通知をスレッドで行う（通知先のペルソナ再生成は母集団モードだと数十万行になり、
+  イベントループを止めてしまうため）。通知先は組み立ててから差し替える形で、読み手に途中の状態を見せないこと
+"""
+import asyncio, json, logging, os
+from catalog_cache import PrecomputedResponse
+
+logger = logging.getLogger(__name__)
+
+STATS_RELOAD_INTERVAL = float(os.getenv("STATS_RELOAD_INTERVAL", "5"))
+
+class StatsIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self.stats: dict[str, dict] = {}
+        self.by_region: dict[str, list[str]] = {}
+        self._responses: dict[str, PrecomputedResponse] = {}
+        self._signature: tuple[int, int] | None = None
+        self._listeners: list = []
+        self.reloads = 0
+        self.last_error: str | None = None
+
+    def _stat(self) -> tuple[int, int]:
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def load(self) -> set[str]:
+        """ファイルを読み込み、内容が変わった（追加・削除を含む）都道府県を返す"""
+        signature = self._stat()
+        with open(self.path, "r", encoding="utf-8") as f:
+            stats = json.load(f)
+        changed = {p for p in stats.keys() | self.stats.keys() if stats.get(p) != self.stats.get(p)}
+        responses = {p: r for p, r in self._responses.items() if p in stats and p not in changed}
+        for pref in changed & stats.keys():
+            responses[pref] = PrecomputedResponse(stats[pref])
+        by_region: dict[str, list[str]] = {}
+        for pref, s in stats.items():
+            by_region.setdefault(s.get("region", ""), []).append(pref)
+        # 参照側が途中の状態を見ないよう、組み立ててから差し替える
+        self.stats, self.by_region, self._responses = stats, by_region, responses
+        self._signature = signature
+        self.last_error = None
+        return changed
+
+    def subscribe(self, callback):
+        """再読み込みで内容が変わったときに callback(変わった都道府県の集合) を呼ぶ"""
+        self._listeners.append(callback)
+
+    def maybe_reload(self) -> set[str]:
+        """ファイルが更新されていれば読み直して通知する。変わった都道府県を返す"""
+        try:
+            if self._stat() == self._signature:
+                return set()
+            changed = self.load()
+        except (OSError, ValueError) as e:
+            self.last_error = str(e)
+            logger.warning("stats reload failed: %s", e)
+            return set()
+        self.reloads += 1
+        if changed:
+            for callback in self._listeners:
+                try:
+                    callback(changed)
+                except Exception as e:
+                    self.last_error = f"{getattr(callback, '__name__', callback)}: {e}"
+                    logger.exception("stats reload listener %r failed", callback)
+        return changed
+
+    async def watch(self, interval: float = STATS_RELOAD_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.maybe_reload)
+            except Exception:
+                # ここで止まると以後の更新が反映されなくなるので、記録して次の確認を続ける
+                logger.exception("stats reload failed")
+
+    def get(self, prefecture: str) -> dict | None:
+        return self.stats.get(prefecture)
+
+    def response(self, prefecture: str) -> PrecomputedResponse | None:
+        return self._responses.get(prefecture)
+
+    def get_status(self) -> dict:
+        return {
+            "prefectures": len(self.stats),
+            "reloads": self.reloads,
+            "reload_interval": STATS_RELOAD_INTERVAL,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,48 @@
+"""
+backend のテスト共通設定
+モジュールが import 時に環境変数を読むので、テストモジュールより先に偽モデル・一時ディレクトリ・緩いレート制限を設定する
+"""
+import asyncio, os, sys, tempfile
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_TMP = tempfile.mkdtemp(prefix="personaai-tests-")
+os.environ.update({
+    "LLM_BACKEND": "fake",
+    "FAKE_LLM_LATENCY": "fixed:20",
+    "FAKE_LLM_429_RATE": "0",
+    "ANSWER_CACHE_PATH": os.path.join(_TMP, "answers.sqlite3"),
+    "BULK_JOBS_DIR": os.path.join(_TMP, "bulk_jobs"),
+    "RATE_LIMIT_STORE": "local",
+    "INTERVIEW_SESSION_STORE": "local",
+    "STATS_RELOAD_INTERVAL": "0",
+    "GEMINI_RPM_LIMIT": "100000",
+    "GEMINI_RPD_LIMIT": "10000000",
+    "GEMINI_TPM_LIMIT": "1000000000",
+    "BULK_CONCURRENCY": "3",
+    "BULK_RESULT_BUFFER": "4",
+})
+
+STATS_PATH = os.path.join(BACKEND_DIR, "data", "stats_by_prefecture.json")
+
+@pytest.fixture(scope="session")
+def personas():
+    from persona_engine import load_all_personas
+    return load_all_personas(STATS_PATH, seed=42)
+
+@pytest.fixture
+def llm_backend():
+    """偽モデル（LLM_BACKEND=fake）を gemini_client に設定する"""
+    import gemini_client
+    return gemini_client.init_llm_backend()
+
+@pytest.fixture
+def tmp_dir():
+    with tempfile.TemporaryDirectory(dir=_TMP) as d:
+        yield d
+
+def run(coro):
+    """pytest-asyncio に依存せず、コルーチンを新しいイベントループで実行する"""
+    return asyncio.run(coro)
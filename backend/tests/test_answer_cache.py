@@ -0,0 +1,38 @@
+import asyncio, os
+from conftest import run
+import gemini_client
+from answer_cache import AnswerCache
+
+def test_store_round_trip_and_normalization(tmp_dir):
+    cache = AnswerCache(os.path.join(tmp_dir, "answers.sqlite3"))
+
+    async def scenario():
+        # 同時に来た保存はまとめて書かれる（どれも失われない）
+        await asyncio.gather(*(
+            cache.store([("好きな　食べ物は？", f"p{i}", "m", "v1", f"answer {i}")]) for i in range(10)
+        ))
+        return await cache.get_many_async("好きな 食べ物は?", "m", {f"p{i}": "v1" for i in range(12)} | {"p0": "v2"})
+
+    found = run(scenario())
+    # プロンプトバージョンが違う p0 と、保存していない p10, p11 は外れ
+    assert found == {f"p{i}": f"answer {i}" for i in range(1, 10)}
+    assert (cache.hits, cache.misses) == (9, 3)
+
+def test_bulk_answers_are_cached_per_group(personas, llm_backend, tmp_dir, monkeypatch):
+    cache = AnswerCache(os.path.join(tmp_dir, "answers.sqlite3"))
+    monkeypatch.setattr(gemini_client, "answer_cache", cache)
+    writes = []
+    put_many = cache.put_many
+    monkeypatch.setattr(cache, "put_many", lambda rows: (writes.append(len(rows)), put_many(rows)))
+    group = personas[:6]
+
+    async def ask():
+        return [item async for item in gemini_client.bulk_ask_stream(group, "休日の過ごし方は？", 2, "m", batch_size=3)]
+
+    first = run(ask())
+    assert not any(item["cached"] for item in first)
+    # 1人ずつではなくグループ（3人）ごとにまとめて書く
+    assert sum(writes) == 6 and all(n >= 3 for n in writes if n)
+    second = run(ask())
+    assert all(item["cached"] for item in second)
+    assert {i["persona_id"]: i["answer"] for i in second} == {i["persona_id"]: i["answer"] for i in first}
@@ -0,0 +1,51 @@
+import random, statistics
+from collections import Counter
+from bulk_aggregator import BulkAggregator, extract_keywords
+from sampling import UNCODED, age_band
+
+def test_running_tallies_match_a_batch_recount(personas):
+    rng = random.Random(0)
+    group = personas[:60]
+    answers = ["賛成" * rng.randint(1, 20) + "。理由は価格です" for _ in group]
+    failed = {p.id for p in group[::7]}
+    agg = BulkAggregator(total=len(group))
+    for p, answer in zip(group, answers):
+        agg.add(p, answer, failed=p.id in failed, cached=p.id.endswith("0"))
+
+    ok = [(p, a) for p, a in zip(group, answers) if p.id not in failed]
+    lengths = [len(a) for _, a in ok]
+    summary = agg.summary()
+    assert (summary["completed"], summary["answered"], summary["failed"]) == (60, len(ok), len(failed))
+    assert summary["cached"] == sum(p.id.endswith("0") for p, _ in ok)
+    assert summary["by_region"] == dict(Counter(p.region for p, _ in ok))
+    assert summary["by_age_band"] == dict(Counter(age_band(p.age) for p, _ in ok))
+    # Welford 法の平均・標準偏差は一括計算と一致する
+    assert summary["answer_length"] == {
+        "mean": round(statistics.mean(lengths), 1),
+        "stdev": round(statistics.stdev(lengths), 1),
+        "min": min(lengths),
+        "max": max(lengths),
+    }
+
+def test_single_answer_has_zero_stdev(personas):
+    agg = BulkAggregator(total=1)
+    agg.add(personas[0], "はい")
+    assert agg.summary()["answer_length"] == {"mean": 2.0, "stdev": 0.0, "min": 2, "max": 2}
+    assert BulkAggregator(total=0).summary()["answer_length"]["min"] is None
+
+def test_keywords_count_once_per_answer(personas):
+    assert extract_keywords("価格と品質、価格が大事。スマホはiPhone15") == {"価格", "品質", "大事", "スマホ", "iPhone15"}
+    agg = BulkAggregator(total=2, top_keywords=1)
+    agg.add(personas[0], "価格、価格、価格")
+    agg.add(personas[1], "品質と価格")
+    assert agg.summary()["keywords"] == [("価格", 2)]
+
+def test_options_are_coded_by_region(personas):
+    agg = BulkAggregator(total=3, options=["はい", "いいえ"])
+    a, b = personas[0], personas[-1]
+    assert agg.add(a, "いいえ、はいとは言えません") == "いいえ"
+    assert agg.add(b, "はい") == "はい"
+    assert agg.add(b, "わからない") == UNCODED
+    summary = agg.summary()
+    assert summary["options"] == {"いいえ": 1, "はい": 1, UNCODED: 1}
+    assert summary["options_by_region"] == {a.region: {"いいえ": 1}, b.region: {"はい": 1, UNCODED: 1}}
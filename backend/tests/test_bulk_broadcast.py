@@ -0,0 +1,107 @@
+import asyncio
+from conftest import run
+import gemini_client, main
+from bulk_broadcast import SingleFlight, bulk_flights
+from models import BulkQuestionRequest
+
+def _count_calls():
+    """偽モデルへの問い合わせ回数を数える"""
+    calls = []
+    backend = gemini_client._backend
+    original = backend.generate_content
+
+    async def counting(*args, **kwargs):
+        calls.append(1)
+        return await original(*args, **kwargs)
+
+    backend.generate_content = counting
+    return calls
+
+async def _numbers(n: int, produced: list, delay: float = 0.0):
+    for i in range(n):
+        await asyncio.sleep(delay)
+        produced.append(i)
+        yield {"i": i}
+
+async def _collect(subscription) -> list:
+    return [r async for r in subscription]
+
+def test_joined_subscriber_replays_and_shares_one_run():
+    async def scenario():
+        flights = SingleFlight()
+        produced = []
+        first, joined = flights.join("k", lambda: _numbers(5, produced, 0.01))
+        assert not joined
+        leader = first.subscribe()
+        got = [await anext(leader), await anext(leader)]
+        second, joined = flights.join("k", lambda: _numbers(5, produced))
+        assert joined and second is first
+        rest, late = await asyncio.gather(_collect(leader), _collect(second.subscribe()))
+        return got + rest, late, produced
+
+    got, late, produced = run(scenario())
+    assert [r["i"] for r in got] == [0, 1, 2, 3, 4]
+    assert [r["i"] for r in late] == [0, 1, 2, 3, 4]
+    assert produced == [0, 1, 2, 3, 4]
+
+def test_slowest_subscriber_holds_back_upstream():
+    async def scenario():
+        flights = SingleFlight()
+        produced = []
+        flight, _ = flights.join("k", lambda: _numbers(100, produced))
+        slow = flight.subscribe()
+        await anext(slow)
+        fast = asyncio.create_task(_collect(flight.subscribe()))
+        await asyncio.sleep(0.05)
+        # slow が1件目を処理している間は、fast がいても上流は先に進まない
+        held = len(produced)
+        await slow.aclose()
+        return held, len(await fast), flight
+
+    held, received, flight = run(scenario())
+    assert held == 1
+    assert received == 100
+    assert flight.done
+
+def test_last_subscriber_leaving_cancels_run():
+    async def scenario():
+        flights = SingleFlight()
+        produced = []
+        flight, _ = flights.join("k", lambda: _numbers(100, produced, 0.01))
+        sub = flight.subscribe()
+        await anext(sub)
+        await sub.aclose()
+        await asyncio.sleep(0.05)
+        return flight, flights.get_status(), len(produced)
+
+    flight, status, produced = run(scenario())
+    assert flight.task.cancelled()
+    assert status == {"in_flight": 0, "subscribers": 0}
+    assert produced < 100
+
+def test_paused_bulk_question_client_bounds_in_flight_calls(personas):
+    """/api/bulk-question（single-flight 経由）でも、読み手が止まると問い合わせが concurrency + バッファで止まる"""
+    async def scenario():
+        gemini_client.init_llm_backend()
+        main.PERSONAS.load(personas)
+        calls = _count_calls()
+        req = BulkQuestionRequest(question="背圧のテスト", bypass_cache=True, summary_only=False)
+        _, concurrency, _ = main._bulk_settings(req)
+        response = await main.bulk_question(req)
+        events = response.body_iterator
+        read = 0
+        while read < 2:
+            ev = await anext(events)
+            if ev["event"] == "progress":
+                read += 1
+        await asyncio.sleep(0.5)
+        paused_calls = len(calls)
+        status = bulk_flights.get_status()
+        await events.aclose()
+        await asyncio.sleep(0.05)
+        return read, paused_calls, concurrency, status, bulk_flights.get_status()
+
+    read, paused_calls, concurrency, status, after = run(scenario())
+    assert status == {"in_flight": 1, "subscribers": 1}
+    assert paused_calls - read <= concurrency + gemini_client.BULK_RESULT_BUFFER
+    assert after == {"in_flight": 0, "subscribers": 0}
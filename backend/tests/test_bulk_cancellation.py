@@ -0,0 +1,34 @@
+import asyncio
+from conftest import run
+import gemini_client
+from llm_backends import FakeBackend
+from metrics import BULK_CANCELLED, BULK_TASKS_IN_FLIGHT
+
+MODEL = "gemini-cancel-test"
+
+def _cancelled(stage: str) -> float:
+    return BULK_CANCELLED._values.get((MODEL, stage), 0)
+
+def test_closing_the_stream_cancels_and_accounts_for_every_group(personas, monkeypatch):
+    backend = FakeBackend(latency="fixed:50", rate_429=0)
+    monkeypatch.setattr(gemini_client, "_backend", backend)
+    group = personas[:20]
+    in_flight_before = BULK_TASKS_IN_FLIGHT._values.get((), 0)
+
+    async def scenario():
+        stream = gemini_client.bulk_ask_stream(group, "途中で切るテスト", 3, MODEL, use_cache=False)
+        first = await anext(stream)
+        # クライアントの切断（SSE が閉じる）
+        await stream.aclose()
+        await asyncio.sleep(0.1)
+        return first
+
+    first = run(scenario())
+    assert first["completed"] == 1
+    queued, in_flight = _cancelled("queued"), _cancelled("in_flight")
+    # 同時実行数ぶんだけ走っていて、残りは送らずに取り消した
+    assert 0 < in_flight <= 3 and queued >= len(group) - 3 - 3
+    # 取り出していないグループは1件も送っていない。実行中に取り消したものはレート制限の待ちで未送信のこともある
+    finished = len(group) - queued - in_flight
+    assert finished <= backend.calls <= len(group) - queued
+    assert BULK_TASKS_IN_FLIGHT._values.get((), 0) == in_flight_before
@@ -0,0 +1,93 @@
+import asyncio, json, os
+from collections import Counter
+from conftest import run
+from bulk_jobs import BulkJobManager
+
+PERSONA_IDS = [f"p{i}" for i in range(6)]
+
+def _runner(calls: list, delay: float = 0.01):
+    async def runner(job):
+        for pid in job.persona_ids:
+            if pid in job.answered:
+                continue
+            await asyncio.sleep(delay)
+            calls.append(pid)
+            job.record_progress({"persona_id": pid, "answer": f"answer {pid}", "failed": False})
+        return {"answered": len(job.answered)}
+    return runner
+
+def _answers_on_disk(path: str) -> Counter:
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return Counter(r["data"]["persona_id"] for r in records if r["type"] == "progress")
+
+def _workers(tmp_dir, n: int = 2) -> list[BulkJobManager]:
+    return [BulkJobManager(tmp_dir, poll_seconds=0.02) for _ in range(n)]
+
+def test_other_worker_follows_job_from_disk(tmp_dir):
+    owner, other = _workers(tmp_dir)
+
+    async def scenario():
+        calls = []
+        job = owner.create({"question": "q"}, PERSONA_IDS)
+        owner.start(job, _runner(calls))
+        # 作っていないワーカーでも 404 にならず、ファイルの追記を追って最後まで受け取れる
+        followed = other.get(job.id)
+        assert followed is not None and followed is not job
+        events = [ev async for ev in followed.follow()]
+        await job.task
+        return job, calls, events
+
+    job, calls, events = run(scenario())
+    assert calls == PERSONA_IDS
+    assert [ev["id"] for ev in events] == [ev["id"] for ev in job.events]
+    assert events[-1]["event"] == "done"
+    assert other.get(job.id).summary() == job.summary()
+
+def test_only_one_worker_resumes_an_unfinished_job(tmp_dir):
+    first = BulkJobManager(tmp_dir)
+    job = first.create({"question": "q"}, PERSONA_IDS)
+    job.record_progress({"persona_id": "p0", "answer": "a", "failed": False})
+    # 前回のプロセスが途中で落ちた
+    job.close()
+    job.lease.release()
+
+    a, b = _workers(tmp_dir)
+    calls = []
+
+    async def scenario():
+        resumed = a.resume(_runner(calls)) + b.resume(_runner(calls))
+        assert [j.id for j in resumed] == [job.id]
+        await asyncio.gather(*(j.task for j in resumed))
+
+    run(scenario())
+    assert calls == PERSONA_IDS[1:]
+    assert _answers_on_disk(job.path) == Counter(PERSONA_IDS)
+
+def test_follower_takes_over_when_the_owner_dies(tmp_dir):
+    owner, other = _workers(tmp_dir)
+    other.runner = _runner(calls := [])
+
+    async def scenario():
+        job = owner.create({"question": "q"}, PERSONA_IDS)
+        owner.start(job, _runner([], delay=0.05))
+        followed = other.get(job.id)
+        stream = followed.follow()
+        first = await anext(stream)
+        # 実行中のワーカーが落ちる（タスクが止まり、OS がロックを外す）
+        job.task.cancel()
+        await asyncio.gather(job.task, return_exceptions=True)
+        rest = [ev async for ev in stream]
+        return job, followed, [first] + rest
+
+    job, followed, events = run(scenario())
+    assert followed.task is not None and followed.finished
+    assert events[-1]["event"] == "done"
+    assert calls and set(calls).isdisjoint({ev["data"]["persona_id"] for ev in events[:1]})
+    assert _answers_on_disk(job.path) == Counter(PERSONA_IDS)
+
+def test_unknown_or_invalid_job_id(tmp_dir):
+    (manager,) = _workers(tmp_dir, 1)
+    assert manager.get("0123456789ab") is None
+    assert manager.get("../../etc/passwd") is None
+    assert not os.path.exists(os.path.join(tmp_dir, "0123456789ab.lock"))
@@ -0,0 +1,55 @@
+import gzip, json
+import pytest
+from fastapi.testclient import TestClient
+import main
+from catalog_cache import CatalogCache, PrecomputedResponse
+
+@pytest.fixture
+def client(personas):
+    main.PERSONAS.load(personas)
+    main.catalog_cache.clear()
+    return TestClient(main.app)
+
+def test_etag_revalidation_returns_304(client):
+    first = client.get("/api/prefectures", headers={"Accept-Encoding": "identity"})
+    assert first.status_code == 200 and "content-encoding" not in first.headers
+    etag = first.headers["etag"]
+    assert "Accept-Encoding" in first.headers["vary"] and first.headers["cache-control"] == "no-cache"
+    again = client.get("/api/prefectures", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert again.status_code == 304 and again.content == b"" and again.headers["etag"] == etag
+    # 弱い比較・複数指定・* も一致とみなす
+    for header in (f"W/{etag}", f'"other", {etag}', "*"):
+        assert client.get("/api/prefectures", headers={"Accept-Encoding": "identity", "If-None-Match": header}).status_code == 304
+    assert client.get("/api/prefectures", headers={"Accept-Encoding": "identity", "If-None-Match": '"other"'}).status_code == 200
+
+def test_gzip_negotiation(client):
+    plain = client.get("/api/personas", headers={"Accept-Encoding": "identity"})
+    zipped = client.get("/api/personas", headers={"Accept-Encoding": "gzip"})
+    assert zipped.headers["content-encoding"] == "gzip"
+    # 表現ごとに別の ETag。中身は同じ
+    assert zipped.headers["etag"] != plain.headers["etag"]
+    assert zipped.json() == plain.json()
+    refused = client.get("/api/personas", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in refused.headers and refused.headers["etag"] == plain.headers["etag"]
+
+def test_small_bodies_are_not_compressed():
+    small = PrecomputedResponse({"a": 1})
+    assert set(small.variants) == {"identity"}
+    large = PrecomputedResponse({"items": list(range(500))})
+    body, _ = large.variants["gzip"]
+    assert json.loads(gzip.decompress(body)) == {"items": list(range(500))}
+
+def test_catalog_cache_builds_once_and_is_bounded():
+    cache, builds = CatalogCache(max_size=2), []
+
+    def build(key):
+        builds.append(key)
+        return {"key": key}
+
+    for key in ("a", "a", "b", "a", "c", "b"):
+        cache.get((key,), lambda: build(key), "test")
+    # a・b・c の順に作り、上限2件なので最も古く使った b を捨てて作り直す
+    assert builds == ["a", "b", "c", "b"]
+    version = cache.version
+    cache.clear()
+    assert cache.get_status()["size"] == 0 and cache.version == version + 1
@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from conftest import run
+import gemini_client
+from llm_backends import FakeBackend
+from rate_limiter import UsageTracker
+from shared_state import LocalRateLimitStore
+
+MODEL = "gemini-test"
+
+class _SlowTracker(UsageTracker):
+    # 1秒に1件。2件目からはローカルの GCRA で待つ
+    RPM_LIMIT = 60
+
+@pytest.fixture
+def tracker(monkeypatch):
+    tracker = _SlowTracker(MODEL, LocalRateLimitStore())
+    monkeypatch.setattr(gemini_client, "usage_tracker", tracker)
+    monkeypatch.setattr(gemini_client, "_backend", FakeBackend(latency="fixed:200", rate_429=0))
+    return tracker
+
+def _requests_today(tracker) -> int:
+    return tracker.usage_summary(MODEL)["requests_today"]
+
+async def _cancel_after(coro, delay: float):
+    task = asyncio.create_task(coro)
+    await asyncio.sleep(delay)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+def test_cancel_during_local_wait_is_refunded(tracker):
+    async def scenario():
+        await gemini_client._generate(MODEL, "a", None, 1)
+        await _cancel_after(gemini_client._generate(MODEL, "b", None, 1), 0.1)
+    run(scenario())
+    assert _requests_today(tracker) == 1
+
+class _SlowConnectBackend(FakeBackend):
+    """送信（mark_sent）の前に 200ms の接続待ちがある偽モデル"""
+
+    async def generate_content(self, model, contents, config=None):
+        await asyncio.sleep(0.2)
+        return await super().generate_content(model, contents, config)
+
+def test_cancel_and_timeout_before_send_are_refunded(tracker, monkeypatch):
+    monkeypatch.setattr(gemini_client, "_backend", _SlowConnectBackend(latency="fixed:10", rate_429=0))
+
+    async def scenario():
+        await _cancel_after(gemini_client._generate(MODEL, "a", None, 1), 0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await gemini_client._generate(MODEL, "b", None, 1, timeout=0.05)
+    run(scenario())
+    assert _requests_today(tracker) == 0
+
+def test_cancel_and_timeout_after_send_are_kept(tracker):
+    async def scenario():
+        await _cancel_after(gemini_client._generate(MODEL, "a", None, 1), 0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await gemini_client._generate(MODEL, "b", None, 1, timeout=0.05)
+    run(scenario())
+    assert _requests_today(tracker) == 2
+
+def test_answer_for_error_checks_the_error_not_its_message():
+    from llm_backends import _rate_limited
+    from rate_limiter import QuotaExceededError
+    quota = "（APIクォータ超過のため回答できませんでした）"
+    assert gemini_client._answer_for_error(_rate_limited("quota")) == quota
+    assert gemini_client._answer_for_error(QuotaExceededError("上限")) == quota
+    # メッセージに 429 が入っているだけのエラーはクォータ超過ではない
+    assert gemini_client._answer_for_error(ValueError("persona 429 not found")) == "（エラー: persona 429 not found）"
+
+def test_parse_batch_answers():
+    ids = ["a", "b", "c"]
+    assert gemini_client.parse_batch_answers('{"a": " はい ", "b": "", "c": 3, "x": "他人"}', ids) == {"a": "はい"}
+    assert gemini_client.parse_batch_answers("not json", ids) == {}
+    assert gemini_client.parse_batch_answers('["a"]', ids) == {}
+    assert gemini_client.parse_batch_answers(None, ids) == {}
+
+@pytest.mark.parametrize("batch_answers, saved", [
+    # 1人欠けた → その1人だけ問い合わせ直す（4人を2回で済ませた）
+    (lambda ids: {pid: f"batch {pid}" for pid in ids[:3]}, 2),
+    # まとめた問い合わせが失敗 → 全員を問い合わせ直す（節約数はマイナスにしない）
+    (None, 0),
+])
+def test_bulk_batch_falls_back_to_single_requests(personas, monkeypatch, batch_answers, saved):
+    group = personas[:4]
+    single = []
+
+    async def ask_batch(batch, question, model_name, timeout=None):
+        if batch_answers is None:
+            raise ValueError("broken batch")
+        return batch_answers([p.id for p in batch])
+
+    async def ask_one(persona, question, model_name, timeout=None):
+        single.append(persona.id)
+        return f"single {persona.id}"
+
+    monkeypatch.setattr(gemini_client, "ask_personas_batch", ask_batch)
+    monkeypatch.setattr(gemini_client, "ask_persona", ask_one)
+
+    async def ask():
+        return [item async for item in gemini_client.bulk_ask_stream(group, "q", 2, MODEL, use_cache=False, batch_size=4)]
+
+    items = run(ask())
+    answers = {item["persona_id"]: item["answer"] for item in items}
+    expected_single = [p.id for p in group] if batch_answers is None else [group[3].id]
+    assert single == expected_single
+    assert answers == {p.id: ("single " if p.id in single else "batch ") + p.id for p in group}
+    assert items[-1]["requests_saved"] == saved and not any(item["failed"] for item in items)
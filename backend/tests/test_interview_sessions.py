@@ -0,0 +1,73 @@
+import asyncio, os, time
+import pytest
+from conftest import run
+import gemini_client, main
+from interview_sessions import InterviewSession, SessionStore, SQLiteSessionStore
+from models import InterviewRequest
+
+def _talk(session: InterviewSession, turns: int):
+    for i in range(turns):
+        session.add_turn(f"質問{i}です。" + "あ" * 200, f"返答{i}です。" + "い" * 400)
+
+def test_history_is_compacted_and_survives_serialization():
+    session = InterviewSession("p1")
+    _talk(session, 30)
+    info = session.info()
+    assert info["turns"] == 30 and info["summarized_turns"] > 0
+    assert len(session.turns) >= InterviewSession.MIN_RECENT_TURNS
+    restored = InterviewSession.from_dict(session.to_dict(), session.last_used)
+    assert restored.history() == session.history() and restored.info() == info
+    # 復元後も同じように畳まれる
+    _talk(session, 1)
+    _talk(restored, 1)
+    assert restored.history() == session.history()
+
+def test_sqlite_sessions_are_shared_between_workers(tmp_dir):
+    path = os.path.join(tmp_dir, "sessions.sqlite3")
+    a, b = SQLiteSessionStore(path), SQLiteSessionStore(path)
+    session = a.create("p1", [{"role": "user", "content": "こんにちは"}, {"role": "model", "content": "どうも"}])
+    # 別のワーカーでも 404 にならず、進めたターンも共有される
+    other = b.get(session.id)
+    assert other.history() == session.history()
+    other.add_turn("元気？", "元気です")
+    b.save(other)
+    assert a.get(session.id).info()["turns"] == 2
+    assert b.get_status()["size"] == 1
+    assert a.delete(session.id) and b.get(session.id) is None
+
+@pytest.mark.parametrize("make", [lambda path: SessionStore(max_size=2, ttl_seconds=60),
+                                  lambda path: SQLiteSessionStore(path, max_size=2, ttl_seconds=60)])
+def test_eviction_by_size_and_ttl(tmp_dir, monkeypatch, make):
+    store = make(os.path.join(tmp_dir, "sessions.sqlite3"))
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    first, second = store.create("p1"), store.create("p2")
+    now += 1
+    store.get(first.id)
+    now += 1
+    store.create("p3")
+    # 最終利用が一番古い second が上限で捨てられる
+    assert store.get(second.id) is None and store.get(first.id) is not None
+    now += 61
+    assert store.get(first.id) is None
+    assert store.get_status()["evicted"] == 3
+
+def test_concurrent_turns_on_a_shared_session_are_serialized(personas, tmp_dir, monkeypatch):
+    # 同じワーカーに同時に届いた2ターンも、ロックを待つ間に進んだ履歴を読み直すので両方残る
+    store = SQLiteSessionStore(os.path.join(tmp_dir, "sessions.sqlite3"))
+    monkeypatch.setattr(main, "interview_sessions", store)
+    main.PERSONAS.load(personas[:5])
+    persona_id = personas[0].id
+
+    async def scenario():
+        gemini_client.init_llm_backend()
+        info = await main.create_interview_session(persona_id)
+        await asyncio.gather(*(
+            main.interview(persona_id, InterviewRequest(message=f"質問{i}", session_id=info["session_id"]))
+            for i in range(3)
+        ))
+        return info["session_id"]
+
+    session = store.get(run(scenario()))
+    assert session.info()["turns"] == 3
+    assert sorted(m for m, _ in session.turns) == ["質問0", "質問1", "質問2"]
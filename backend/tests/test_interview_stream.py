@@ -0,0 +1,43 @@
+import json
+import pytest
+from conftest import run
+import gemini_client, main
+from llm_backends import FakeBackend
+from models import InterviewRequest
+
+@pytest.fixture
+def persona(personas):
+    main.PERSONAS.load(personas[:5])
+    return personas[0]
+
+async def _events(response) -> list[tuple[str, dict]]:
+    return [(ev["event"], json.loads(ev["data"])) async for ev in response.body_iterator]
+
+def test_stream_sends_deltas_then_done_with_usage(persona, monkeypatch):
+    monkeypatch.setattr(gemini_client, "_backend", FakeBackend(latency="fixed:20", rate_429=0, chunk_chars=4))
+
+    async def scenario():
+        info = await main.create_interview_session(persona.id)
+        response = await main.interview_stream(persona.id, InterviewRequest(message="最近どう？", session_id=info["session_id"]))
+        return info["session_id"], await _events(response)
+
+    session_id, events = run(scenario())
+    kinds = [kind for kind, _ in events]
+    # 返答は小分けの delta で届き、最後に done が1回
+    assert kinds.count("delta") > 1 and kinds[-1] == "done" and kinds.count("done") == 1
+    done = events[-1][1]
+    assert "".join(data["text"] for kind, data in events if kind == "delta") == done["answer"]
+    assert done["persona_id"] == persona.id and done["usage"]["total_tokens"] > 0
+    assert done["finish_reason"] == "STOP"
+    # セッションに1ターン残る
+    assert done["session"]["turns"] == 1
+    assert main.interview_sessions.get(session_id).history()[-1] == {"role": "model", "content": done["answer"]}
+
+def test_stream_reports_rate_limit_as_error_event(persona, monkeypatch):
+    monkeypatch.setattr(gemini_client, "_backend", FakeBackend(latency="fixed:20", rate_429=1))
+
+    async def scenario():
+        response = await main.interview_stream(persona.id, InterviewRequest(message="最近どう？"))
+        return await _events(response)
+
+    assert run(scenario()) == [("error", {"status": 429, "error": "APIの無料枠の上限に達しました。しばらく待ってから再試行してください。"})]
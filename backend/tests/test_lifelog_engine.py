@@ -0,0 +1,41 @@
+import threading
+from lifelog_engine import ProfileCache, generate_persona_profile
+
+def _first_child(profile):
+    return [e.age for e in profile.lifelog if e.event == "第一子が誕生"]
+
+def test_first_child_age_at_the_threshold(personas):
+    base = personas[0].model_copy(update={"household_type": "夫婦と子供"})
+    # 28歳から第一子のイベントが付く（子供は3歳以上）。範囲が空にならない
+    assert _first_child(generate_persona_profile(base.model_copy(update={"age": 27}))) == []
+    assert _first_child(generate_persona_profile(base.model_copy(update={"age": 28}))) == [25]
+    for age in range(29, 80):
+        (child,) = _first_child(generate_persona_profile(base.model_copy(update={"age": age})))
+        assert 26 <= child <= min(38, age - 3)
+
+def test_profile_is_deterministic_per_persona(personas):
+    a, b = generate_persona_profile(personas[0]), generate_persona_profile(personas[0])
+    assert a == b and a != generate_persona_profile(personas[1])
+
+def test_profile_cache_from_threads(personas):
+    cache = ProfileCache(max_size=20)
+    errors = []
+
+    def work(offset: int):
+        try:
+            for i in range(200):
+                p = personas[(offset + i) % 60]
+                assert cache.get(p) == generate_persona_profile(p)
+                if i % 50 == 0:
+                    cache.invalidate([p.id])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(n * 7,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert cache.get_status()["size"] <= 20
+    assert cache.hits + cache.misses == 800
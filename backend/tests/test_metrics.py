@@ -0,0 +1,28 @@
+import threading
+from llm_backends import _rate_limited
+from metrics import REGISTRY, Counter, Histogram, error_kind
+
+def test_updates_from_threads_are_not_lost():
+    counter, histogram = Counter("test_total", "test", ("kind",)), Histogram("test_seconds", "test")
+    try:
+        def work():
+            for _ in range(5000):
+                counter.inc(kind="a")
+                histogram.observe(0.01)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert 'test_total{kind="a"} 20000' in counter.render()
+        assert "test_seconds_count 20000" in histogram.render()
+    finally:
+        REGISTRY.remove(counter)
+        REGISTRY.remove(histogram)
+
+def test_error_kind():
+    assert error_kind(_rate_limited("quota")) == "rate_limited"
+    assert error_kind(TimeoutError()) == "timeout"
+    # メッセージに 429 が入っているだけでは rate_limited にしない
+    assert error_kind(ValueError("429 personas")) == "ValueError"
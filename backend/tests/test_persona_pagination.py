@@ -0,0 +1,40 @@
+import pytest
+from fastapi.testclient import TestClient
+import main
+
+@pytest.fixture
+def client(personas):
+    main.PERSONAS.load(personas)
+    main.catalog_cache.clear()
+    return TestClient(main.app)
+
+def _pages(client, params: dict) -> list[dict]:
+    pages, cursor = [], None
+    while True:
+        body = client.get("/api/personas", params={**params, **({"cursor": cursor} if cursor else {})}).json()
+        pages.append(body)
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+@pytest.mark.parametrize("filters", [{}, {"region": "関東"}, {"gender": "女性", "age_min": 40}])
+def test_cursor_pages_cover_the_filtered_list_once(client, personas, filters):
+    full = client.get("/api/personas", params=filters).json()
+    assert full["next_cursor"] is None and full["total"] == len(full["personas"])
+    pages = _pages(client, {**filters, "limit": 7})
+    assert all(len(p["personas"]) == 7 for p in pages[:-1]) and 1 <= len(pages[-1]["personas"]) <= 7
+    assert {p["total"] for p in pages} == {full["total"]}
+    assert [row for p in pages for row in p["personas"]] == full["personas"]
+
+def test_field_projection_and_count_only(client, personas):
+    body = client.get("/api/personas", params={"fields": "age, prefecture,age", "limit": 2}).json()
+    # id は常に先頭に付け、重複は除く
+    assert body["personas"] == [{"id": p.id, "age": p.age, "prefecture": p.prefecture} for p in personas[:2]]
+    assert client.get("/api/personas", params={"prefecture": "東京都", "count_only": "true"}).json() == {
+        "total": sum(p.prefecture == "東京都" for p in personas)
+    }
+
+@pytest.mark.parametrize("params", [{"fields": "id,password"}, {"limit": 0}, {"limit": main.PERSONA_PAGE_MAX + 1},
+                                    {"limit": 5, "cursor": "not-a-cursor"}])
+def test_invalid_queries_are_rejected(client, params):
+    assert client.get("/api/personas", params=params).status_code == 400
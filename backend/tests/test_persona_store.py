@@ -0,0 +1,104 @@
+import os
+import pytest
+from persona_store import PersonaStore, read_shared_meta
+
+FILTERS = [
+    {},
+    {"prefecture": "東京都"},
+    {"gender": "女性", "age_min": 30, "age_max": 39},
+    {"region": "関東", "income_min": 600},
+    {"employment_type": "regular", "commute_max": 20},
+    {"age_min": 70},
+    {"prefecture": "東京都", "gender": ""},
+    {"prefecture": "存在しない県"},
+]
+
+def _matches(p, f: dict) -> bool:
+    for field in ("prefecture", "region", "gender", "employment_type", "major_industry"):
+        if f.get(field) and getattr(p, field) != f[field]:
+            return False
+    for name, field in (("age", "age"), ("income", "annual_income"), ("commute", "commute_minutes")):
+        value = getattr(p, field)
+        if f.get(f"{name}_min") is not None and value < f[f"{name}_min"]:
+            return False
+        if f.get(f"{name}_max") is not None and value > f[f"{name}_max"]:
+            return False
+    return True
+
+@pytest.fixture
+def store(personas):
+    store = PersonaStore()
+    store.load(personas)
+    return store
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_query_matches_full_scan(store, personas, filters):
+    expected = [p.id for p in personas if _matches(p, filters)]
+    assert [p.id for p in store.query(**filters)] == expected
+
+def test_dict_api_and_projection(store, personas):
+    assert len(store) == len(personas)
+    first, last = personas[0], personas[-1]
+    assert store[first.id] == first
+    assert store.get("missing") is None and "missing" not in store
+    row = store.row_of(last.id)
+    assert row == len(personas) - 1 and store.id_at(row) == last.id
+    assert store.project([0, row], ("id", "age")) == [{"id": first.id, "age": first.age}, {"id": last.id, "age": last.age}]
+    assert sum(store.count_by("prefecture").values()) == len(personas)
+
+def test_replace_prefectures_keeps_order_of_others(store, personas):
+    replacement = [p.model_copy(update={"id": f"new_{i}", "age": 99}) for i, p in enumerate(personas) if p.prefecture == "大阪府"]
+    removed = store.replace_prefectures({"大阪府"}, replacement)
+    assert removed == [p.id for p in personas if p.prefecture == "大阪府"]
+    assert len(store) == len(personas)
+    others = [pid for pid in store.keys() if not pid.startswith("new_")]
+    assert others == [p.id for p in personas if p.prefecture != "大阪府"]
+    # インデックスも作り直している
+    assert [p.id for p in store.query(prefecture="大阪府")] == [p.id for p in replacement]
+    assert len(store.query(age_min=99)) == len(replacement)
+
+def test_shared_snapshot_round_trip(store, personas, tmp_dir):
+    path = os.path.join(tmp_dir, "personas.snap")
+    store.save_shared_snapshot(path, {"seed": 42})
+    assert read_shared_meta(path) == {"seed": 42}
+
+    shared = PersonaStore()
+    assert shared.open_shared(path) == {"seed": 42}
+    assert shared.shared and len(shared) == len(personas)
+    for filters in FILTERS:
+        assert shared.query_rows(**filters) == store.query_rows(**filters)
+    assert shared[personas[5].id] == personas[5]
+    assert shared.project(range(3)) == store.project(range(3))
+    assert shared.profile(personas[0].id) is None
+
+def test_reload_closes_previous_snapshot_once_readers_release_it(store, tmp_dir):
+    path = os.path.join(tmp_dir, "personas.snap")
+    store.save_shared_snapshot(path, {})
+    shared = PersonaStore()
+    shared.open_shared(path)
+    old = shared._snapshot
+    # 読み手がまだ旧スナップショットの配列（mmap 上の memoryview）を持っている
+    ages = old.array("num:age")
+
+    shared.open_shared(path)
+    assert not old.closed and old in shared._retired
+    # 閉じられなかったスナップショットはそのまま読める
+    assert old.row(0) == shared._snapshot.row(0)
+
+    ages.release()
+    shared.open_shared(path)
+    assert old.closed and old not in shared._retired
+
+def test_reload_waits_for_readers_of_the_current_snapshot(store, personas, tmp_dir):
+    path = os.path.join(tmp_dir, "personas.snap")
+    store.save_shared_snapshot(path, {})
+    shared = PersonaStore()
+    shared.open_shared(path)
+    # 別スレッドの読み手が読んでいる途中に再読み込みされる
+    with shared._pinned() as old:
+        shared.open_shared(path)
+        assert not old.closed and old.readers == 1
+        assert old.row(len(personas) - 1)[0] == personas[-1].id
+    # 読み終わったところで閉じる
+    assert old.closed and not shared._retired
+    assert shared.project([0], ("id",)) == [{"id": personas[0].id}]
@@ -0,0 +1,45 @@
+import gemini_client
+from gemini_client import PromptCache, build_system_prompt
+from lifelog_engine import generate_persona_profile
+
+def test_hits_match_a_fresh_build(personas):
+    cache = PromptCache(max_size=10)
+    p = personas[0]
+    profile = generate_persona_profile(p)
+    assert cache.get(p) == build_system_prompt(p)
+    assert cache.get(p, profile) == build_system_prompt(p, profile)
+    # プロファイルの有無は別キー
+    assert cache.get(p) == build_system_prompt(p) and cache.get(p, profile) != cache.get(p)
+    assert (cache.hits, cache.misses) == (3, 2)
+
+def test_lru_bound_and_invalidate(personas):
+    cache = PromptCache(max_size=3)
+    for p in personas[:3]:
+        cache.get(p)
+    cache.get(personas[0])          # 0 を最近使った側へ
+    cache.get(personas[3])          # 一番古い 1 が追い出される
+    assert cache.get_status()["size"] == 3
+    misses = cache.misses
+    cache.get(personas[0])
+    cache.get(personas[1])
+    assert cache.misses == misses + 1
+
+    cache.invalidate([personas[0].id])
+    cache.get(personas[0])
+    assert cache.misses == misses + 2
+    cache.invalidate()
+    assert cache.get_status()["size"] == 0
+
+def test_template_change_drops_old_entries(personas, monkeypatch):
+    cache = PromptCache()
+    cache.get(personas[0])
+    monkeypatch.setattr(gemini_client, "PROMPT_TEMPLATE_VERSION", "changed")
+    cache.get(personas[0])
+    assert cache.misses == 2 and cache.get_status()["size"] == 1
+
+def test_prompt_version_follows_the_prompt(personas):
+    p = personas[0]
+    profile = generate_persona_profile(p)
+    assert gemini_client.prompt_version(p) == gemini_client.prompt_version(p)
+    assert gemini_client.prompt_version(p) != gemini_client.prompt_version(p, profile)
+    assert gemini_client.prompt_version(p) != gemini_client.prompt_version(personas[1])
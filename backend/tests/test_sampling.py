@@ -0,0 +1,113 @@
+import json, math
+import pytest
+from collections import Counter
+from conftest import STATS_PATH, run
+from sampling import (
+    DIMENSIONS, UNCODED, SampleEstimator, code_answer, population_margins, rake_weights,
+    sample_order, sampled_ask_stream, stratum_of, wilson_interval,
+)
+
+OPTIONS = ["賛成", "どちらかといえば賛成", "反対"]
+
+@pytest.fixture(scope="module")
+def stats():
+    with open(STATS_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+def test_code_answer_picks_first_and_longest_option():
+    assert code_answer("反対です。理由は…", OPTIONS) == "反対"
+    # 同じ位置なら長い方（「賛成」より「どちらかといえば賛成」）
+    assert code_answer("どちらかといえば賛成。でも賛成しきれない", OPTIONS) == "どちらかといえば賛成"
+    # 先に出てきた方
+    assert code_answer("賛成か反対かで言えば", OPTIONS) == "賛成"
+    # 全角・半角や大文字小文字の違いは吸収する
+    assert code_answer("ＹＥＳ", ["yes", "no"]) == "yes"
+    assert code_answer("わかりません", OPTIONS) == UNCODED
+
+def test_wilson_interval_contains_estimate_and_narrows():
+    assert wilson_interval(0.5, 0) == (0.0, 1.0)
+    lo, hi = wilson_interval(0.3, 100)
+    assert 0.0 <= lo < 0.3 < hi <= 1.0
+    lo_big, hi_big = wilson_interval(0.3, 10000)
+    assert hi_big - lo_big < hi - lo
+    # 0% でも区間は潰れない
+    lo, hi = wilson_interval(0.0, 20)
+    assert lo == 0.0 and hi > 0.0
+
+def test_rake_weights_match_margins():
+    strata = [
+        ("東京都", "20s", "男性", "200_400"),
+        ("東京都", "60s", "女性", "400_600"),
+        ("大阪府", "20s", "女性", "200_400"),
+        ("大阪府", "60s", "男性", "400_600"),
+        ("大阪府", "60s", "女性", "200_400"),
+    ]
+    margins = {
+        "prefecture": {"東京都": 300.0, "大阪府": 100.0, "北海道": 50.0},
+        # 重み (120, 180, 40, 30, 30) から作った周辺分布（両立するので正確に合わせられる）
+        "age": {"20s": 16.0, "60s": 24.0},
+        "gender": {"男性": 15.0, "女性": 25.0},
+        "income": {"200_400": 19.0, "400_600": 21.0},
+    }
+    weights = rake_weights(strata, margins, iterations=500, tol=1e-9)
+    # 標本にない北海道は外れ、合計は標本の都道府県の人口にそろう
+    assert sum(weights) == pytest.approx(400.0)
+    expected = {"prefecture": {"東京都": 300.0, "大阪府": 100.0}, "age": {"20s": 160.0, "60s": 240.0},
+                "gender": {"男性": 150.0, "女性": 250.0}, "income": {"200_400": 190.0, "400_600": 210.0}}
+    for d, dim in enumerate(DIMENSIONS):
+        sums = Counter()
+        for s, w in zip(strata, weights):
+            sums[s[d]] += w
+        for cell, target in expected[dim].items():
+            assert sums[cell] == pytest.approx(target, rel=1e-4)
+    assert rake_weights([], margins) == []
+
+def test_sample_order_is_stratified_at_every_prefix(personas, stats):
+    order = sample_order(personas, stats, 100, seed=1)
+    assert len(order) == 100
+    assert len({p.id for p in order}) == 100
+    assert [p.id for p in sample_order(personas, stats, 100, seed=1)] == [p.id for p in order]
+
+    # サン＝ラグ方式なので、（県の候補が尽きるまでは）どこで切っても都道府県の人数は人口比の ±1 程度に収まる
+    pool = {p.prefecture for p in personas}
+    total = sum(stats[pref]["population"] for pref in pool)
+    for k in (20, 50):
+        counts = Counter(p.prefecture for p in order[:k])
+        for pref in pool:
+            assert abs(counts[pref] - k * stats[pref]["population"] / total) < 2.5
+
+    # 年齢帯も母集団の構成比から大きく外れない
+    margins = population_margins(stats, pool)
+    age_total = sum(margins["age"].values())
+    ages = Counter(stratum_of(p)[1] for p in order)
+    for band, v in margins["age"].items():
+        assert abs(ages[band] / len(order) - v / age_total) < 0.1
+
+def test_sample_estimator_shares_sum_to_one(personas, stats):
+    estimator = SampleEstimator(OPTIONS, population_margins(stats))
+    answers = ["賛成です", "反対", "どちらかといえば賛成かな", "うーん"]
+    for i, p in enumerate(personas[:40]):
+        estimator.add(p, answers[i % len(answers)])
+    result = estimator.estimate()
+    assert result["sampled"] == len(estimator) == 40
+    assert sum(e["share"] for e in result["estimates"]) == pytest.approx(1.0, abs=1e-3)
+    assert sum(e["count"] for e in result["estimates"]) == 40
+    assert {e["option"] for e in result["estimates"]} == set(OPTIONS) | {UNCODED}
+    assert 0 < result["effective_n"] <= 40
+    for e in result["estimates"]:
+        assert e["ci_low"] <= e["share"] <= e["ci_high"]
+
+def test_sampled_ask_stream_stops_at_sample_size(personas, stats, llm_backend):
+    async def scenario():
+        return [e async for e in sampled_ask_stream(
+            personas, stats, "消費税の引き上げに賛成ですか？", OPTIONS,
+            sample_size=12, min_sample=100, wave_size=5, use_cache=False,
+        )]
+    events = run(scenario())
+    done = events[-1]
+    assert done["type"] == "done"
+    assert done["stopped"] == "sample_size"
+    assert done["asked"] == done["answered"] == 12
+    assert sum(e["type"] == "progress" for e in events) == 12
+    # 波（5, 5, 2 人）ごとに推計を出す
+    assert sum(e["type"] == "estimate" for e in events) == math.ceil(12 / 5)
@@ -0,0 +1,127 @@
+import asyncio, os, time
+import pytest
+from conftest import run
+from rate_limiter import UsageTracker
+from shared_state import LocalRateLimitStore, RateLimits, RateLimitStore, SQLiteRateLimitStore, gcra_reserve
+
+MODEL = "gemini-test"
+
+@pytest.fixture(params=["local", "sqlite"])
+def store(request, tmp_dir):
+    if request.param == "local":
+        return LocalRateLimitStore()
+    return SQLiteRateLimitStore(os.path.join(tmp_dir, "rate_limits.sqlite3"))
+
+def test_gcra_reserve():
+    # 空いていれば今すぐ、TAT は interval 進む
+    assert gcra_reserve(0.0, 10.0, 2.0, 0.0) == (10.0, 12.0)
+    # TAT が先なら TAT まで待つ
+    assert gcra_reserve(12.0, 10.0, 2.0, 0.0) == (12.0, 14.0)
+    # 許容量の分だけ前倒しできる
+    assert gcra_reserve(12.0, 10.0, 2.0, 2.0) == (10.0, 14.0)
+    # cost 倍進む（TPM）
+    assert gcra_reserve(0.0, 10.0, 0.5, 0.0, cost=10) == (10.0, 15.0)
+
+def test_rate_limit_store_is_abstract():
+    with pytest.raises(TypeError):
+        RateLimitStore()
+
+    class Partial(RateLimitStore):
+        def now(self):
+            return 0.0
+
+    with pytest.raises(TypeError):
+        Partial()
+
+def test_reserve_spaces_requests_and_honours_burst(store):
+    limits = RateLimits(rpm=60, rpd=100, tpm=1_000_000)
+    assert store.reserve(MODEL, limits, 0) <= 0
+    assert store.reserve(MODEL, limits, 0) == pytest.approx(1.0, abs=0.05)
+
+    burst = RateLimits(rpm=60, rpd=100, tpm=1_000_000, rpm_burst=3)
+    delays = [store.reserve("burst", burst, 0) for _ in range(4)]
+    assert all(d <= 0 for d in delays[:3])
+    assert delays[3] > 0.9
+
+def test_tpm_reservation_and_adjust(store):
+    limits = RateLimits(rpm=100_000, rpd=100, tpm=600, rpm_burst=10)
+    # 1分ぶん（600 トークン）まではまとめて使える
+    assert store.reserve(MODEL, limits, 600) <= 0
+    # 超えると 1 トークン 0.1 秒の間隔に戻るまで待つ
+    assert store.reserve(MODEL, limits, 10) == pytest.approx(0.1, abs=0.05)
+    # 見積もりより 300 少なかったら返却 → すぐに使える
+    store.adjust_tokens(MODEL, limits, -300)
+    assert store.reserve(MODEL, limits, 10) <= 0
+
+def test_rpd_limit_and_refund(store):
+    limits = RateLimits(rpm=100_000, rpd=2, tpm=1_000_000)
+    assert store.reserve(MODEL, limits, 5) is not None
+    assert store.reserve(MODEL, limits, 5) is not None
+    started = store.mark_started(MODEL)
+    assert store.usage(MODEL, limits) == (2, 1)
+    assert store.reserve(MODEL, limits, 5) is None
+
+    store.refund(MODEL, limits, 5, started)
+    assert store.usage(MODEL, limits) == (1, 0)
+    assert store.reserve(MODEL, limits, 5) is not None
+
+def test_usage_of_unknown_model_does_not_create_state(store):
+    limits = RateLimits(rpm=60, rpd=100, tpm=1000)
+    assert store.models() == []
+    assert store.usage("unused", limits) == (0, 0)
+    if isinstance(store, SQLiteRateLimitStore):
+        assert store.models() == []
+    store.reserve(MODEL, limits, 0)
+    assert MODEL in store.models()
+
+def test_sqlite_store_is_shared_between_workers(tmp_dir):
+    path = os.path.join(tmp_dir, "rate_limits.sqlite3")
+    a, b = SQLiteRateLimitStore(path), SQLiteRateLimitStore(path)
+    limits = RateLimits(rpm=60, rpd=100, tpm=1_000_000)
+    assert a.reserve(MODEL, limits, 0) <= 0
+    # 別のワーカー（別の接続）の予約も同じ枠から取る
+    assert b.reserve(MODEL, limits, 0) == pytest.approx(1.0, abs=0.05)
+    b.mark_started(MODEL)
+    assert a.usage(MODEL, limits) == (2, 1)
+    assert a.models() == [MODEL]
+
+class _Tracker(UsageTracker):
+    RPM_LIMIT = 60
+    RPD_LIMIT = 100
+    TPM_LIMIT = 1_000_000
+
+def test_usage_tracker_refunds_cancelled_acquire(store):
+    tracker = _Tracker(MODEL, store)
+
+    async def scenario():
+        first = await tracker.acquire(MODEL, 10)
+        assert first.started_at is not None
+        # 2件目は GCRA で約1秒待つ。待っている間にキャンセルしたら返却される
+        task = asyncio.create_task(tracker.acquire(MODEL, 10))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.1)  # blocking なストアの返却はスレッドで行う
+        return tracker.usage_summary(MODEL)["requests_today"]
+
+    assert run(scenario()) == 1
+    # 返却したので RPM の待ちも戻っている（次はおよそ1秒後。2秒ではない）
+    assert store.reserve(MODEL, tracker._limits(MODEL), 0) < 1.0
+
+def test_sqlite_reads_do_not_wait_for_writers(tmp_dir):
+    path = os.path.join(tmp_dir, "rate_limits.sqlite3")
+    store, other = SQLiteRateLimitStore(path), SQLiteRateLimitStore(path)
+    limits = RateLimits(rpm=60, rpd=100, tpm=1_000_000)
+    store.reserve(MODEL, limits, 0)
+    # このプロセスの更新がロックを持ったまま、別のワーカーが書き込みトランザクションの途中
+    with store._lock:
+        writer = other._connect()
+        writer.execute("BEGIN IMMEDIATE")
+        try:
+            started = time.perf_counter()
+            assert store.usage(MODEL, limits) == (1, 0)
+            assert store.models() == [MODEL]
+            assert time.perf_counter() - started < 0.2
+        finally:
+            writer.execute("ROLLBACK")
@@ -0,0 +1,36 @@
+import asyncio, json, os, threading, time
+from conftest import run
+from stats_index import StatsIndex
+
+def _write(path: str, stats: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(stats, f, ensure_ascii=False)
+
+def test_reload_notifies_changed_prefectures_off_the_event_loop(tmp_dir):
+    path = os.path.join(tmp_dir, "stats.json")
+    _write(path, {"東京都": {"region": "関東", "population": 1}, "大阪府": {"region": "近畿", "population": 2}})
+    index = StatsIndex(path)
+    index.load()
+    calls = []
+
+    def slow_listener(changed):
+        # 母集団の作り直しのように重い通知先
+        time.sleep(0.3)
+        calls.append((changed, threading.current_thread() is threading.main_thread()))
+
+    index.subscribe(slow_listener)
+
+    async def scenario():
+        watcher = asyncio.create_task(index.watch(interval=0.01))
+        _write(path, {"東京都": {"region": "関東", "population": 3}, "大阪府": {"region": "近畿", "population": 2}})
+        # 通知先が動いている間もイベントループは止まらない
+        ticks, started = 0, time.perf_counter()
+        while not calls and time.perf_counter() - started < 5:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        watcher.cancel()
+        return ticks
+
+    assert run(scenario()) > 10
+    assert calls == [({"東京都"}, False)]
+    assert index.get("東京都")["population"] == 3 and index.by_region == {"関東": ["東京都"], "近畿": ["大阪府"]}
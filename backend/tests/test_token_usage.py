@@ -0,0 +1,66 @@
+import contextvars, time
+import pytest
+from conftest import run
+import gemini_client
+from llm_backends import FakeBackend
+from token_usage import TokenBudgetExceeded, TokenLedger, TokenMeter, attribute_usage, estimate_cost
+
+USAGE = {"prompt_tokens": 1000, "output_tokens": 100, "cached_tokens": 400, "thoughts_tokens": 50, "total_tokens": 1150}
+
+def test_estimate_cost():
+    # キャッシュ済み入力は安い単価、思考トークンは出力として数える
+    assert estimate_cost("gemini-2.5-flash", USAGE) == pytest.approx((600 * 0.30 + 400 * 0.075 + 150 * 2.50) / 1e6)
+    assert estimate_cost("unknown-model", USAGE) == 0.0
+
+def test_ledger_attribution_and_meter():
+    ledger, meter = TokenLedger(), TokenMeter(budget=2000)
+
+    def calls():
+        attribute_usage(endpoint="bulk-jobs", job_id="job1", meter=meter)
+        ledger.record("gemini-2.5-flash", USAGE, persona_ids=["a", "b"])
+        ledger.record("gemini-2.5-flash", USAGE, persona_ids=["a"])
+
+    # 帰属は contextvars なので、別のコンテキストで設定しても外には漏れない
+    contextvars.copy_context().run(calls)
+    ledger.record("gemini-2.0-flash", {"total_tokens": 10})
+    status = ledger.get_status()
+    assert status["total"]["calls"] == 3 and status["total"]["total_tokens"] == 2310
+    assert status["by_endpoint"]["bulk-jobs"]["calls"] == 2 and status["by_endpoint"]["other"]["calls"] == 1
+    assert status["by_job"]["job1"]["total_tokens"] == 2300
+    # 複数ペルソナの呼び出しは人数で按分
+    assert status["top_personas"] == [{"persona_id": "a", "total_tokens": 1725}, {"persona_id": "b", "total_tokens": 575}]
+    assert meter.used == 2300 and meter.exhausted
+    with pytest.raises(TokenBudgetExceeded):
+        meter.check()
+    TokenMeter(budget=None, used=10**9).check()
+
+def test_rolling_windows(monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(time, "time", lambda: now)
+    ledger = TokenLedger()
+    ledger.record("gemini-2.5-flash", USAGE)
+    now += 30
+    ledger.record("gemini-2.5-flash", USAGE)
+    assert ledger.get_status()["last_minute"]["calls"] == 2
+    now += 45
+    # 1件目は直近1分から外れ、直近24時間には残る
+    status = ledger.get_status()
+    assert (status["last_minute"]["calls"], status["last_day"]["calls"]) == (1, 2)
+    assert status["last_minute"]["total_tokens"] == 1150
+    now += 86400
+    status = ledger.get_status()
+    assert (status["last_minute"]["calls"], status["last_day"]["calls"], status["total"]["calls"]) == (0, 0, 2)
+
+def test_exhausted_budget_stops_calls_before_the_api(personas, monkeypatch):
+    backend = FakeBackend(latency="fixed:0", rate_429=0)
+    monkeypatch.setattr(gemini_client, "_backend", backend)
+
+    async def scenario():
+        attribute_usage(meter=TokenMeter(budget=1))
+        await gemini_client.ask_persona(personas[0], "q", "gemini-test")
+        # 予算を使い切ったので次は送らずに失敗する
+        with pytest.raises(TokenBudgetExceeded):
+            await gemini_client.ask_persona(personas[0], "q", "gemini-test")
+
+    run(scenario())
+    assert backend.calls == 1
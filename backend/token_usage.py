@@ -0,0 +1,160 @@
+"""
+トークン使用量・コストの記録
+- 呼び出しごとに usage_metadata（入力・出力・キャッシュ済み・思考トークン）を記録し、目安のコストを計算する
+- 帰属: エンドポイント・ペルソナ・一括質問ジョブ。エンドポイントとジョブは contextvars で呼び出し元から伝える
+  （attribute_usage() した後に作ったタスクにも引き継がれる）
+- 直近1分 / 直近24時間のローリング集計。時間バケットを足し引きするだけなので記録は O(1)
+- TokenMeter: 一括質問1回分の消費量。予算を超えたら以降の呼び出しを API に送らずに失敗させる
+"""
+import contextvars, time
+from collections import Counter, OrderedDict, deque
+
+# 100万トークンあたりの USD（入力, 出力, キャッシュ済み入力）。有料枠の公表価格で、無料枠では実際には課金されない
+MODEL_PRICES: dict[str, tuple[float, float, float]] = {
+    "gemini-2.5-pro": (1.25, 10.00, 0.31),
+    "gemini-2.5-flash": (0.30, 2.50, 0.075),
+    "gemini-2.5-flash-lite": (0.10, 0.40, 0.025),
+    "gemini-2.0-flash": (0.10, 0.40, 0.025),
+    "gemini-2.0-flash-lite": (0.075, 0.30, 0.019),
+}
+TOKEN_FIELDS = ("prompt_tokens", "output_tokens", "cached_tokens", "thoughts_tokens", "total_tokens")
+
+def estimate_cost(model: str, usage: dict) -> float:
+    price = MODEL_PRICES.get(model)
+    if price is None:
+        return 0.0
+    input_price, output_price, cached_price = price
+    cached = usage.get("cached_tokens", 0)
+    prompt = max(0, usage.get("prompt_tokens", 0) - cached)
+    output = usage.get("output_tokens", 0) + usage.get("thoughts_tokens", 0)
+    return (prompt * input_price + cached * cached_price + output * output_price) / 1_000_000
+
+class TokenBudgetExceeded(Exception):
+    pass
+
+class TokenMeter:
+    """1回の一括質問（またはジョブ）で使ったトークン数。budget=None なら無制限"""
+
+    def __init__(self, budget: int | None = None, used: int = 0):
+        self.budget = budget
+        self.used = used
+
+    @property
+    def exhausted(self) -> bool:
+        return self.budget is not None and self.used >= self.budget
+
+    def check(self):
+        if self.exhausted:
+            raise TokenBudgetExceeded(f"トークン予算（{self.budget}）を使い切りました")
+
+_scope: contextvars.ContextVar[dict] = contextvars.ContextVar("token_usage_scope", default={})
+
+def attribute_usage(**attrs):
+    """以降の呼び出しの帰属先を設定する（endpoint / job_id / meter）"""
+    _scope.set({**_scope.get(), **attrs})
+
+def current_meter() -> TokenMeter | None:
+    return _scope.get().get("meter")
+
+class _RollingWindow:
+    """bucket_seconds 秒単位のバケットを buckets 個持ち、その範囲の合計を保つ"""
+
+    def __init__(self, bucket_seconds: int, buckets: int):
+        self.bucket_seconds = bucket_seconds
+        self.span = buckets
+        self._buckets: deque[tuple[int, Counter]] = deque()
+        self.totals: Counter = Counter()
+
+    def _evict(self, index: int):
+        while self._buckets and self._buckets[0][0] <= index - self.span:
+            self.totals.subtract(self._buckets.popleft()[1])
+
+    def add(self, now: float, counts: dict):
+        index = int(now // self.bucket_seconds)
+        self._evict(index)
+        if not self._buckets or self._buckets[-1][0] != index:
+            self._buckets.append((index, Counter()))
+        self._buckets[-1][1].update(counts)
+        self.totals.update(counts)
+
+    def get(self, now: float) -> dict:
+        self._evict(int(now // self.bucket_seconds))
+        return _rounded(self.totals)
+
+def _rounded(counts: Counter) -> dict:
+    result = {k: int(counts.get(k, 0)) for k in ("calls", *TOKEN_FIELDS)}
+    result["cost_usd"] = round(counts.get("cost_usd", 0.0), 6)
+    return result
+
+class TokenLedger:
+    # ジョブ別の集計は直近のものだけ残す
+    MAX_JOBS = 200
+    TOP_PERSONAS = 10
+    # ペルソナ別は上位の表示用なので、当日（UTC）の分だけを最大 MAX_PERSONAS 人まで持つ。
+    # 超えたら多い順に半分だけ残す（母集団が大きくてもメモリが増え続けないように。下位の順位は近似になる）
+    MAX_PERSONAS = 2000
+
+    def __init__(self):
+        self.totals: Counter = Counter()
+        self.by_model: dict[str, Counter] = {}
+        self.by_endpoint: dict[str, Counter] = {}
+        self.by_job: OrderedDict[str, Counter] = OrderedDict()
+        self.by_persona: Counter = Counter()
+        self._persona_day = int(time.time() // 86400)
+        self.minute = _RollingWindow(1, 60)
+        self.day = _RollingWindow(60, 24 * 60)
+
+    def record(self, model: str, usage: dict, persona_ids: list[str] | tuple = ()):
+        counts = {k: usage.get(k, 0) for k in TOKEN_FIELDS}
+        counts["calls"] = 1
+        counts["cost_usd"] = estimate_cost(model, usage)
+        scope = _scope.get()
+
+        self.totals.update(counts)
+        self.by_model.setdefault(model, Counter()).update(counts)
+        self.by_endpoint.setdefault(scope.get("endpoint", "other"), Counter()).update(counts)
+        job_id = scope.get("job_id")
+        if job_id:
+            job = self.by_job.get(job_id)
+            if job is None:
+                job = self.by_job[job_id] = Counter()
+                while len(self.by_job) > self.MAX_JOBS:
+                    self.by_job.popitem(last=False)
+            job.update(counts)
+        now = time.time()
+        # 複数ペルソナをまとめた呼び出しは人数で按分する
+        if persona_ids:
+            self._add_personas(now, persona_ids, counts["total_tokens"] / len(persona_ids))
+        self.minute.add(now, counts)
+        self.day.add(now, counts)
+
+        meter = scope.get("meter")
+        if meter is not None:
+            meter.used += counts["total_tokens"]
+
+    def _add_personas(self, now: float, persona_ids, share: float):
+        day = int(now // 86400)
+        if day != self._persona_day:
+            self.by_persona.clear()
+            self._persona_day = day
+        for pid in persona_ids:
+            self.by_persona[pid] += share
+        if len(self.by_persona) > self.MAX_PERSONAS:
+            self.by_persona = Counter(dict(self.by_persona.most_common(self.MAX_PERSONAS // 2)))
+
+    def get_status(self) -> dict:
+        now = time.time()
+        return {
+            "total": _rounded(self.totals),
+            "last_minute": self.minute.get(now),
+            "last_day": self.day.get(now),
+            "by_model": {m: _rounded(c) for m, c in self.by_model.items()},
+            "by_endpoint": {e: _rounded(c) for e, c in self.by_endpoint.items()},
+            "by_job": {j: _rounded(c) for j, c in self.by_job.items()},
+            "top_personas": [
+                {"persona_id": pid, "total_tokens": int(tokens)}
+                for pid, tokens in self.by_persona.most_common(self.TOP_PERSONAS)
+            ],
+        }
+
+token_ledger = TokenLedger()
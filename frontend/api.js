@@ -22,10 +22,14 @@ async function wakeBackend({ onWaking, onReady } = {}) {
   return false; // 起動失敗
 }
 
-async function fetchPersonas(prefecture = null, region = null) {
+// fields: 返す項目の配列（省略時は全項目）/ limit, cursor: ページ送り（next_cursor を次の cursor に渡す）
+async function fetchPersonas(prefecture = null, region = null, { fields = null, limit = null, cursor = null } = {}) {
   const params = new URLSearchParams();
   if (prefecture) params.append('prefecture', prefecture);
   if (region) params.append('region', region);
+  if (fields) params.append('fields', fields.join(','));
+  if (limit) params.append('limit', limit);
+  if (cursor) params.append('cursor', cursor);
   const res = await fetch(`${API_BASE}/api/personas?${params}`);
   return res.json();
 }
@@ -94,6 +98,122 @@ async function sendInterview(personaId, message, history) {
   return res.json();
 }
 
+// SSEレスポンスを { event, data, id } 単位で読み出す
+async function* readSSE(res) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let event = 'message';
+  let id = null;
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop();
+    for (const raw of lines) {
+      const line = raw.trim();
+      if (line.startsWith('event:')) {
+        event = line.slice(6).trim();
+      } else if (line.startsWith('id:')) {
+        id = line.slice(3).trim();
+      } else if (line.startsWith('data:')) {
+        const data = line.slice(5).trim();
+        if (data) {
+          try { yield { event, data: JSON.parse(data), id }; } catch { }
+        }
+      } else if (!line) {
+        event = 'message';
+      }
+    }
+  }
+}
+
+// サーバー側で会話履歴を持つセッションを作る（history を渡すとその続きから）
+async function createInterviewSession(personaId, history = []) {
+  const res = await fetch(`${API_BASE}/api/interview/${encodeURIComponent(personaId)}/sessions`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ history }),
+  });
+  if (!res.ok) throw new Error(`セッションの作成に失敗しました (${res.status})`);
+  return res.json();
+}
+
+// インタビューのストリーミング版: delta（部分テキスト）→ done（使用量・終了理由）の順に返る
+// sessionId を指定した場合は history を送らない（履歴はサーバー側が保持）
+async function* streamInterview(personaId, message, history, sessionId = null) {
+  const body = sessionId ? { message, session_id: sessionId } : { message, history };
+  const res = await fetch(`${API_BASE}/api/interview/${encodeURIComponent(personaId)}/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+  if (!res.ok) {
+    const err = await res.json().catch(() => ({}));
+    const error = new Error(`サーバーエラー (${res.status}): ${err.detail || JSON.stringify(err)}`);
+    error.status = res.status;
+    throw error;
+  }
+  yield* readSSE(res);
+}
+
+// ── 一括質問ジョブ: サーバー側で実行され、切断しても再接続して続きから受け取れる ──
+async function createBulkJob(question, prefectureFilter) {
+  const body = { question };
+  if (prefectureFilter) body.prefecture_filter = prefectureFilter;
+  const res = await fetch(`${API_BASE}/api/bulk-jobs`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+  if (!res.ok) throw new Error(`ジョブの作成に失敗しました (${res.status})`);
+  return res.json();
+}
+
+async function fetchBulkJob(jobId) {
+  const res = await fetch(`${API_BASE}/api/bulk-jobs/${encodeURIComponent(jobId)}`);
+  if (!res.ok) return null;
+  return res.json();
+}
+
+// ジョブのイベントを done / error まで返す。接続が切れたら受信済みの次のイベントから再接続する
+// 再接続の間隔は 1秒, 2秒, 4秒…（最大30秒）。続けて FOLLOW_MAX_RETRIES 回つながらなければ例外を投げる
+// 待つ間は { event: 'reconnecting', data: { attempt, maxRetries, delayMs, error } } を返す（画面表示用）
+const FOLLOW_MAX_RETRIES = 8;
+
+async function* followBulkJob(jobId, lastEventId = 0) {
+  let failures = 0;
+  while (true) {
+    let error;
+    try {
+      const res = await fetch(`${API_BASE}/api/bulk-jobs/${encodeURIComponent(jobId)}/events?last_event_id=${lastEventId}`);
+      if (res.status === 404) throw new Error('ジョブが見つかりません');
+      if (!res.ok) throw new Error(`サーバーエラー (${res.status})`);
+      for await (const ev of readSSE(res)) {
+        failures = 0;
+        if (ev.id) lastEventId = Number(ev.id);
+        yield ev;
+        if (ev.event === 'done' || ev.event === 'error') return;
+      }
+      error = new Error('接続が切れました');
+    } catch (e) {
+      if (e.message === 'ジョブが見つかりません') throw e;
+      error = e;
+    }
+    failures += 1;
+    if (failures > FOLLOW_MAX_RETRIES) {
+      const e = new Error(`ジョブに再接続できませんでした（${error.message}）`);
+      e.retryable = true;
+      throw e;
+    }
+    const delayMs = Math.min(30000, 1000 * 2 ** (failures - 1));
+    yield { event: 'reconnecting', data: { attempt: failures, maxRetries: FOLLOW_MAX_RETRIES, delayMs, error: error.message }, id: null };
+    await new Promise(r => setTimeout(r, delayMs));
+  }
+}
+
 function streamBulkQuestion(question, prefectureFilter, onProgress, onDone, onError) {
   const params = new URLSearchParams({ question });
   if (prefectureFilter) params.append('prefecture_filter', prefectureFilter);
@@ -62,6 +62,18 @@ async function initBulk() {
     } catch (e) {
         console.error('初期化エラー:', e);
     }
+
+    // 実行中のジョブがあれば続きから表示する（タブを閉じた・再読み込みした場合）
+    const jobId = localStorage.getItem('bulkJobId');
+    if (jobId) {
+        const job = await fetchBulkJob(jobId).catch(() => null);
+        if (job && job.status === 'running') {
+            document.getElementById('question-input').value = job.question || '';
+            watchBulkJob(jobId);
+        } else {
+            localStorage.removeItem('bulkJobId');
+        }
+    }
 }
 
 async function startBulkQuestion() {
@@ -70,6 +82,19 @@ async function startBulkQuestion() {
     if (isRunning) return;
 
     const prefFilter = document.getElementById('pref-filter').value;
+    let job;
+    try {
+        job = await createBulkJob(question, prefFilter || null);
+    } catch (e) {
+        alert(e.message);
+        return;
+    }
+    localStorage.setItem('bulkJobId', job.job_id);
+    await watchBulkJob(job.job_id);
+}
+
+async function watchBulkJob(jobId) {
+    if (isRunning) return;
     isRunning = true;
     allResults = [];
 
@@ -99,9 +124,16 @@ async function startBulkQuestion() {
     const progressCount = document.getElementById('progress-count');
     const progressStatus = document.getElementById('progress-status');
 
+    let failure = null;
     try {
-        for await (const item of streamBulkQuestionFetch(question, prefFilter || null)) {
-            if (item.event === 'done' || item.total === undefined) continue;
+        for await (const { event, data } of followBulkJob(jobId)) {
+            if (event === 'error') throw new Error(data.error);
+            if (event === 'reconnecting') {
+                progressStatus.textContent = `⚠️ 接続が切れました（${data.error}）。${Math.round(data.delayMs / 1000)}秒後に再接続します（${data.attempt}/${data.maxRetries}）`;
+                continue;
+            }
+            if (event !== 'progress') continue;
+            const item = data;
 
             const pct = (item.completed / item.total * 100).toFixed(1);
             progressBar.style.width = pct + '%';
@@ -127,16 +159,19 @@ async function startBulkQuestion() {
             document.getElementById('result-count').textContent = allResults.length + '件';
         }
     } catch (e) {
-        progressStatus.textContent = `エラー: ${e.message}`;
+        failure = e;
         console.error(e);
     }
 
-    // 完了
+    // 完了（再接続できなかっただけならジョブはサーバーで続いているので、再読み込みで続きから受け取れるよう残す）
+    if (!failure || !failure.retryable) localStorage.removeItem('bulkJobId');
     clearInterval(timerInterval);
     const elapsed = (Date.now() - startTime) / 1000;
     document.getElementById('elapsed-time').textContent = formatTime(elapsed);
-    document.getElementById('remaining-time').textContent = '完了';
-    progressStatus.textContent = `✅ 全${allResults.length}人の回答が完了しました！`;
+    document.getElementById('remaining-time').textContent = failure ? '中断' : '完了';
+    progressStatus.textContent = failure
+        ? `❌ エラー: ${failure.message}${failure.retryable ? '（ページを再読み込みすると続きから受け取れます）' : ''}`
+        : `✅ 全${allResults.length}人の回答が完了しました！`;
     btn.disabled = false;
     document.getElementById('ask-btn-text').textContent = '📡 全員に質問する';
     isRunning = false;
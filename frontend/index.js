@@ -1,9 +1,13 @@
 // ダッシュボードページロジック
-let personaCache = {}; // prefecture -> [Persona]
+let personaCache = {}; // prefecture -> { personas: [カード用の項目だけ], total, nextCursor }
 let profileCache = {}; // persona_id -> PersonaProfile
 let selectedChip = null;
 let currentPersonaId = null;
 
+// 一覧カードに必要な項目だけ取得し、詳細はモーダルを開いたときに取得する
+const CARD_FIELDS = ['id', 'prefecture', 'age', 'gender', 'occupation', 'annual_income', 'household_type', 'political_leaning'];
+const PERSONA_PAGE_SIZE = 60;
+
 // ── 起動中バナー ──────────────────────────────────────────────────
 function showWakingBanner(attempt, max) {
   let banner = document.getElementById('waking-banner');
@@ -199,24 +203,51 @@ async function showPersonasForPref(pref) {
 
   // キャッシュがあれば再利用
   if (!personaCache[pref]) {
-    const data = await fetchPersonas(pref);
-    personaCache[pref] = data.personas;
+    const data = await fetchPersonas(pref, null, { fields: CARD_FIELDS, limit: PERSONA_PAGE_SIZE });
+    personaCache[pref] = { personas: data.personas, total: data.total, nextCursor: data.next_cursor };
   }
-  const personas = personaCache[pref];
+  renderPersonaGrid(pref);
+}
+
+function renderPersonaGrid(pref) {
+  const grid = document.getElementById('persona-grid');
+  const title = document.getElementById('panel-title');
+  const { personas, total, nextCursor } = personaCache[pref];
 
-  title.textContent = `${pref}在住のペルソナ（${personas.length}人）`;
+  title.textContent = `${pref}在住のペルソナ（${total}人）`;
   grid.innerHTML = '';
   personas.forEach(p => {
     const card = createPersonaCard(p);
     grid.appendChild(card);
   });
+  if (nextCursor) {
+    const more = document.createElement('button');
+    more.className = 'btn btn-sm';
+    more.textContent = `さらに表示（${personas.length}/${total}人）`;
+    more.onclick = () => loadMorePersonas(pref, more);
+    grid.appendChild(more);
+  }
+}
+
+async function loadMorePersonas(pref, button) {
+  const entry = personaCache[pref];
+  button.disabled = true;
+  try {
+    const data = await fetchPersonas(pref, null, { fields: CARD_FIELDS, limit: PERSONA_PAGE_SIZE, cursor: entry.nextCursor });
+    entry.personas = entry.personas.concat(data.personas);
+    entry.nextCursor = data.next_cursor;
+    if (selectedChip === pref) renderPersonaGrid(pref);
+  } catch (e) {
+    button.disabled = false;
+    console.error(e);
+  }
 }
 
 
 function createPersonaCard(p) {
   const div = document.createElement('div');
   div.className = 'persona-card';
-  div.onclick = () => openModal(p);
+  div.onclick = async () => openModal(await fetchPersona(p.id));
   div.innerHTML = `
     <div class="card-avatar">${getGenderEmoji(p.gender)}</div>
     <div class="card-name">${p.age}歳・${p.gender}</div>
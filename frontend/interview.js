@@ -3,6 +3,7 @@ let personaId = null;
 let persona = null;
 let personaProfile = null;
 let chatHistory = [];
+let sessionId = null;
 
 async function initInterview() {
   const params = new URLSearchParams(window.location.search);
@@ -127,14 +128,34 @@ async function sendMessage() {
   // タイピングインジケーター
   const typingEl = appendTyping();
 
+  // 返答はストリーミングで受け取り、届いた分から吹き出しに描画する
+  let bubble = null;
+  let answer = '';
   try {
-    const result = await sendInterview(personaId, text, chatHistory);
-    typingEl.remove();
-    appendMessage('persona', result.answer, getGenderEmoji(persona.gender));
+    for await (const { event, data } of streamInterviewTurn(text)) {
+      if (event === 'delta') {
+        if (!bubble) {
+          typingEl.remove();
+          bubble = appendMessage('persona', '', getGenderEmoji(persona.gender)).querySelector('.msg-bubble');
+        }
+        answer += data.text;
+        bubble.innerHTML = escapeHtml(answer).replace(/\n/g, '<br>');
+        const container = document.getElementById('chat-messages');
+        container.scrollTop = container.scrollHeight;
+      } else if (event === 'done') {
+        answer = data.answer || answer;
+      } else if (event === 'error') {
+        throw new Error(data.error);
+      }
+    }
+    if (!bubble) {
+      typingEl.remove();
+      appendMessage('persona', answer, getGenderEmoji(persona.gender));
+    }
 
     // 履歴に追加
     chatHistory.push({ role: 'user', content: text });
-    chatHistory.push({ role: 'model', content: result.answer });
+    chatHistory.push({ role: 'model', content: answer });
   } catch (e) {
     typingEl.remove();
     appendMessage('persona', `（エラーが発生しました: ${e.message}）`, '⚠️');
@@ -144,6 +165,18 @@ async function sendMessage() {
   input.focus();
 }
 
+// サーバー側セッションで1ターン送る。セッションが期限切れなら手元の履歴から作り直して送り直す
+async function* streamInterviewTurn(text) {
+  if (!sessionId) sessionId = (await createInterviewSession(personaId, chatHistory)).session_id;
+  try {
+    yield* streamInterview(personaId, text, [], sessionId);
+  } catch (e) {
+    if (e.status !== 404) throw e;
+    sessionId = (await createInterviewSession(personaId, chatHistory)).session_id;
+    yield* streamInterview(personaId, text, [], sessionId);
+  }
+}
+
 function appendMessage(role, text, avatarEmoji) {
   const container = document.getElementById('chat-messages');
   const notice = container.querySelector('.chat-notice');